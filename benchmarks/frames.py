@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# Copyright 2010-2025 Alexei Gilchrist
+#
+# This file is part of Nexus.
+#
+# Nexus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nexus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Frame times of panning, zooming and playing the transitions between views,
+drawing in software and with OpenGL.
+
+    python benchmarks/frames.py --stems 2000 --views 10 -o frames.json
+    python benchmarks/frames.py --map big.nex --mode opengl
+
+OpenGL needs a display. Without a GPU, Mesa's llvmpipe renderer can be used
+in a virtual X server:
+
+    LIBGL_ALWAYS_SOFTWARE=1 xvfb-run -a python benchmarks/frames.py
+
+With no display the offscreen platform is used, which has no OpenGL, so only
+software drawing is timed.
+'''
+
+import sys, os, time, json, shutil, tempfile, argparse, platform, statistics
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+if 'DISPLAY' not in os.environ and 'WAYLAND_DISPLAY' not in os.environ:
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6 import QtCore, QtWidgets
+from nexus import mainwindow, graphics
+import mkmap
+from suite import git_commit
+
+MODES = ['software', 'opengl']
+
+
+def frame(app, view):
+    '''
+    Draw the view now and return how long it took
+    '''
+    t = time.perf_counter()
+    view.viewport().repaint()
+    app.processEvents()
+    return time.perf_counter()-t
+
+
+def pan(app, view, frames):
+    times = []
+    bar = view.horizontalScrollBar()
+    step = max(1, view.viewport().width()//50)
+    for ii in range(frames):
+        # back and forth over the same part of the map
+        bar.setValue(bar.value()+(step if (ii//10) % 2 == 0 else -step))
+        times.append(frame(app, view))
+    return times
+
+
+def zoom(app, view, frames):
+    times = []
+    for ii in range(frames):
+        view.scaleView(1.1 if (ii//10) % 2 == 0 else 1/1.1)
+        times.append(frame(app, view))
+    return times
+
+
+def transitions(app, window, frames):
+    '''
+    Play the transitions between views in order, a frame for each step
+    '''
+    times = []
+    views = window.views.viewsModel.views
+    ii = 0
+    while len(views) > 1 and len(times) < frames:
+        window.jumpToView(views[ii % len(views)])
+        # step through ourselves rather than on the timer
+        window.viewtimer.stop()
+        for sides in window.viewsteps[:frames-len(times)]:
+            window.view.setViewSides(sides)
+            times.append(frame(app, window.view))
+        ii += 1
+    return times
+
+
+def summary(times):
+    if len(times) == 0:
+        return None
+    times = sorted(times)
+    return {'frames': len(times), 'mean': statistics.mean(times), 'median': statistics.median(times),
+            'p95': times[int(0.95*(len(times)-1))], 'worst': times[-1]}
+
+
+def run(app, mappath, modes, frames, size):
+    window = mainwindow.MainWindow(mappath)
+    window.resize(*size)
+    window.show()
+    app.processEvents()
+
+    print("{:10s} {:12s} {:>8s} {:>10s} {:>10s} {:>10s} {:>8s}".format(
+        'mode', '', 'frames', 'mean', 'p95', 'worst', 'fps'))
+    results = {}
+    for mode in modes:
+        if graphics.setOpenGLViewport(window.view, mode == 'opengl') != (mode == 'opengl'):
+            print("{:10s} not available".format(mode))
+            continue
+        app.processEvents()
+
+        results[mode] = {}
+        for name, fn in [('pan', lambda: pan(app, window.view, frames)),
+                         ('zoom', lambda: zoom(app, window.view, frames)),
+                         ('transitions', lambda: transitions(app, window, frames))]:
+            window.view.zoomAll()
+            frame(app, window.view)
+            r = summary(fn())
+            results[mode][name] = r
+            if r is None:
+                print("{:10s} {:12s} {:>8s}".format(mode, name, 'no views'))
+                continue
+            print("{:10s} {:12s} {:8d} {:8.2f}ms {:8.2f}ms {:8.2f}ms {:8.1f}".format(
+                mode, name, r['frames'], 1000*r['mean'], 1000*r['p95'], 1000*r['worst'], 1/r['mean']))
+
+    # not window.close(), that would save window settings and vacuum the map
+    window.hide()
+    window.scene.graph.connection.close(True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time drawing frames of a Nexus map in software and OpenGL.')
+    mkmap.add_arguments(parser)
+    parser.set_defaults(views=10)
+    parser.add_argument('--map', default=None, help='time an existing map instead (a copy is used)')
+    parser.add_argument('--mode', choices=MODES, action='append', default=[],
+                        help='only time this way of drawing (can be repeated)')
+    parser.add_argument('--frames', type=int, default=100, help='frames timed for each action (default 100)')
+    parser.add_argument('--size', type=int, nargs=2, default=[1920, 1080], metavar=('W', 'H'),
+                        help='window size (default 1920 1080)')
+    parser.add_argument('-o', '--output', default=None, help='JSON file to save results to')
+    args = parser.parse_args(argv)
+
+    app = mainwindow.NexusApplication()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        mappath = os.path.join(workdir, 'map.nex')
+        if args.map is None:
+            g = mkmap.make_map(mappath, **mkmap.map_options(args))
+            g.connection.close()
+            mapinfo = mkmap.map_options(args)
+        else:
+            shutil.copy(args.map, mappath)
+            mapinfo = {'path': str(Path(args.map).resolve())}
+
+        results = run(app, mappath, args.mode or MODES, args.frames, args.size)
+
+    commit, dirty = git_commit()
+    out = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'qt': QtCore.QT_VERSION_STR,
+        'qpa': QtWidgets.QApplication.platformName(),
+        'platform': platform.platform(),
+        'map': mapinfo,
+        'size': args.size,
+        'results': results,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(out, fp, indent=1)
+        print("Saved results to %s" % args.output)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
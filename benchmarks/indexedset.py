@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Copyright 2010-2025 Alexei Gilchrist
+#
+# This file is part of Nexus.
+#
+# Nexus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nexus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare graphydb.NSet against the previous list+dict IndexedSet.
+
+    python benchmarks/indexedset.py [N]
+'''
+
+import sys, time, functools, random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from nexus import graphydb
+
+
+class LegacyIndexedSet:
+    '''
+    The IndexedSet as it was before the ordered dict rewrite (trimmed to what is timed)
+    '''
+    def __init__(self, iterable=[]):
+        self._index = {n.__uid__():n for n in iterable}
+        self._list = list(iterable)
+        if len(self._list) != len(self._index.keys()):
+            self._list = list(self._index.values())
+
+    def __iter__(self):
+        return iter(self._list)
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, item):
+        uid = item.__uid__()
+        if uid in self._index:
+            current = self._index[uid]
+            self._index[uid] = item
+            idx = self._list.index(current)
+            self._list[idx] = item
+        else:
+            self._list.append(item)
+            self._index[uid]=item
+        return self
+
+    def remove(self, item):
+        uid = item.__uid__()
+        actualitem = self._index[uid]
+        self._list.remove(actualitem)
+        del self._index[uid]
+        return self
+
+    def discard(self, item):
+        uid = item.__uid__()
+        if uid in self._index:
+            actualitem = self._index[uid]
+            self._list.remove(actualitem)
+            del self._index[uid]
+        return self
+
+    def union(self, *others):
+        return functools.reduce(lambda x,y:x|y,others, self)
+    def intersection(self, *others):
+        return functools.reduce(lambda x,y:x&y,others, self)
+
+    def __and__(self, other):
+        keys = self._index.keys().__and__(other._index.keys())
+        return self.__class__(graphydb.conditionalyield(keys,self._index,other._index))
+    def __or__(self, other):
+        keys = self._index.keys().__or__(other._index.keys())
+        return self.__class__(graphydb.conditionalyield(keys, self._index, other._index))
+    def __sub__(self, other):
+        keys = self._index.keys().__sub__(other._index.keys())
+        return self.__class__(graphydb.conditionalyield(keys, self._index, other._index))
+
+    def filter(self, function):
+        out = self.__class__()
+        for item in self:
+            try:
+                if function(item):
+                    out.add(item)
+            except:
+                pass
+        return out
+
+
+def timeit(fn, repeat=3):
+    best = float('inf')
+    for ii in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter()-t)
+    return best
+
+
+def run(N=100000):
+    nodes = [graphydb.Node({'kind': 'Stem', 'i': i}, changed=False) for i in range(N)]
+    half = nodes[N//2:] + [graphydb.Node({'kind': 'Stem', 'i': -i}, changed=False) for i in range(N//2)]
+    # remove/overwrite a sample spread through the set, the legacy
+    # version is O(n) per call (with a full dict compare per item) so keep it small
+    sample = random.Random(1).sample(nodes, 20)
+
+    results = []
+    for name, cls in [('legacy', LegacyIndexedSet), ('NSet', graphydb.NSet)]:
+        A = cls(nodes)
+        B = cls(half)
+        r = {'impl': name}
+        r['create'] = timeit(lambda: cls(nodes))
+        r['union'] = timeit(lambda: A.union(B, B))
+        r['intersection'] = timeit(lambda: A.intersection(B, B))
+        r['difference'] = timeit(lambda: A-B)
+        r['filter'] = timeit(lambda: A.filter(lambda n: n['i'] % 2 == 0))
+
+        S = cls(nodes)
+        def removes():
+            for n in sample:
+                S.remove(n)
+        r['remove (per item)'] = timeit(removes, repeat=1)/len(sample)
+
+        copies = [graphydb.Node(dict(n.data), changed=False) for n in sample]
+        S = cls(nodes)
+        def overwrites():
+            for n in copies:
+                S.add(n)
+        r['add overwrite (per item)'] = timeit(overwrites, repeat=1)/len(sample)
+
+        def iterate():
+            for n in A:
+                pass
+        r['iterate'] = timeit(iterate)
+        results.append(r)
+
+    keys = [k for k in results[0] if k != 'impl']
+    print(f"{N} items{'':14s}" + ''.join(f"{r['impl']:>14s}" for r in results))
+    for k in keys:
+        print(f"{k:26s}" + ''.join(f"{r[k]*1000:12.4f}ms" for r in results))
+
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
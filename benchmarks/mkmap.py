@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# Copyright 2010-2025 Alexei Gilchrist
+#
+# This file is part of Nexus.
+#
+# Nexus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nexus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Generate synthetic maps for benchmarking.
+
+    python benchmarks/mkmap.py out.nex --stems 5000 --depth 6 --fanout 5 \\
+        --strokes 2 --words 12 --images 50 --views 20
+
+Stems are added breadth first, each getting up to fanout children until
+there are the requested number or the tree is depth deep. The same seed
+always gives the same map.
+'''
+
+import sys, math, random, hashlib, argparse, os
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6 import QtGui
+from nexus import nexusgraph, graphydb, graphics
+
+WORDS = '''lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod
+tempor incididunt ut labore et dolore magna aliqua ut enim ad minim veniam quis
+nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat'''.split()
+
+IDENTITY = [1, 0, 0, 0, 1, 0, 0, 0, 1]
+
+# distinct images shared between the stems with images
+DISTINCTIMAGES = 4
+
+
+def stroke(rnd, points=60):
+    '''
+    A wiggly pen stroke with pressure
+    '''
+    out = []
+    x = y = 0.0
+    angle = rnd.uniform(0, 2*math.pi)
+    for ii in range(points):
+        angle += rnd.gauss(0, 0.4)
+        x += 0.8*math.cos(angle)
+        y += 0.8*math.sin(angle)
+        out.append([round(x, 2), round(y, 2), round(0.3+0.4*rnd.random(), 2)])
+    return out
+
+
+def image_data(rnd, width=800, height=600):
+    '''
+    Return (encoded data, sha1) of a random blocky image
+    '''
+    image = QtGui.QImage(width, height, QtGui.QImage.Format.Format_RGB32)
+    image.fill(QtGui.QColor('white'))
+    painter = QtGui.QPainter(image)
+    for ii in range(200):
+        painter.fillRect(rnd.randrange(width), rnd.randrange(height), rnd.randrange(width//4),
+                         rnd.randrange(height//4), QtGui.QColor(rnd.randrange(1 << 24)))
+    painter.end()
+    data = nexusgraph.ImageToData(image)
+    return data, hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def make_map(path, stems=1000, depth=6, fanout=4, strokes=1, words=6, images=0, views=0, seed=1):
+    '''
+    Write a synthetic map to path (which shouldn't exist) and return the
+    NexusGraph. images is the number of stems with an image.
+    '''
+    rnd = random.Random(seed)
+    g = nexusgraph.NexusGraph(str(path))
+
+    imagenodes = []
+    if images > 0:
+        for ii in range(min(images, DISTINCTIMAGES)):
+            data, sha1 = image_data(rnd)
+            imagenodes.append(g.Node('ImageData', data=data, sha1=sha1).save(setchange=False))
+
+    def content(n):
+        items = {}
+        text = ' '.join(rnd.choice(WORDS) for ii in range(words)) or 'stem %d' % n
+        items[graphydb.generateUUID()] = {'kind': 'Text', 'source': '<p>%s</p>' % text,
+                                          'frame': IDENTITY, 'z': 0}
+        for ii in range(strokes):
+            items[graphydb.generateUUID()] = {'kind': 'Stroke', 'stroke': nexusgraph.StrokeToData(stroke(rnd)),
+                                              'type': 'XYZ', 'width': 1.3, 'color': '#000080', 'opacity': 1.0,
+                                              'frame': [1, 0, 0, 0, 1, 0, 0, -8-4*ii, 1], 'z': 1+ii}
+        return items
+
+    root = g.Node('Root').save(setchange=False)
+    base = g.Node('Stem', pos=[0, 0], flip=1, scale=1.0, z=0, content=content(0)).save(setchange=False)
+    g.Edge(root, 'Child', base).save(setchange=False)
+
+    level = [base]
+    allstems = [base]
+    for d in range(1, depth):
+        following = []
+        for parent in level:
+            for ii in range(fanout):
+                if len(allstems) >= stems:
+                    break
+                # spread the children out around their parent
+                angle = math.pi*(ii+0.5)/fanout-math.pi/2
+                r = 120 if d == 1 else 60
+                stem = g.Node('Stem', pos=[r*math.cos(angle), r*math.sin(angle)], flip=1,
+                              scale=1.0 if d == 1 else 0.85, z=0,
+                              content=content(len(allstems))).save(setchange=False)
+                g.Edge(parent, 'Child', stem).save(setchange=False)
+                following.append(stem)
+                allstems.append(stem)
+        level = following
+        if len(level) == 0 or len(allstems) >= stems:
+            break
+
+    if len(allstems) < stems:
+        print("Only %d stems fit in depth %d with fanout %d" % (len(allstems), depth, fanout), file=sys.stderr)
+
+    for ii, stem in enumerate(rnd.sample(allstems, min(images, len(allstems)))):
+        datanode = imagenodes[ii % len(imagenodes)]
+        items = dict(stem['content'])
+        items[graphydb.generateUUID()] = {'kind': 'Image', 'sha1': datanode['sha1'], 'z': 5,
+                                          'frame': [0.05, 0, 0, 0, 0.05, 0, 0, 0, 1]}
+        stem['content'] = items
+        stem.save(setchange=False)
+        g.Edge(stem, 'With', datanode).save(setchange=False)
+
+    previous = None
+    for ii in range(views):
+        x, y = rnd.uniform(-300, 300), rnd.uniform(-300, 300)
+        w = rnd.uniform(100, 600)
+        view = g.Node('View', left=[x-w/2, y], right=[x+w/2, y]).save(setchange=False)
+        if previous is not None:
+            g.Edge(previous, 'Transition', view).save(setchange=False)
+        previous = view
+
+    g.savesetting('version', graphics.VERSION)
+    return g
+
+
+def add_arguments(parser):
+    parser.add_argument('--stems', type=int, default=1000, help='number of stems (default 1000)')
+    parser.add_argument('--depth', type=int, default=6, help='maximum depth of the tree (default 6)')
+    parser.add_argument('--fanout', type=int, default=4, help='children per stem (default 4)')
+    parser.add_argument('--strokes', type=int, default=1, help='pen strokes per stem (default 1)')
+    parser.add_argument('--words', type=int, default=6, help='words of text per stem (default 6)')
+    parser.add_argument('--images', type=int, default=0, help='number of stems with an image (default 0)')
+    parser.add_argument('--views', type=int, default=0, help='number of views (default 0)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+
+
+def map_options(args):
+    return {k: getattr(args, k) for k in ('stems', 'depth', 'fanout', 'strokes', 'words', 'images', 'views', 'seed')}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic Nexus map.')
+    parser.add_argument('path', help='.nex file to write')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if Path(args.path).exists():
+        parser.error('%s already exists' % args.path)
+    g = make_map(args.path, **map_options(args))
+    print("%s: %d stems" % (args.path, g.fetch('[n:Stem]', COUNT=True)))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Copyright 2010-2025 Alexei Gilchrist
+#
+# This file is part of Nexus.
+#
+# Nexus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nexus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Check text comes out the same size in PDFs whatever their dpi.
+
+    python benchmarks/pdftext.py --dpi 150 --dpi 1200
+
+A map of text is exported to PDF at 96 dpi (the dpi leaf text is laid out
+at on screen) and at each --dpi. The pages are rendered to images of the
+same size and compared, and the exit status is 1 if more than --threshold
+of the pixels differ.
+'''
+
+import sys, os, tempfile, argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6 import QtCore, QtGui, QtPdf
+from nexus import export
+import mkmap
+
+# screen dpi, what leaf text is recorded at
+BASEDPI = 96
+
+
+def page_image(path, width):
+    '''
+    The first page of the PDF at path rendered width pixels wide
+    '''
+    doc = QtPdf.QPdfDocument(None)
+    doc.load(str(path))
+    size = doc.pagePointSize(0)
+    image = doc.render(0, QtCore.QSize(width, round(width*size.height()/size.width())))
+    doc.close()
+    return image.convertToFormat(QtGui.QImage.Format.Format_Grayscale8)
+
+
+def differing(a, b, tolerance=64):
+    '''
+    Fraction of pixels differing by more than tolerance grey levels
+    '''
+    pa, pb = a.constBits(), b.constBits()
+    pa.setsize(a.sizeInBytes())
+    pb.setsize(b.sizeInBytes())
+    pa, pb = bytes(pa), bytes(pb)
+    n = sum(1 for x, y in zip(pa, pb) if abs(x-y) > tolerance)
+    return n/len(pa)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check PDF text size at different dpi.')
+    mkmap.add_arguments(parser)
+    parser.set_defaults(stems=20, strokes=0, words=12)
+    parser.add_argument('--dpi', type=int, action='append', default=[],
+                        help='dpi to check against %d (can be repeated, default 150 and 1200)' % BASEDPI)
+    parser.add_argument('--width', type=int, default=1200, help='width of the compared images (default 1200)')
+    parser.add_argument('--threshold', type=float, default=0.01,
+                        help='fraction of pixels allowed to differ (default 0.01)')
+    args = parser.parse_args(argv)
+
+    export._init_worker()
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        mappath = os.path.join(workdir, 'map.nex')
+        g = mkmap.make_map(mappath, **mkmap.map_options(args))
+        g.connection.close()
+        scene = export.load_scene(mappath)
+
+        images = {}
+        for dpi in [BASEDPI]+(args.dpi or [150, 1200]):
+            pdfpath = os.path.join(workdir, 'map%d.pdf' % dpi)
+            export.export_pdf(scene, pdfpath, dpi=dpi)
+            images[dpi] = page_image(pdfpath, args.width)
+
+        for dpi, image in images.items():
+            if dpi == BASEDPI:
+                continue
+            fraction = differing(images[BASEDPI], image)
+            ok = fraction <= args.threshold
+            failed += not ok
+            print("{:6d} dpi {:8.2%} of pixels differ from {} dpi{}".format(
+                dpi, fraction, BASEDPI, '' if ok else '  FAILED'))
+
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+#
+# Copyright 2010-2025 Alexei Gilchrist
+#
+# This file is part of Nexus.
+#
+# Nexus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nexus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Time the expensive operations on a synthetic map (see mkmap.py), headless.
+
+    python benchmarks/suite.py --stems 2000 --images 20 -o before.json
+    ... change things ...
+    python benchmarks/suite.py --stems 2000 --images 20 --compare before.json
+
+Results are saved as JSON with the commit they were run on. With --compare
+each timing is shown against the earlier run and slowdowns of more than
+--threshold are flagged. Only run benchmarks matching -k by giving part of
+their names.
+'''
+
+import sys, os, time, json, shutil, tempfile, argparse, platform, subprocess, statistics, random, math
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6 import QtCore
+from nexus import mainwindow, graphics, graphydb
+import mkmap
+
+FETCHES = [
+    ('all stems', ('[n:Stem]',), {}),
+    ('root children', ('(r:Root) -(e:Child)> [n:Stem]',), {}),
+    ('child pairs', ('(n:Stem) -(e:Child)> [m:Stem]',), {}),
+    ('stems by data', ('[n:Stem]', 'n.data.scale < 0.9'), {}),
+    ('count stems', ('[n:Stem]',), {'COUNT': True}),
+    ('views', ('[n:View]',), {}),
+]
+
+
+def timed(fn, setup=None, repeat=5):
+    '''
+    Run fn(setup()) repeat times, return the list of times (not counting setup)
+    '''
+    times = []
+    for ii in range(repeat):
+        arg = setup() if setup is not None else None
+        t = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter()-t)
+    return times
+
+
+def raw_stroke(rnd, points=400):
+    '''
+    Pen input as it arrives: x, y, pressure, time
+    '''
+    out = []
+    x = y = 0.0
+    angle = 0.0
+    for ii in range(points):
+        angle += rnd.gauss(0, 0.2)
+        x += math.cos(angle)+rnd.gauss(0, 0.1)
+        y += math.sin(angle)+rnd.gauss(0, 0.1)
+        out.append([x, y, 0.5+0.2*rnd.random(), ii*0.005])
+    return out
+
+
+#----------------------------------------------------------------------
+class Suite:
+#----------------------------------------------------------------------
+
+    def __init__(self, mappath, workdir, repeat=5, select=None):
+        self.mappath = mappath
+        self.workdir = Path(workdir)
+        self.repeat = repeat
+        self.select = select or []
+        self.results = {}
+        self.copies = 0
+
+    def copy(self):
+        '''
+        A fresh copy of the map so benchmarks don't see each other's changes
+        '''
+        self.copies += 1
+        path = self.workdir.joinpath('map%03d.nex' % self.copies)
+        shutil.copy(self.mappath, path)
+        return str(path)
+
+    def run(self, name, fn, setup=None, repeat=None):
+        if len(self.select) > 0 and not any(s in name for s in self.select):
+            return
+        times = timed(fn, setup, repeat or self.repeat)
+        self.results[name] = {'best': min(times), 'median': statistics.median(times), 'runs': times}
+        print("{:32s} {:10.2f}ms {:10.2f}ms".format(name, 1000*min(times), 1000*statistics.median(times)))
+
+    def all(self):
+        print("{:32s} {:>12s} {:>12s}".format('', 'best', 'median'))
+
+        # a window on its own copy of the map, as the app would have
+        window = mainwindow.MainWindow(self.copy())
+        scene = window.scene
+        g = scene.graph
+
+        self.run('loadMap', lambda a: window.loadMap(self.copy()), repeat=3)
+        self.run('StemItem.renew', lambda a: scene.root().renew())
+        self.run('StemItem.renew (no reload)', lambda a: scene.root().renew(reload=False))
+
+        for name, args, kwargs in FETCHES:
+            self.run('fetch: '+name, lambda a: g.fetch(*args, **kwargs))
+        self.run('iterfetch: all stems', lambda a: sum(1 for n in g.iterfetch('[n:Stem]')))
+
+        rnd = random.Random(1)
+        strokes = [raw_stroke(rnd) for ii in range(50)]
+        self.run('smoothInkPath (50 strokes)', lambda a: [graphics.smoothInkPath(s) for s in strokes])
+
+        svgpath = str(self.workdir.joinpath('map.svg'))
+        self.run('exportSVG', lambda a: mainwindow.export_svg(scene, svgpath), repeat=3)
+
+        # copy and paste the biggest subtree below the base stem
+        base = scene.root()
+        subtree = max(base.childStems2, key=lambda s: len(s.allChildStems()), default=base)
+        nodes = graphydb.NSet([subtree.node])
+        self.run('copyTrees', lambda a: g.copyTrees(nodes))
+        copydata = g.copyTrees(nodes)
+
+        def paste(a=None):
+            batch = graphydb.generateUUID()
+            for data in copydata.nodes:
+                scene.recursivePaste(base.node, data, copydata.images, batch)
+
+        def pasted():
+            # paste and return the new child of the base stem
+            before = {n['uid'] for n in base.node.outN('n.kind="Stem"')}
+            paste()
+            return next(n for n in base.node.outN('n.kind="Stem"') if n['uid'] not in before)
+
+        self.run('recursivePaste', paste)
+        self.run('undo (paste)', lambda a: g.undo(), setup=paste)
+        self.run('deleteOutFromNodes', lambda a: g.deleteOutFromNodes(graphydb.NSet([a]), setchange=True),
+                 setup=pasted)
+        self.run('undo (delete)', lambda a: g.undo(),
+                 setup=lambda: g.deleteOutFromNodes(graphydb.NSet([pasted()]), setchange=True))
+
+        # not window.close(), that would save window settings and vacuum the copy
+        window.hide()
+        g.connection.close(True)
+        return self.results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip() != ''
+        return commit, dirty
+    except OSError:
+        return None, None
+
+
+def compare(results, previous, threshold):
+    print()
+    print("{:32s} {:>12s} {:>12s} {:>8s}".format('compared to %s' % (previous.get('commit') or '?')[:10],
+                                                  'before', 'now', 'ratio'))
+    regressions = 0
+    for name, r in results.items():
+        if name not in previous['results']:
+            continue
+        before = previous['results'][name]['best']
+        ratio = r['best']/before if before > 0 else float('inf')
+        flag = ''
+        if ratio > 1+threshold:
+            flag = '  SLOWER'
+            regressions += 1
+        elif ratio < 1-threshold:
+            flag = '  faster'
+        print("{:32s} {:10.2f}ms {:10.2f}ms {:8.2f}{}".format(name, 1000*before, 1000*r['best'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Nexus on a synthetic map.')
+    mkmap.add_arguments(parser)
+    parser.add_argument('--map', default=None, help='benchmark an existing map instead')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='times to run each benchmark (default 5)')
+    parser.add_argument('-k', dest='select', action='append', default=[],
+                        help='only run benchmarks with this in their name (can be repeated)')
+    parser.add_argument('-o', '--output', default=None, help='JSON file to save results to')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction slower to count as a regression (default 0.1)')
+    args = parser.parse_args(argv)
+
+    app = mainwindow.NexusApplication()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.map is None:
+            mappath = os.path.join(workdir, 'synthetic.nex')
+            t = time.perf_counter()
+            g = mkmap.make_map(mappath, **mkmap.map_options(args))
+            g.connection.close()
+            print("Generated map in %.2fs" % (time.perf_counter()-t))
+            mapinfo = mkmap.map_options(args)
+        else:
+            mappath = args.map
+            mapinfo = {'path': str(Path(args.map).resolve())}
+
+        results = Suite(mappath, workdir, args.repeat, args.select).all()
+
+    commit, dirty = git_commit()
+    out = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'qt': QtCore.QT_VERSION_STR,
+        'platform': platform.platform(),
+        'map': mapinfo,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(out, fp, indent=1)
+        print("Saved results to %s" % args.output)
+
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            previous = json.load(fp)
+        if previous.get('map') != mapinfo:
+            print("Warning: %s was run on a different map %s" % (args.compare, previous.get('map')))
+        if compare(results, previous, args.threshold) > 0:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
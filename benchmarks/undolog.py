@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+# Copyright 2010-2025 Alexei Gilchrist
+#
+# This file is part of Nexus.
+#
+# Nexus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nexus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Size of the undo log over an editing session, with graphydb.diff against the
+previous diff that stored whole top level values.
+
+    python benchmarks/undolog.py --stems 200 --strokes 20 --edits 100
+
+The session is a mix of the edits made while working on a map: pen strokes
+added and erased, text changed and stems moved. Each is saved the way the
+app saves it. The session is then undone and the map checked against how
+it started (only when it fits in the undo log, see Graph.deleteoldchanges).
+'''
+
+import sys, os, time, random, tempfile, argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from nexus import mainwindow, nexusgraph, graphydb
+import mkmap
+
+# as many as Graph.deleteoldchanges keeps
+UNDOKEEP = 100
+
+
+def legacy_diff(d1, d2, changedkeys):
+    '''
+    graphydb.diff as it was before nested diffs, changed keys store their whole values
+    '''
+    remove = {}
+    add = {}
+    for k in d1.keys()|d2.keys():
+        if k[0] == '_':
+            continue
+        elif k in changedkeys:
+            if k not in d2:
+                remove[k] = d1[k]
+            elif k not in d1:
+                add[k] = d2[k]
+            elif d1[k] != d2[k]:
+                remove[k] = d1[k]
+                add[k] = d2[k]
+
+    if len(remove) == 1 and 'mtime' in remove and len(add) == 1 and 'mtime' in add:
+        remove = {}
+        add = {}
+
+    change = {}
+    if len(add) > 0:
+        change['+'] = add
+    if len(remove) > 0:
+        change['-'] = remove
+    return change
+
+
+def edit(rnd, stem):
+    '''
+    Make a random edit to the content or placement of stem, return its name
+    '''
+    content = stem['content']
+    strokes = [k for k, v in content.items() if v['kind'] == 'Stroke']
+    texts = [k for k, v in content.items() if v['kind'] == 'Text']
+    kind = rnd.choices(['stroke', 'erase', 'text', 'move'], [6, 2, 1, 1])[0]
+
+    if kind == 'erase' and len(strokes) > 0:
+        del content[rnd.choice(strokes)]
+        stem.keyChanged('content')
+    elif kind == 'text' and len(texts) > 0:
+        item = content[rnd.choice(texts)]
+        item['source'] = item['source'].replace('</p>', ' %s</p>' % rnd.choice(mkmap.WORDS))
+        stem.keyChanged('content')
+    elif kind == 'move':
+        x, y = stem['pos']
+        stem['pos'] = [x+rnd.uniform(-20, 20), y+rnd.uniform(-20, 20)]
+    else:
+        # as InkView.penReleaseEvent adds a stroke
+        kind = 'stroke'
+        content[graphydb.generateUUID()] = {
+            'kind': 'Stroke', 'stroke': nexusgraph.StrokeToData(mkmap.stroke(rnd)), 'type': 'XYZ',
+            'width': 1.3, 'color': '#000080', 'opacity': 1.0,
+            'frame': [1, 0, 0, 0, 1, 0, rnd.uniform(-50, 50), rnd.uniform(-50, 50), 1], 'z': 1+len(content)}
+        stem.keyChanged('content')
+
+    stem.save(setchange=True)
+    return kind
+
+
+def session(path, edits, seed):
+    '''
+    Run the editing session on the map at path, return (bytes of each change, seconds saving)
+    '''
+    rnd = random.Random(seed)
+    g = nexusgraph.NexusGraph(path)
+    stems = [n['uid'] for n in g.fetch('[n:Stem]')]
+    start = {n['uid']: graphydb.cleandata(n.data) for n in g.fetch('[n:Stem]')}
+
+    sizes = []
+    saving = 0.0
+    cursor = g.cursor()
+    for ii in range(edits):
+        stem = g.getuid(rnd.choice(stems))
+        t = time.perf_counter()
+        edit(rnd, stem)
+        saving += time.perf_counter()-t
+        row = cursor.execute('SELECT change FROM changes ORDER BY id DESC LIMIT 1').fetchall()
+        sizes.append(len(row[0][0]))
+
+    restored = None
+    if edits <= UNDOKEEP:
+        while g.countchanges() > 0:
+            g.undo()
+        restored = start == {n['uid']: graphydb.cleandata(n.data) for n in g.fetch('[n:Stem]')}
+
+    g.connection.close(True)
+    return sizes, saving, restored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Size of the undo log over an editing session.')
+    mkmap.add_arguments(parser)
+    parser.set_defaults(stems=200, strokes=20)
+    parser.add_argument('--edits', type=int, default=UNDOKEEP, help='edits in the session (default %d)' % UNDOKEEP)
+    args = parser.parse_args(argv)
+
+    app = mainwindow.NexusApplication()
+
+    print("{:10s} {:>12s} {:>12s} {:>12s} {:>10s}".format('diff', 'log bytes', 'mean', 'largest', 'saving'))
+    with tempfile.TemporaryDirectory() as workdir:
+        mappath = os.path.join(workdir, 'map.nex')
+        g = mkmap.make_map(mappath, **mkmap.map_options(args))
+        g.connection.close()
+
+        results = {}
+        current = graphydb.diff
+        for name, fn in [('top level', legacy_diff), ('nested', current)]:
+            copy = os.path.join(workdir, 'session.nex')
+            with open(mappath, 'rb') as src, open(copy, 'wb') as dst:
+                dst.write(src.read())
+            # _changerecord looks diff up in graphydb when called
+            graphydb.diff = fn
+            try:
+                sizes, saving, restored = session(copy, args.edits, args.seed)
+            finally:
+                graphydb.diff = current
+            os.remove(copy)
+            results[name] = sum(sizes)
+            print("{:10s} {:12d} {:12.0f} {:12d} {:8.1f}ms{}".format(
+                name, sum(sizes), sum(sizes)/len(sizes), max(sizes), 1000*saving,
+                '' if restored is None else '  undo ok' if restored else '  UNDO FAILED'))
+
+    print("nested diffs are %.1fx smaller" % (results['top level']/max(1, results['nested'])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,7 +7,7 @@ a = Analysis(
     ['../../../runnexus.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('../../../nexus/resources.rcc', 'nexus')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -55,6 +55,12 @@ default_config = {
     # max cartesian distance error to tolerate
     "pen_simplify_tolerance": 0.1,
 
+    # Eraser
+    # radius in view pixels, "stroke" erases whole strokes, "split" only
+    # the parts touched
+    "eraser_radius": 4,
+    "eraser_mode": "stroke",
+
     # Default scaling for child stems
     "child_scale": 0.5,
 
@@ -101,10 +107,44 @@ default_config = {
     # Icon size
     #
     "icon_size": 26,
+
+    #
+    # Virtual scene
+    # Maps with at least this many stems only build the stems near the view,
+    # the rest are kept as outlines (0 = always, -1 = never)
+    #
+    "virtual_scene_stems": 2000,
+    "virtual_scene_margin": 400, # view pixels around the view to build
+    "virtual_scene_budget": 1500, # built stems kept before releasing off screen ones
+
+    #
+    # Item caches
+    # Leaf content at least this complex (~path elements) is drawn from a cached
+    # pixmap, all the caches share the memory limit (in MB)
+    #
+    "item_cache": True,
+    "item_cache_min_complexity": 200,
+    "item_cache_limit": 64,
+
+    #
+    # OpenGL
+    # Draw the map and the input dialog through OpenGL rather than the
+    # software raster engine, can also be switched in the View menu
+    #
+    "opengl_viewport": False,
+    "opengl_samples": 4, # multisampling for antialiasing
 }
 
 
+_config = None
+
 def get_config():
+    '''
+    Return the config dict. The user config files are only read on the first call.
+    '''
+    global _config
+    if _config is not None:
+        return _config
 
     config = default_config.copy()
 
@@ -122,4 +162,5 @@ def get_config():
             mod = SourceFileLoader("", c.as_posix()).load_module()
             config.update(mod.config)
 
+    _config = config
     return config
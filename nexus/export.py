@@ -0,0 +1,431 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Export maps without the GUI.
+
+    python -m nexus.export --format pdf,png --views -o handouts/ lectures/*.nex
+
+Each map is loaded and exported in its own worker process under the
+"offscreen" Qt platform, so no display is needed. The whole map is written
+as one page/image, with --views every view (keyframe) in presentation order
+is written as a page of the PDF or as numbered SVG/PNG files. The svgz
+format is gzipped SVG, tiles writes a map-tiles/ directory with a tiled
+viewer page for the web (see tiles.py).
+
+With more workers than maps the pages of view PDFs are rendered in ranges
+in parallel and merged. Images in PDFs are scaled to --dpi, and with
+--max-size a PDF that comes out too big is rendered again at a lower dpi.
+'''
+
+from pathlib import Path
+from math import ceil, sqrt
+import argparse, logging, multiprocessing, os, sys, time
+
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+from . import mainwindow, graphics, nexusgraph, tiles, pdfmerge
+from .viewrender import map_rect, view_transform, map_transform, render_page, ImageDownsampler
+
+FORMATS = ['pdf', 'svg', 'svgz', 'png', 'tiles']
+
+# lowest resolution tried to fit --max-size
+MINDPI = 50
+
+# fewest pages worth starting a worker for
+MINPAGES = 8
+
+# worker process globals
+_app = None
+
+
+def _init_worker():
+    '''
+    Set up a QApplication in a worker process
+    '''
+    global _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    _app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([sys.argv[0]])
+    mainwindow.add_application_fonts()
+
+
+def load_scene(path):
+    '''
+    Load map at path into a new scene with stems tagged "hide" hidden
+    '''
+    # read only, so don't pack strokes (pool workers would all rewrite the map)
+    g = mainwindow.load_or_convert_map(path, pack=False)
+    scene = graphics.NexusScene()
+    scene.graph = g
+    scene.childcounts = g.childCounts()
+    try:
+        for n in g.fetch('(r:Root) -(e:Child)> [n:Stem]'):
+            root = graphics.StemItem(node=n, scene=scene)
+            root.renew(reload=False)
+    finally:
+        scene.childcounts = {}
+
+    for child in scene.allChildStems(includeroot=False):
+        if 'hide' in child.getTags() and child.isVisible():
+            child.hide()
+
+    return scene
+
+
+def view_sides(g):
+    '''
+    Return list of (left, right) sides of the views in presentation order
+    '''
+    views = {n['uid']: n for n in g.fetch('[n:View]')}
+    transitions = dict(g.fetch('-[e:Transition]>', COLUMNS=['e.startuid', 'e.enduid']))
+    targets = set(transitions.values())
+
+    uid = next((uid for uid in views if uid not in targets), None)
+    sides = []
+    seen = set()
+    while uid in views and uid not in seen:
+        seen.add(uid)
+        view = views[uid]
+        if 'left' in view and 'right' in view:
+            sides.append((view['left'], view['right']))
+        else:
+            logging.warning("Skipping old style view, open and save the map to update it")
+        uid = transitions.get(uid)
+
+    return sides
+
+
+def render(scene, painter, width, height, sides=None):
+    '''
+    Render the whole map (sides None) or a single view to painter, fitting a
+    width x height target
+    '''
+    if sides is None:
+        T = map_transform(scene, width, height)
+    else:
+        T = view_transform(sides[0], sides[1], width, height)
+    render_page(scene, painter, T, width, height)
+
+
+def export_pdf(scene, path, views=None, width=None, precision=None, dpi=150):
+    '''
+    Write the map or its views, one per page, to an A4 landscape PDF. Images
+    are embedded once each, scaled down to what dpi needs on the pages.
+    '''
+    writer = QtGui.QPdfWriter(str(path))
+    writer.setCreator('Nexus %s' % str(graphics.VERSION))
+    writer.setTitle(Path(str(scene.graph.path)).stem)
+    writer.setPageSize(QtGui.QPageSize(QtGui.QPageSize.PageSizeId.A4))
+    writer.setPageOrientation(QtGui.QPageLayout.Orientation.Landscape)
+    writer.setResolution(dpi)
+
+    painter = QtGui.QPainter(writer)
+    W = painter.device().width()
+    H = painter.device().height()
+    if views is None:
+        pages = [map_transform(scene, W, H)]
+    else:
+        pages = [view_transform(left, right, W, H) for left, right in views]
+
+    images = ImageDownsampler(scene)
+    for T in pages:
+        images.need(T, W, H)
+    images.apply()
+
+    try:
+        for ii, T in enumerate(pages):
+            if ii > 0:
+                writer.newPage()
+            render_page(scene, painter, T, W, H)
+    finally:
+        painter.end()
+        images.restore()
+
+    return [path]
+
+
+def export_png(scene, path, views=None, width=1920, precision=None, dpi=None):
+    def save(path, W, H, sides=None):
+        image = QtGui.QImage(W, H, QtGui.QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.GlobalColor.white)
+        painter = QtGui.QPainter(image)
+        render(scene, painter, W, H, sides)
+        painter.end()
+        image.save(str(path))
+        return path
+
+    if views is None:
+        rect = map_rect(scene)
+        return [save(path, width, max(1, int(width*rect.height()/rect.width())))]
+    else:
+        return [save(numbered(path, ii), width, width*9//16, sides) for ii, sides in enumerate(views)]
+
+
+def export_svg(scene, path, views=None, width=1920, precision=1, dpi=None):
+    if views is None:
+        mainwindow.export_svg(scene, str(path), precision=precision)
+        return [path]
+
+    paths = []
+    for ii, sides in enumerate(views):
+        target = numbered(path, ii)
+        mainwindow.export_svg(scene, str(target), precision=precision, sides=sides, size=(width, width*9//16))
+        paths.append(target)
+
+    return paths
+
+
+def export_tiles(scene, path, views=None, width=1920, precision=None, dpi=None, scale=None):
+    # always a single page with the views as navigation targets
+    path = Path(path)
+    if views is None:
+        views = view_sides(scene.graph)
+    return [tiles.export_tiles(scene, path.with_name(path.stem+'-tiles'), views, scale=scale,
+                               screenwidth=width)]
+
+
+def numbered(path, ii):
+    path = Path(path)
+    return path.with_name('{}-{:03d}{}'.format(path.stem, ii+1, path.suffix))
+
+
+EXPORTERS = {'pdf': export_pdf, 'svg': export_svg, 'svgz': export_svg, 'png': export_png,
+             'tiles': export_tiles}
+
+
+def export_map(path, outdir=None, formats=('pdf',), views=False, width=1920, precision=1, dpi=150,
+               pages=None, output=None, tilescale=None):
+    '''
+    Export the map at path in each of formats. Runs in a worker process.
+
+    pages is an optional (start, stop) slice of the views to export and
+    output a file to write to instead of the default name (for a single
+    format). tilescale is the pixels per scene unit of tiles (default from
+    the views).
+
+    Returns (path, list of files written, seconds taken, error or None)
+    '''
+    tic = time.time()
+    try:
+        if _app is None:
+            _init_worker()
+
+        path = Path(path)
+        target = Path(outdir) if outdir is not None else path.parent
+        target.mkdir(parents=True, exist_ok=True)
+
+        scene = load_scene(str(path))
+        try:
+            viewlist = view_sides(scene.graph) if views else None
+            if viewlist is not None and pages is not None:
+                viewlist = viewlist[pages[0]:pages[1]]
+
+            written = []
+            for fmt in formats:
+                out = output or target.joinpath(path.name).with_suffix('.'+fmt)
+                extra = {'scale': tilescale} if fmt == 'tiles' else {}
+                written.extend(EXPORTERS[fmt](scene, out, viewlist, width=width, precision=precision, dpi=dpi, **extra))
+        finally:
+            nexusgraph.release_graph(scene.graph)
+
+        return str(path), [str(w) for w in written], time.time()-tic, None
+
+    except Exception as e:
+        logging.exception("Failed to export %s", path)
+        return str(path), [], time.time()-tic, str(e)
+
+
+def count_views(path):
+    '''
+    Number of views of the map at path, without loading it into a scene
+    '''
+    try:
+        g = nexusgraph.NexusGraph(str(path))
+        n = len(view_sides(g))
+        g.connection.close()
+        return n
+    except Exception:
+        # old format maps are converted in the workers
+        return 0
+
+
+#----------------------------------------------------------------------
+class PDFJob:
+#----------------------------------------------------------------------
+    '''
+    The views PDF of one map, rendered as page ranges in parallel and
+    merged. With maxsize, rendered again at a lower dpi until small enough.
+    '''
+
+    def __init__(self, path, target, npages, parts, args):
+        self.path = path
+        self.target = Path(target)
+        self.args = args
+        self.dpi = args.dpi
+        self.attempts = 0
+        self.seconds = 0
+        step = max(1, ceil(npages/parts))
+        self.ranges = [(start, min(npages, start+step)) for start in range(0, npages, step)]
+
+    def submit(self, pool):
+        self.attempts += 1
+        self.parts = []
+        self.tasks = []
+        for ii, pages in enumerate(self.ranges):
+            part = self.target.with_name('.{}.part{:03d}.pdf'.format(self.target.stem, ii))
+            self.parts.append(part)
+            self.tasks.append(pool.apply_async(export_map, (self.path, self.args.outdir, ['pdf'], True, self.args.width,
+                                                            self.args.precision, self.dpi, pages, str(part))))
+
+    def collect(self):
+        '''
+        Wait for the parts and merge them. Returns error or None
+        '''
+        error = None
+        for task in self.tasks:
+            path, written, seconds, e = task.get()
+            self.seconds += seconds
+            error = error or e
+
+        try:
+            if error is None:
+                if len(self.parts) == 1:
+                    os.replace(self.parts[0], self.target)
+                else:
+                    pdfmerge.merge_pdfs(self.parts, self.target)
+        finally:
+            for part in self.parts:
+                if part.exists():
+                    part.unlink()
+
+        return error
+
+    def toobig(self):
+        '''
+        Check the size and lower the dpi for another go if needed
+        '''
+        maxsize = self.args.max_size
+        if maxsize is None:
+            return False
+
+        size = self.target.stat().st_size/1e6
+        if size <= maxsize:
+            return False
+        if self.attempts >= 4 or self.dpi <= MINDPI:
+            logging.warning("%s is still %.1fMB at %d dpi", self.target.name, size, self.dpi)
+            return False
+
+        # only images shrink with the dpi, so aim low
+        self.dpi = max(MINDPI, int(self.dpi*0.8*sqrt(maxsize/size)))
+        logging.info("%s is %.1fMB, trying again at %d dpi", self.target.name, size, self.dpi)
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m nexus.export',
+                                     description='Export Nexus maps to PDF, SVG, PNG or web tiles without the GUI.')
+    parser.add_argument('maps', nargs='+', help='.nex files to export')
+    parser.add_argument('-f', '--format', default='pdf',
+                        help='comma separated list of formats out of {} (default pdf)'.format(', '.join(FORMATS)))
+    parser.add_argument('-o', '--outdir', default=None,
+                        help='directory to write to (default next to each map)')
+    parser.add_argument('--views', action='store_true',
+                        help='export each view rather than the whole map')
+    parser.add_argument('--width', type=int, default=1920,
+                        help='width in pixels of PNG and per-view SVG output, and of the screen tiles '
+                        'are made sharp on (default 1920)')
+    parser.add_argument('--precision', type=int, default=1,
+                        help='decimal places kept in SVG paths (default 1)')
+    parser.add_argument('--dpi', type=int, default=150,
+                        help='resolution of images in PDF output (default 150)')
+    parser.add_argument('--tile-scale', type=float, default=None,
+                        help='pixels per map unit of the most detailed tiles (default enough for the views)')
+    parser.add_argument('--max-size', type=float, default=None,
+                        help='re-export view PDFs at a lower dpi until under this many MB')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default number of CPUs)')
+    args = parser.parse_args(argv)
+
+    formats = [f.strip().lower() for f in args.format.split(',') if len(f.strip()) > 0]
+    for f in formats:
+        if f not in FORMATS:
+            parser.error("unknown format '{}'".format(f))
+
+    maps = [str(Path(m).resolve()) for m in args.maps]
+    for m in maps:
+        # opening a missing map would create an empty one
+        if not os.path.isfile(m):
+            parser.error("no such map '{}'".format(m))
+    jobs = max(1, args.jobs or 1)
+
+    # with spare workers or a size limit, view PDFs are done in page ranges
+    pdfjobs = {}
+    if args.views and 'pdf' in formats and (jobs > len(maps) or args.max_size is not None):
+        parts = max(1, jobs//len(maps))
+        for m in maps:
+            npages = count_views(m)
+            if npages > 0:
+                target = Path(args.outdir or Path(m).parent).joinpath(Path(m).name).with_suffix('.pdf')
+                target.parent.mkdir(parents=True, exist_ok=True)
+                pdfjobs[m] = PDFJob(m, target, npages, max(1, min(parts, npages//MINPAGES)), args)
+    jobs = min(jobs, sum(len(j.ranges) for j in pdfjobs.values())+len(maps))
+
+    tic = time.time()
+    failed = 0
+    # Qt isn't fork safe so always start fresh interpreters
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(jobs, initializer=_init_worker) as pool:
+        tasks = {}
+        for m in maps:
+            mapformats = [f for f in formats if not (f == 'pdf' and m in pdfjobs)]
+            if m in pdfjobs:
+                pdfjobs[m].submit(pool)
+            if len(mapformats) > 0:
+                tasks[m] = pool.apply_async(export_map, (m, args.outdir, mapformats, args.views, args.width,
+                                                         args.precision, args.dpi),
+                                            {'tilescale': args.tile_scale})
+
+        for m in maps:
+            seconds = 0
+            written = []
+            error = None
+            if m in tasks:
+                path, written, seconds, error = tasks[m].get()
+            if m in pdfjobs:
+                job = pdfjobs[m]
+                e = job.collect()
+                while e is None and job.toobig():
+                    job.submit(pool)
+                    e = job.collect()
+                error = error or e
+                seconds += job.seconds
+                written.append(str(job.target))
+
+            if error is None:
+                print("{:7.2f}s  {}  ({} files)".format(seconds, m, len(written)))
+            else:
+                failed += 1
+                print("{:7.2f}s  {}  FAILED: {}".format(seconds, m, error))
+
+    print("Exported {} maps in {:.2f}s with {} workers".format(len(maps)-failed, time.time()-tic, jobs))
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,13 +19,11 @@
 from PyQt6 import QtCore, QtGui, QtWidgets
 from PyQt6.QtCore import pyqtSlot
 
-from math import sqrt, atan2, cos, sin, pi, asin, degrees, pow, exp, fmod
+from math import sqrt, atan2, cos, sin, pi, asin, degrees, pow, exp, fmod, log2, ceil
 import logging
 
-from bs4 import BeautifulSoup
-
 import re, time, copy, hashlib, json
-from . import interpreter, tools, graphydb, config, nexusgraph
+from . import interpreter, tools, graphydb, config, nexusgraph, instrument
 
 import urllib.parse, os
 from functools import reduce
@@ -44,7 +42,7 @@ EraserMode = 3
 # Mouse press states
 MPRESS, MMOVE, MLONG, MDOUBLE, MADD = 1, 2, 3, 4, 5
 
-VERSION = 0.91
+VERSION = 0.92
 
 #----------------------------------------------------------------------
 class Transform(QtGui.QTransform):
@@ -511,8 +509,7 @@ class InputDialog(QtWidgets.QDialog):
 
         # If there are no outgoing links (With, Child) and
         # there are no items (or just blank Text items) delete branch
-        if self.stem.node.outE('e.kind="With"', COUNT=True) == 0 and \
-           self.stem.node.outE('e.kind="Child"', COUNT=True) == 0:
+        if self.stem.node.outE('e.kind IN ("With", "Child")', COUNT=True) == 0:
 
             empty = True
             for item in self.stem.node['content'].values():
@@ -538,6 +535,9 @@ class InputDialog(QtWidgets.QDialog):
 
         self.stem.isBeingEdited = False
 
+        # Write out the edits now rather than waiting for the idle timer
+        self.stem.node.graph.flush()
+
         self.hide()
 
     def done(self, r):
@@ -553,7 +553,7 @@ class InputDialog(QtWidgets.QDialog):
                 self.stem.node['tags'] = list(newtags)
             else:
                 self.stem.node.discard('tags')
-            self.stem.node.save(setchange=True)
+            self.stem.node.save(setchange=True, defer=True)
             self.stem.renew(reload=False, create=True, children=False,
                             recurse=False, position=False)
 
@@ -565,7 +565,7 @@ class InputDialog(QtWidgets.QDialog):
             self.stem.node['iconified'] = True
         else:
             self.stem.node.discard('iconified')
-        self.stem.node.save(setchange=True)
+        self.stem.node.save(setchange=True, defer=True)
         self.stem.renew(reload=False, create=True, children=False,
                         recurse=True, position=False)
 
@@ -573,7 +573,7 @@ class InputDialog(QtWidgets.QDialog):
         # Callback for spinbox
         if 'scale' not in self.stem.node or self.stem.node['scale'] != scale:
             self.stem.node['scale'] = scale
-            self.stem.node.save(setchange=True)
+            self.stem.node.save(setchange=True, defer=True)
             self.stem.renew(reload=False, children=False,
                             recurse=False, position=False)
 
@@ -584,7 +584,7 @@ class InputDialog(QtWidgets.QDialog):
             self.branchcolorbutton.setDisabled(True)
             if 'branchcolor' in self.stem.node:
                 del self.stem.node['branchcolor']
-                self.stem.node.save(setchange=True)
+                self.stem.node.save(setchange=True, defer=True)
                 self.stem.renew(reload=False, children=False,
                                 recurse=True, position=False)
         else:
@@ -603,7 +603,7 @@ class InputDialog(QtWidgets.QDialog):
             self.branchcolorbutton.setIcon(QtGui.QIcon(pix))
             colorhex = color.name(QtGui.QColor.NameFormat.HexArgb)
             self.stem.node['branchcolor'] = colorhex
-            self.stem.node.save(setchange=True)
+            self.stem.node.save(setchange=True, defer=True)
             self.stem.renew(reload=False, children=False, recurse=True, position=False)
 
     def opacityWidgetChanged(self, opacity):
@@ -901,7 +901,7 @@ class InputDialog(QtWidgets.QDialog):
                 z = max(z, otheritem.get('z', 0))
             item['z'] = z+1
             self.stem.node['content'][uid] = item
-            self.stem.node.save(setchange=True)
+            self.stem.node.save(setchange=True, defer=True)
             textitem = TextItem(uid, self.stem, scene=self.scene)
             textitem.positionChanged.connect(self.setTextControls)
             # textitem.setMode(TextMode)
@@ -1683,7 +1683,7 @@ class TransformationWidget(QtWidgets.QGraphicsItem):
                 item['frame'] = Transform(item.transform()).tolist()
                 # Trigger a change
                 # item.stemnode.keyChanged('content')
-                item.stem.node.save(setchange=True, batch=batch)
+                item.stem.node.save(setchange=True, batch=batch, defer=True)
                 item._changed = False
 
         # NB if stem reloaded it will break node reference
@@ -1906,6 +1906,214 @@ class PointerEvent():
 # TODO move modes into class
 Free, Mouse, Tablet, Gesture = 0,1,2,3
 
+#----------------------------------------------------------------------
+class LiveInkItem(QtWidgets.QGraphicsItem):
+#----------------------------------------------------------------------
+    '''
+    The stroke being drawn, as a single item over everything. Each new
+    segment only dirties its own rect and repaints are held to the screen's
+    refresh rate. The time from a pen event to painting its segment is
+    recorded as LiveInk.latency when profiling.
+    '''
+
+    # grow the bounding rect by this much at a time, growing repaints it all
+    MARGIN = 50
+
+    def __init__(self, pen, refreshrate=60):
+        super().__init__()
+        self.pen = QtGui.QPen(pen)
+        self.pen.setCapStyle(QtCore.Qt.PenCapStyle.RoundCap)
+        self.basewidth = pen.widthF()
+        # (line, width, rect) of each segment
+        self.segments = []
+        self.rect = QtCore.QRectF()
+        self.dirty = QtCore.QRectF()
+        # perf_counter time of the oldest segment not painted yet (when profiling)
+        self.waiting = None
+
+        self.interval = 1/max(refreshrate, 1)
+        self.flushed = 0.0
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+        # Draw over everything
+        self.setZValue(1000)
+        self.setEnabled(False)
+        self.setFlag(self.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return self.rect
+
+    def addSegment(self, x0, y0, x1, y1, pressure):
+        line = QtCore.QLineF(x0, y0, x1, y1)
+        width = self.basewidth*pressure
+        w = width/2+1
+        rect = QtCore.QRectF(line.p1(), line.p2()).normalized().adjusted(-w, -w, w, w)
+        self.segments.append((line, width, rect))
+
+        if not self.rect.contains(rect):
+            self.prepareGeometryChange()
+            m = self.MARGIN
+            self.rect = self.rect.united(rect).adjusted(-m, -m, m, m)
+        self.dirty = self.dirty.united(rect)
+        if self.waiting is None and instrument.ENABLED:
+            self.waiting = time.perf_counter()
+
+        if not self.timer.isActive():
+            wait = self.interval-(time.perf_counter()-self.flushed)
+            if wait <= 0:
+                self.flush()
+            else:
+                self.timer.start(int(1000*wait)+1)
+
+    def flush(self):
+        self.flushed = time.perf_counter()
+        if not self.dirty.isEmpty():
+            self.update(self.dirty)
+            self.dirty = QtCore.QRectF()
+
+    def clear(self):
+        self.timer.stop()
+        if self.scene() is not None:
+            self.scene().removeItem(self)
+
+    def paint(self, painter, option, widget):
+        exposed = option.exposedRect
+        pen = self.pen
+        for line, width, rect in self.segments:
+            if rect.intersects(exposed):
+                pen.setWidthF(width)
+                painter.setPen(pen)
+                painter.drawLine(line)
+
+        if self.waiting is not None:
+            instrument.record('LiveInk.latency', self.waiting, time.perf_counter())
+            self.waiting = None
+
+def segmentDistance(a, b, c, d):
+    '''
+    Shortest distance between the segments a-b and c-d, each an (x, y) pair
+    '''
+    def cross(o, p, q):
+        return (p[0]-o[0])*(q[1]-o[1])-(p[1]-o[1])*(q[0]-o[0])
+
+    d1, d2, d3, d4 = cross(c, d, a), cross(c, d, b), cross(a, b, c), cross(a, b, d)
+    if ((d1 > 0) != (d2 > 0)) and ((d3 > 0) != (d4 > 0)):
+        return 0.0
+
+    def pointDistance(p, q, r):
+        # distance of p from segment q-r
+        dx, dy = r[0]-q[0], r[1]-q[1]
+        L = dx*dx+dy*dy
+        t = 0.0 if L == 0 else max(0.0, min(1.0, ((p[0]-q[0])*dx+(p[1]-q[1])*dy)/L))
+        return sqrt((q[0]+t*dx-p[0])**2+(q[1]+t*dy-p[1])**2)
+
+    return min(pointDistance(a, c, d), pointDistance(b, c, d),
+               pointDistance(c, a, b), pointDistance(d, a, b))
+
+def splitStroke(data, erased):
+    '''
+    Return the stroke data of the pieces left after erasing the segments
+    (indices, segment i joins points i and i+1) in erased
+    '''
+    points = nexusgraph.DataToStroke(data['stroke'])
+    runs = []
+    run = [points[0]]
+    for ii in range(len(points)-1):
+        if ii in erased:
+            runs.append(run)
+            run = [points[ii+1]]
+        else:
+            run.append(points[ii+1])
+    runs.append(run)
+
+    pieces = []
+    for run in runs:
+        if len(run) > 1:
+            piece = copy.deepcopy({k: v for k, v in data.items() if k != 'stroke'})
+            piece['stroke'] = nexusgraph.StrokeToData(run)
+            pieces.append(piece)
+    return pieces
+
+#----------------------------------------------------------------------
+class StrokeIndex:
+#----------------------------------------------------------------------
+    '''
+    Grid of the segments of the pen strokes in a stem's content (in the
+    stem's coordinates), to find what the eraser touches without going
+    through every stroke.
+    '''
+
+    CELL = 10.0
+
+    def __init__(self, content):
+        # (i, j) -> [(uid, segment index), ...]
+        self.cells = collections.defaultdict(list)
+        # uid -> ([(start, end, half width), ...], cells it is in)
+        self.strokes = {}
+        for uid, data in content.items():
+            if data.get('kind') == 'Stroke':
+                self.add(uid, data)
+
+    def add(self, uid, data):
+        m11, m12, m13, m21, m22, m23, m31, m32, m33 = data['frame']
+        w = sqrt(abs(m11*m22-m12*m21))*data['width']/2
+        points = nexusgraph.DataToStroke(data['stroke'])
+        mapped = [(m11*p[0]+m21*p[1]+m31, m12*p[0]+m22*p[1]+m32) for p in points]
+        halfwidths = [w*p[2] if len(p) > 2 else w for p in points]
+        if len(points) == 1:
+            segments = [(mapped[0], mapped[0], halfwidths[0])]
+        else:
+            segments = [(mapped[ii], mapped[ii+1], max(halfwidths[ii], halfwidths[ii+1]))
+                        for ii in range(len(points)-1)]
+
+        C = self.CELL
+        cells = self.cells
+        keys = set()
+        for ii, (a, b, hw) in enumerate(segments):
+            i0, i1 = int((min(a[0], b[0])-hw)//C), int((max(a[0], b[0])+hw)//C)
+            j0, j1 = int((min(a[1], b[1])-hw)//C), int((max(a[1], b[1])+hw)//C)
+            for i in range(i0, i1+1):
+                for j in range(j0, j1+1):
+                    cells[i, j].append((uid, ii))
+                    keys.add((i, j))
+        self.strokes[uid] = (segments, keys)
+
+    def remove(self, uid):
+        segments, keys = self.strokes.pop(uid)
+        for key in keys:
+            entries = [e for e in self.cells[key] if e[0] != uid]
+            if len(entries) > 0:
+                self.cells[key] = entries
+            else:
+                del self.cells[key]
+
+    def cellRange(self, x0, y0, x1, y1):
+        C = self.CELL
+        for i in range(int(x0//C), int(x1//C)+1):
+            for j in range(int(y0//C), int(y1//C)+1):
+                yield (i, j)
+
+    def hits(self, a, b, radius):
+        '''
+        Return {uid: set of segment indices} of the segments touched by an
+        eraser of radius moved from point a to b
+        '''
+        t = instrument.start('StrokeIndex.hits')
+        candidates = set()
+        for key in self.cellRange(min(a[0], b[0])-radius, min(a[1], b[1])-radius,
+                                  max(a[0], b[0])+radius, max(a[1], b[1])+radius):
+            candidates.update(self.cells.get(key, ()))
+
+        hits = {}
+        for uid, ii in candidates:
+            c, d, hw = self.strokes[uid][0][ii]
+            if segmentDistance(a, b, c, d) <= radius+hw:
+                hits.setdefault(uid, set()).add(ii)
+        instrument.stop('StrokeIndex.hits', t)
+        return hits
+
 #----------------------------------------------------------------------
 class InkView(QtWidgets.QGraphicsView):
 #----------------------------------------------------------------------
@@ -1931,6 +2139,7 @@ class InkView(QtWidgets.QGraphicsView):
         self.grabGesture(QtCore.Qt.GestureType.PinchGesture)
 
         self.setViewportUpdateMode(QtWidgets.QGraphicsView.ViewportUpdateMode.SmartViewportUpdate)
+        setOpenGLViewport(self, CONFIG['opengl_viewport'])
 
         self.setAcceptDrops(True)
 
@@ -1949,6 +2158,9 @@ class InkView(QtWidgets.QGraphicsView):
         # Extra potential filter to separate mouse and tablet
         self.tablettime = 0
 
+        # Drawing a stroke with the pen, moves take the fast path in tabletEvent
+        self._inking = False
+
         self.setAttribute(QtCore.Qt.WidgetAttribute.WA_AcceptTouchEvents, True)
 
         # Set default scale for the view
@@ -1964,20 +2176,23 @@ class InkView(QtWidgets.QGraphicsView):
         self.tablettime = time.time()
 
         eventtype = event.type()
+        event.setAccepted(True)
+
+        # Fast path for the stream of moves while inking, no hit testing or
+        # pointer bookkeeping, only the position and pressure are needed
+        if self._inking and eventtype == QtGui.QTabletEvent.Type.TabletMove:
+            Tinv, dummy = self.viewportTransform().inverted()
+            self.penMoveEvent(Tinv.map(event.position()),
+                              pressureCurve(event.pressure(), **CONFIG['pressure_curve']))
+            return
+
         pointertype = event.pointerType()
         pressure = event.pressure()
-        event.setAccepted(True)
         scene = self.scene()
         scenePos = self.mapToScene(event.position().toPoint())
 
-        # Report what was received for debugging
-        tev = {QtGui.QTabletEvent.Type.TabletPress: "TabletPress",
-               QtGui.QTabletEvent.Type.TabletMove: "TabletMove",
-               QtGui.QTabletEvent.Type.TabletRelease: "TabletRelease"}
-        etype = tev.get(eventtype, "OtherTabletEvent")
-
         # logging.debug("I {} pointer={} pressure={} tilt=({},{}) buttons={} device={}".format(
-        #     etype, event.pointerType(), pressure,
+        #     eventtype, event.pointerType(), pressure,
         #     event.xTilt(), event.yTilt(),
         #     repr(event.buttons()),
         #     repr(event.device()),
@@ -1989,13 +2204,10 @@ class InkView(QtWidgets.QGraphicsView):
         Tinv, dummy = T.inverted()
         scenePosF = event.position()*Tinv
         scenePosF = (scenePosF.x(), scenePosF.y())
-        etime = time.time()
 
         #
         # Dispatch events mirroring mouse event structures
         #
-        itemunder = scene.itemAt(scenePos, self.transform())
-
         if eventtype == QtGui.QTabletEvent.Type.TabletPress:
             self._eventstate = Tablet
 
@@ -2007,6 +2219,7 @@ class InkView(QtWidgets.QGraphicsView):
                 self.eraserPressEvent(scenePos)
 
             elif scene.mode == PenMode:
+                self._inking = True
                 self.penPressEvent(scenePos, pressure)
 
             else:
@@ -2032,6 +2245,7 @@ class InkView(QtWidgets.QGraphicsView):
             if self._eventstate != Tablet:
                 return
             self._eventstate = Free
+            self._inking = False
 
             self._event.update("release", scenePos=scenePosF)
 
@@ -2218,15 +2432,10 @@ class InkView(QtWidgets.QGraphicsView):
         scene = self.scene()
         scene._lastScenePos = scenePos
 
-        # This grouping is so we can delete the items easily
-        scene.tmpgroup = QtWidgets.QGraphicsItemGroup()
-
-        # Draw over everything
-        scene.tmpgroup.setZValue(1000)
-        scene.addItem(scene.tmpgroup)
+        scene.liveink = LiveInkItem(scene.pen, self.screen().refreshRate())
+        scene.addItem(scene.liveink)
 
         point = [scenePos.x(), scenePos.y(), pressure, t]
-        scene._tmppath = [point]
         scene.strokecoords = [point]
 
         self.viewChangeStream.emit(self)
@@ -2246,25 +2455,9 @@ class InkView(QtWidgets.QGraphicsView):
 
         p1 = scene._lastScenePos
         p2 = scenePos
-        pen = QtGui.QPen(scene.pen)
-        pen.setCapStyle(QtCore.Qt.PenCapStyle.RoundCap)
         point = [p2.x(), p2.y(), pressure, t]
         scene.strokecoords.append(point)
-        scene._tmppath.append(point)
-
-        # only draw the stroke segment every few calls
-        # otherwise mac can't cope and rate goes down, poor thing.
-        if len(scene._tmppath) > 4:
-            x0, y0, z0, t0 = scene._tmppath[0]
-            for x1, y1, z1, t1 in scene._tmppath[1:]:
-                pen.setWidthF(scene.pen.widthF()*z1)
-                line = scene.addLine(x0, y0, x1, y1, pen)
-                line.setFlag(line.GraphicsItemFlag.ItemIsSelectable, False)
-                line.setEnabled(False)
-                scene.tmpgroup.addToGroup(line)
-                x0, y0, z0, t0 = x1, y1, z1, t1
-
-            scene._tmppath = [[x1, y1, z1, t1]]
+        scene.liveink.addSegment(p1.x(), p1.y(), p2.x(), p2.y(), pressure)
 
         scene._lastScenePos = p2
         self.viewChangeStream.emit(self)
@@ -2294,7 +2487,7 @@ class InkView(QtWidgets.QGraphicsView):
                 out.append([p[0]-p0[0], p[1]-p0[1], p[2]])
             else:
                 out.append([p[0]-p0[0], p[1]-p0[1]])
-        data['stroke'] = out
+        data['stroke'] = nexusgraph.StrokeToData(out)
 
         # Make copy of transform otherwise default one instantiated on definition
         # Accumulates translations
@@ -2308,15 +2501,14 @@ class InkView(QtWidgets.QGraphicsView):
         # stemnode['content'].append(data)
         scene.stem.node.keyChanged('content')
         # print('content', stemnode['data']['content'])
-        scene.stem.node.save(setchange=True)
+        scene.stem.node.save(setchange=True, defer=True)
 
         # Refresh the stem in the Nexus map
         scene.refreshStem()
 
-        if hasattr(scene, "tmpgroup"):
-            for item in scene.tmpgroup.childItems():
-                scene.removeItem(item)
-            scene.removeItem(scene.tmpgroup)
+        if hasattr(scene, "liveink"):
+            scene.liveink.clear()
+            del scene.liveink
 
         InkItem(uid, scene.stem, scene)
 
@@ -2326,23 +2518,70 @@ class InkView(QtWidgets.QGraphicsView):
     # Eraser action
     #
     def eraserPressEvent(self, scenePos):
-        pass
+
+        scene = self.scene()
+        scene.strokeindex = StrokeIndex(scene.stem.node['content'])
+        scene.inkitems = {item.uid: item for item in scene.items() if isinstance(item, InkItem)}
+        scene.erased = False
+        scene._lastScenePos = scenePos
+
+        self.eraserMoveEvent(scenePos, self.transform())
 
     def eraserMoveEvent(self, scenePos, transform):
 
         scene = self.scene()
-        item = scene.itemAt(scenePos, transform)
+        if getattr(scene, 'strokeindex', None) is None:
+            self.eraserPressEvent(scenePos)
+            return
+
+        # the eraser sweeps from the last position, fast moves don't skip strokes
+        radius = CONFIG['eraser_radius']/sqrt(abs(transform.determinant()))
+        p0 = scene._lastScenePos
+        hits = scene.strokeindex.hits((p0.x(), p0.y()), (scenePos.x(), scenePos.y()), radius)
+        scene._lastScenePos = scenePos
 
         # only erase pen strokes, this makes is easy to annotate images
-        if item is not None and isinstance(item, InkItem):
-            item.deleteNodeItem()
-            self.scene().refreshStem(reload=False)
+        if len(hits) > 0:
+            self.eraseStrokes(hits)
 
         self.viewChangeStream.emit(self)
 
+    def eraseStrokes(self, hits):
+        '''
+        Erase the strokes, or with eraser_mode "split" only the segments, in
+        hits ({uid: segment indices}). Saved on eraser release.
+        '''
+        scene = self.scene()
+        content = scene.stem.node['content']
+        split = CONFIG['eraser_mode'] == 'split'
+
+        for uid, segments in hits.items():
+            pieces = splitStroke(content[uid], segments) if split else []
+            del content[uid]
+            scene.strokeindex.remove(uid)
+            item = scene.inkitems.pop(uid, None)
+            if item is not None:
+                scene.removeItem(item)
+
+            for piece in pieces:
+                newuid = graphydb.generateUUID()
+                content[newuid] = piece
+                scene.strokeindex.add(newuid, piece)
+                scene.inkitems[newuid] = InkItem(newuid, scene.stem, scene)
+
+        scene.stem.node.keyChanged('content')
+        scene.erased = True
+
     def eraserReleaseEvent(self, event):
-        # All the action happens on move
-        self.scene().refreshStem()
+
+        scene = self.scene()
+        if getattr(scene, 'erased', False):
+            # one save for everything erased in the gesture
+            scene.stem.node.save(setchange=True, defer=True)
+        scene.strokeindex = None
+        scene.inkitems = None
+        scene.erased = False
+        scene.refreshStem()
 
         self.viewChangeStream.emit(self)
 
@@ -2553,6 +2792,23 @@ class NexusScene(QtWidgets.QGraphicsScene):
         self.backgroundDialog = BackgroundDialog(self, self.parent())
         self.backgroundDialog.hide()
 
+        # {uid: number of children} of every stem while loading a map
+        self.childcounts = {}
+
+        # Virtual scene: only stems near a view have their leaf built,
+        # the others have a LeafProxy with the geometry cached in the map
+        self.virtual = False
+        self.leafgeometry = {}
+        self.leafgeometrychanged = False
+        # built leaves, least recently seen first
+        self.builtstems = collections.OrderedDict()
+        self.realisedrect = QtCore.QRectF()
+
+        # Scale and rotation of the view the item caches are set up for
+        # (None until shown in a view)
+        self.cachescale = None
+        self.cacherotated = False
+
         brush = QtGui.QBrush(QtGui.QColor("White"), QtCore.Qt.BrushStyle.SolidPattern)
         self.setBackgroundBrush(brush)
 
@@ -2789,6 +3045,173 @@ class NexusScene(QtWidgets.QGraphicsScene):
         # TODO this will fail if there are more than one root's
         return self.childStems()[0]
 
+    def refreshStems(self, uids):
+        '''
+        Bring the stems with the given node uids up to date with the database,
+        e.g. after another program changed the map. Parents go first so their
+        new and deleted children are sorted out before the children themselves.
+        '''
+        stems = [s for s in self.allChildStems() if s.node['uid'] in uids]
+        stems.sort(key=lambda s: s.depth)
+
+        for stem in stems:
+            if stem.scene() is not self:
+                # already removed along with its parent
+                continue
+            if stem.isBeingEdited:
+                # local edits win, they'll be saved when the dialog closes
+                continue
+            if not stem.node.exists:
+                continue
+
+            stem.renew(reload=True, children=False, recurse=False)
+            # new and deleted children, as after a paste
+            stem.renew(reload=False, create=False)
+
+    def render(self, painter, target=QtCore.QRectF(), source=QtCore.QRectF(),
+               mode=QtCore.Qt.AspectRatioMode.KeepAspectRatio):
+        # Build any stems only outlined in a virtual scene first
+        rect = source if not source.isNull() else self.itemsBoundingRect()
+        if self.virtual:
+            self.realiseStems(rect)
+        cached = self.uncacheItems(rect)
+        super().render(painter, target, source, mode)
+        self.recacheItems(cached)
+
+    def applyItemCaching(self):
+        '''
+        Set the cache modes of all the leaf content, after a zoom or a change in policy
+        '''
+        t = instrument.start('NexusScene.applyItemCaching')
+        for stem in self.allChildStems():
+            if stem.leaf is not None:
+                stem.leaf.applyCaching()
+        instrument.stop('NexusScene.applyItemCaching', t)
+
+    def uncacheItems(self, rect):
+        '''
+        Turn off the caches of items in rect (scene coordinates) so rendering
+        to a file or printer draws them rather than their pixmaps. Returns
+        the items and modes for recacheItems().
+        '''
+        if self.cachescale is None:
+            return []
+        nocache = QtWidgets.QGraphicsItem.CacheMode.NoCache
+        cached = [(item, item.cacheMode()) for item in self.items(rect) if item.cacheMode() != nocache]
+        for item, mode in cached:
+            item.setCacheMode(nocache)
+        return cached
+
+    def recacheItems(self, cached):
+        for item, mode in cached:
+            item.setCacheMode(mode, getattr(item, '_cachesize', QtCore.QSize()))
+
+    # Leaf geometry depends on the fonts and text width as well as the stems
+    LEAFGEOMETRYKEY = 'leafgeometry'
+
+    def leafGeometryFingerprint(self):
+        return [VERSION, CONFIG['text_item_font_family'], CONFIG['text_item_font_size'],
+                CONFIG['text_item_width']]
+
+    def loadLeafGeometry(self):
+        '''
+        Read the cached leaf geometry of the stems from the map
+        '''
+        try:
+            cached = self.graph.cached(self.LEAFGEOMETRYKEY)
+        except KeyError:
+            cached = {}
+        if cached.get('fingerprint') == self.leafGeometryFingerprint():
+            self.leafgeometry = cached['stems']
+        else:
+            self.leafgeometry = {}
+        self.leafgeometrychanged = False
+
+    def saveLeafGeometry(self):
+        '''
+        Write the leaf geometry back to the map's cache if any changed
+        '''
+        if not self.leafgeometrychanged:
+            return
+        self.graph.cache(self.LEAFGEOMETRYKEY, {'fingerprint': self.leafGeometryFingerprint(),
+                                                'stems': self.leafgeometry})
+        self.leafgeometrychanged = False
+
+    def leafGeometry(self, stem):
+        '''
+        Return (titlerect, boundingrect) of the stem's leaf when last built or
+        None if the stem changed since (or the scene isn't virtual)
+        '''
+        if not self.virtual:
+            return None
+        entry = self.leafgeometry.get(stem.node['uid'])
+        if entry is None or entry[0] != stem.node.get('mtime'):
+            return None
+        return QtCore.QRectF(*entry[1]), QtCore.QRectF(*entry[2])
+
+    def builtLeaf(self, stem):
+        '''
+        Note the freshly built leaf of stem
+        '''
+        if not self.virtual:
+            return
+        leaf = stem.leaf
+        entry = [stem.node.get('mtime'), leaf.titlerect.getRect(), leaf.boundingrect.getRect()]
+        if self.leafgeometry.get(stem.node['uid']) != entry:
+            self.leafgeometry[stem.node['uid']] = entry
+            self.leafgeometrychanged = True
+        self.builtstems[stem] = None
+        self.builtstems.move_to_end(stem)
+
+    def realiseStems(self, rect=None):
+        '''
+        Build the leaves of the stems with proxies in rect (scene coordinates),
+        or all of them if rect is None. Built stems in rect count as recently seen.
+        '''
+        if not self.virtual:
+            return
+        t = instrument.start('NexusScene.realiseStems')
+
+        if rect is None:
+            stems = [s for s in self.allChildStems() if isinstance(s.leaf, LeafProxy)]
+        else:
+            stems = set()
+            for item in self.items(rect):
+                while item is not None and not isinstance(item, StemItem):
+                    item = item.parentItem()
+                if item is None:
+                    continue
+                if isinstance(item.leaf, LeafProxy):
+                    stems.add(item)
+                elif item in self.builtstems:
+                    self.builtstems.move_to_end(item)
+        # parents first, their leaves place the children
+        for stem in sorted(stems, key=lambda s: s.depth):
+            stem.realise()
+
+        instrument.stop('NexusScene.realiseStems', t, stems=len(stems))
+
+    def trimLeaves(self, keep=QtCore.QRectF()):
+        '''
+        Release built stems outside keep (scene coordinates) and the area
+        realised for the views, least recently seen first, until the budget is met
+        '''
+        if not self.virtual:
+            return
+        excess = len(self.builtstems)-CONFIG['virtual_scene_budget']
+        for stem in list(self.builtstems):
+            if excess <= 0:
+                break
+            if stem.scene() is not self:
+                del self.builtstems[stem]
+                excess -= 1
+                continue
+            rect = stem.sceneBoundingRect()
+            if keep.intersects(rect) or self.realisedrect.intersects(rect):
+                continue
+            if stem.release():
+                excess -= 1
+
 
 
 
@@ -2831,6 +3254,8 @@ class NexusView(QtWidgets.QGraphicsView):
         self.setRenderHint(QtGui.QPainter.RenderHint.TextAntialiasing)
         self.setRenderHint(QtGui.QPainter.RenderHint.SmoothPixmapTransform)
         self.setCacheMode(self.CacheModeFlag.CacheBackground)
+        # Item caches (see itemCacheMode) share the global pixmap cache
+        QtGui.QPixmapCache.setCacheLimit(CONFIG['item_cache_limit']*1024)
 
         # Implement the drag pan ourselves to avoid tablet event bug
         self.setDragMode(QtWidgets.QGraphicsView.DragMode.NoDrag)
@@ -2867,6 +3292,64 @@ class NexusView(QtWidgets.QGraphicsView):
         # Trying to fix touchpad zoom on linux
         # self.viewport().setAttribute(QtCore.Qt.WidgetAttribute.WA_AcceptTouchEvents, False)
 
+        setOpenGLViewport(self, CONFIG['opengl_viewport'])
+
+    def setupViewport(self, widget):
+        # also called when switching between OpenGL and software
+        super().setupViewport(widget)
+        widget.setCursor(QtCore.Qt.CursorShape.OpenHandCursor)
+
+    def paintEvent(self, event):
+        # Time repaints when profiling
+        t = instrument.start('NexusView.paint')
+        scene = self.scene()
+        if scene is not None and scene.virtual:
+            # Build the stems coming into view before they're drawn
+            # (or after zooming well in, to release the stems now out of view)
+            rect = self.mapToScene(self.viewport().rect()).boundingRect()
+            m = CONFIG['virtual_scene_margin']
+            margin = self.mapToScene(self.viewport().rect().adjusted(-m, -m, m, m)).boundingRect()
+            area = lambda r: r.width()*r.height()
+            if not scene.realisedrect.contains(rect) or area(scene.realisedrect) > 4*area(margin):
+                scene.realisedrect = margin
+                scene.realiseStems(margin)
+                scene.trimLeaves(margin)
+
+        if scene is not None:
+            # Cache modes depend on the zoom, only change them on doubling or
+            # halving, and whether the view is rotated
+            T = self.transform()
+            viewscale = sqrt(abs(T.determinant()))
+            rotated = abs(T.m12()) > 1e-6
+            if scene.cachescale is None or abs(log2(viewscale/scene.cachescale)) >= 1 or \
+               rotated != scene.cacherotated:
+                scene.cachescale = viewscale
+                scene.cacherotated = rotated
+                scene.applyItemCaching()
+
+            if instrument.ENABLED:
+                nocache = QtWidgets.QGraphicsItem.CacheMode.NoCache
+                rect = self.mapToScene(event.rect()).boundingRect()
+                instrument.count('ItemCache.draw', sum(1 for item in scene.items(rect)
+                                                        if item.cacheMode() != nocache and item.isVisible()))
+
+        super().paintEvent(event)
+        instrument.frame(t)
+
+    def render(self, painter, target=QtCore.QRectF(), source=QtCore.QRect(),
+               mode=QtCore.Qt.AspectRatioMode.KeepAspectRatio):
+        scene = self.scene()
+        cached = []
+        if scene is not None:
+            rect = source if not source.isNull() else self.viewport().rect()
+            rect = self.mapToScene(rect).boundingRect()
+            if scene.virtual:
+                scene.realiseStems(rect)
+            cached = scene.uncacheItems(rect)
+        super().render(painter, target, source, mode)
+        if scene is not None:
+            scene.recacheItems(cached)
+
     def scaleView(self, scaleFactor, point=None):
 
         matrix = self.transform()
@@ -3729,6 +4212,71 @@ def hsv_to_rgb(h, s, v):
     if h_i == 5: r, g, b = v, p, q
     return '#%X%X%X'%(round(r*255),round(g*255),round(b*255))
 
+def itemCacheMode(item, viewscale, rotated=False):
+    '''
+    Cache policy for leaf content, returns (mode, logical cache size). Simple
+    items are quicker to draw than to cache. Complex ones drawn at least at
+    their own size are cached in device coordinates so they stay sharp. When
+    drawn smaller, or the view is rotated (as between views in presentations),
+    they are cached in item coordinates at about the size drawn so the cache
+    survives zooming and rotating without holding more pixels than shown.
+    Caches that would take more than a sixteenth of the pixmap cache (a
+    rotated view zoomed in close) aren't kept, the item is drawn directly.
+    '''
+    mode = QtWidgets.QGraphicsItem.CacheMode
+    if viewscale is None or not CONFIG['item_cache'] or \
+       item.complexity() < CONFIG['item_cache_min_complexity']:
+        return mode.NoCache, QtCore.QSize()
+    scale = viewscale*sqrt(abs(item.sceneTransform().determinant()))
+    if not rotated and scale >= 1:
+        return mode.DeviceCoordinateCache, QtCore.QSize()
+    # round up to a power of 2 so the size only changes on doubling or halving
+    scale = pow(2, ceil(log2(max(scale, 1e-3))))
+    size = item.boundingRect().size()*scale
+    # item_cache_limit is in MB of 32 bit pixels
+    if size.width()*size.height() > CONFIG['item_cache_limit']*1024*1024/4/16:
+        return mode.NoCache, QtCore.QSize()
+    return mode.ItemCoordinateCache, QtCore.QSize(max(1, ceil(size.width())), max(1, ceil(size.height())))
+
+_openglavailable = None
+
+def openGLAvailable():
+    '''
+    Whether an OpenGL context can be made (checked once)
+    '''
+    global _openglavailable
+    if _openglavailable is None:
+        _openglavailable = QtGui.QOpenGLContext().create()
+    return _openglavailable
+
+def setOpenGLViewport(view, on):
+    '''
+    Draw view through OpenGL (a QOpenGLWidget viewport) when on, otherwise
+    with the software raster engine. Falls back to software when there is
+    no OpenGL. Returns whether OpenGL is used.
+    '''
+    if on and not openGLAvailable():
+        logging.warning("OpenGL is not available, drawing in software")
+        on = False
+    if on == view.viewport().inherits('QOpenGLWidget'):
+        return on
+
+    if on:
+        from PyQt6 import QtOpenGLWidgets
+        widget = QtOpenGLWidgets.QOpenGLWidget()
+        fmt = QtGui.QSurfaceFormat.defaultFormat()
+        fmt.setSamples(CONFIG['opengl_samples'])
+        widget.setFormat(fmt)
+        # the framebuffer isn't kept between frames so redraw all of it
+        view.setViewportUpdateMode(QtWidgets.QGraphicsView.ViewportUpdateMode.FullViewportUpdate)
+    else:
+        widget = QtWidgets.QWidget()
+        view.setViewportUpdateMode(QtWidgets.QGraphicsView.ViewportUpdateMode.SmartViewportUpdate)
+    # the old viewport is deleted, setupViewport() sets up the new one
+    view.setViewport(widget)
+    logging.info("Drawing %s", "with OpenGL" if on else "in software")
+    return on
+
 #----------------------------------------------------------------------
 class ContentItem:
 #----------------------------------------------------------------------
@@ -3794,12 +4342,20 @@ class InkItem(QtWidgets.QGraphicsPathItem, ContentItem):
         self.color = QtGui.QColor(self.get('color', '#000000'))
         self.color.setAlphaF(self.get('opacity', 1.0))
 
-        self.setinkpath(self['stroke'])
+        self.setinkpath(nexusgraph.DataToStroke(self['stroke']))
         self.setTransform(Transform(*self['frame']))
 
         # used to track moves, scales, etc
         self._changed = False
 
+    def complexity(self):
+        return self.path().elementCount()
+
+    def paint(self, painter, option, widget):
+        if self.cacheMode() != self.CacheMode.NoCache:
+            instrument.count('ItemCache.render')
+        super().paint(painter, option, widget)
+
     def keyPressEvent(self, event):
         for item in self.scene().selectedItems():
             if item.flags() & QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemIsFocusable:
@@ -3840,6 +4396,7 @@ class InkItem(QtWidgets.QGraphicsPathItem, ContentItem):
     #             item.save(batch=batch)
 
     def setinkpath(self, S):
+        t = instrument.start('InkItem.setinkpath')
 
         path = QtGui.QPainterPath(QtCore.QPointF(S[0][0], S[0][1]))
 
@@ -3884,6 +4441,8 @@ class InkItem(QtWidgets.QGraphicsPathItem, ContentItem):
         # TODO[autosave] remove the following?
         self.coords = S
 
+        instrument.stop('InkItem.setinkpath', t, points=len(S))
+
     def shape(self):
         # TODO performance
 
@@ -3999,7 +4558,7 @@ class TextWidthWidget(QtWidgets.QGraphicsPathItem):
         p = self.parentItem()
         p['maxwidth'] = p.textWidth()
         # p.stem.node.keyChanged('content')
-        p.stem.node.save(setchange=True)
+        p.stem.node.save(setchange=True, defer=True)
 
 
 # ----------------------------------------------------------------------
@@ -4084,6 +4643,7 @@ class TextItem(QtWidgets.QGraphicsTextItem, ContentItem):
         # body tag and ignore it and track the default font and color
         # ourselves
 
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(src, "html.parser")
 
         body = soup.find('body')
@@ -4316,7 +4876,7 @@ class TextItem(QtWidgets.QGraphicsTextItem, ContentItem):
                 self['source'] = src
                 # Need to mark node as changed
                 # self.stemnode.keyChanged('content')
-                self.stem.node.save(setchange=True)
+                self.stem.node.save(setchange=True, defer=True)
 
     def focusOutEvent(self,  event):
         QtWidgets.QGraphicsTextItem.focusOutEvent(self, event)
@@ -4498,6 +5058,198 @@ class TextItem(QtWidgets.QGraphicsTextItem, ContentItem):
             painter.drawRect(self.boundingRect())
         QtWidgets.QGraphicsTextItem.paint(self, painter, option, widget)
 
+#----------------------------------------------------------------------
+class StaticText:
+#----------------------------------------------------------------------
+    '''
+    Rich text laid out once and recorded as a picture, with its size, plain
+    text and the areas of any links. See staticText().
+
+    The picture only draws the text at the right size on devices with the
+    dpi it was recorded at (the screen), the document is kept to draw on
+    any other (PDFs and printers).
+    '''
+
+    __slots__ = ('picture', 'document', 'color', 'rect', 'plain', 'links')
+
+    def __init__(self, picture, document, color, rect, plain, links):
+        self.picture = picture
+        self.document = document
+        self.color = color
+        self.rect = rect
+        self.plain = plain
+        self.links = links
+
+# Laid out texts {(source hash, font, color, width): StaticText}, least recently used first
+STATICTEXTS = collections.OrderedDict()
+STATICTEXTSMAX = 2000
+
+
+def textDocument(source, font, maxwidth):
+    '''
+    A document laid out as TextItem lays out text in stem leaves
+    '''
+    doc = QtGui.QTextDocument()
+    doc.setDefaultFont(font)
+    doc.setHtml(source)
+    doc.setTextWidth(-1)
+    if doc.idealWidth() > maxwidth:
+        doc.setTextWidth(maxwidth)
+    # This is needed to make alignments work (as in Leaf)
+    doc.setTextWidth(doc.size().width())
+    return doc
+
+
+def staticText(source, font, color, maxwidth):
+    '''
+    Return the StaticText of html source, shared by texts that look the same
+    '''
+    key = (hashlib.sha1(source.encode('utf-8')).hexdigest(), font.key(), color, maxwidth)
+    text = STATICTEXTS.get(key)
+    if text is not None:
+        STATICTEXTS.move_to_end(key)
+        return text
+
+    t = instrument.start('staticText')
+    doc = textDocument(source, font, maxwidth)
+
+    picture = QtGui.QPicture()
+    painter = QtGui.QPainter(picture)
+    context = QtGui.QAbstractTextDocumentLayout.PaintContext()
+    context.palette.setColor(QtGui.QPalette.ColorRole.Text, QtGui.QColor(color))
+    doc.documentLayout().draw(painter, context)
+    painter.end()
+
+    # Find where the links are laid out
+    links = []
+    block = doc.begin()
+    while block.isValid():
+        layout = block.layout()
+        origin = layout.position()
+        it = block.begin()
+        while not it.atEnd():
+            fmt = it.fragment().charFormat()
+            if fmt.isAnchor() and len(fmt.anchorHref()) > 0:
+                start = it.fragment().position()-block.position()
+                end = start+it.fragment().length()
+                for ii in range(layout.lineCount()):
+                    line = layout.lineAt(ii)
+                    a = max(start, line.textStart())
+                    b = min(end, line.textStart()+line.textLength())
+                    if a < b:
+                        x1, x2 = line.cursorToX(a)[0], line.cursorToX(b)[0]
+                        rect = QtCore.QRectF(origin.x()+min(x1, x2), origin.y()+line.y(), abs(x2-x1), line.height())
+                        links.append((rect, fmt.anchorHref()))
+            it += 1
+        block = block.next()
+
+    text = StaticText(picture, doc, color, QtCore.QRectF(QtCore.QPointF(), doc.size()), doc.toPlainText(), links)
+    STATICTEXTS[key] = text
+    if len(STATICTEXTS) > STATICTEXTSMAX:
+        STATICTEXTS.popitem(last=False)
+    instrument.stop('staticText', t)
+    return text
+
+
+#----------------------------------------------------------------------
+class StaticTextItem(QtWidgets.QGraphicsItem, ContentItem):
+#----------------------------------------------------------------------
+    '''
+    Text in stem leaves. Nothing can be edited there so rather than hold a
+    QTextDocument like TextItem (used in the input dialog) the text is laid
+    out once into a StaticText that identical texts share.
+    '''
+
+    url = None
+
+    def __init__(self, uid, stem, parent=None):
+        self.uid = uid
+        self.stem = stem
+
+        super().__init__(parent)
+
+        self.font = QtGui.QFont(self.get("font_family", CONFIG['text_item_font_family']),
+                                self.get("font_size", CONFIG['text_item_font_size']))
+        self.color = self.get("color", CONFIG['text_item_color'])
+        self.maxTextWidth = self.get('maxwidth', CONFIG['text_item_width'])
+        self.text = staticText(self['source'], self.font, self.color, self.maxTextWidth)
+        self.setAcceptHoverEvents(len(self.text.links) > 0)
+
+        self.setFlag(QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, False)
+        self.setFlag(QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemIsMovable, False)
+        self.setFlag(QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemIsFocusable, False)
+        self.setZValue(self.get('z', 0))
+
+        self.setTransform(Transform(*self['frame']))
+
+    def setHtml(self, html):
+        self.prepareGeometryChange()
+        self.text = staticText(html, self.font, self.color, self.maxTextWidth)
+        self.setAcceptHoverEvents(len(self.text.links) > 0)
+        self.update()
+
+    def toHtml(self):
+        return textDocument(self['source'], self.font, self.maxTextWidth).toHtml()
+
+    def toPlainText(self):
+        return self.text.plain
+
+    def boundingRect(self):
+        return self.text.rect
+
+    def complexity(self):
+        # glyphs take about as long as 10 path elements
+        return 10*len(self.text.plain)
+
+    def paint(self, painter, option, widget):
+        if self.cacheMode() != self.CacheMode.NoCache:
+            instrument.count('ItemCache.render')
+        device = painter.device()
+        picture = self.text.picture
+        if device.logicalDpiX() == picture.logicalDpiX() and device.logicalDpiY() == picture.logicalDpiY():
+            painter.drawPicture(0, 0, picture)
+        else:
+            # drawPicture would scale the fonts by the difference in dpi
+            context = QtGui.QAbstractTextDocumentLayout.PaintContext()
+            context.palette.setColor(QtGui.QPalette.ColorRole.Text, QtGui.QColor(self.text.color))
+            self.text.document.documentLayout().draw(painter, context)
+
+    def linkAt(self, pos):
+        for rect, url in self.text.links:
+            if rect.contains(pos):
+                return url
+        return None
+
+    def hoverMoveEvent(self, event):
+        '''
+        Give some feed back when over a link.
+        '''
+        url = self.linkAt(event.pos())
+        if url == self.url:
+            return
+        self.url = url
+        if url is not None:
+            self.setCursor(QtCore.Qt.CursorShape.PointingHandCursor)
+            self.scene().statusMessage.emit(str(url))
+        else:
+            self.unsetCursor()
+            self.scene().statusMessage.emit("")
+
+    def hoverLeaveEvent(self, event):
+        if self.url is not None:
+            self.url = None
+            self.unsetCursor()
+            self.scene().statusMessage.emit("")
+
+    def mousePressEvent(self, event):
+        url = self.linkAt(event.pos())
+        if url is not None:
+            self.scene().linkClicked.emit(str(url))
+            return
+        # Normal actions
+        event.ignore()
+
+
 #----------------------------------------------------------------------
 class PixmapItem(QtWidgets.QGraphicsPixmapItem, ContentItem):
 #----------------------------------------------------------------------
@@ -4537,6 +5289,15 @@ class PixmapItem(QtWidgets.QGraphicsPixmapItem, ContentItem):
         # used to track moves, scales, etc
         self._changed = False
 
+    def complexity(self):
+        # smooth scaling touches every pixel
+        return self.pixmap().width()*self.pixmap().height()//1000
+
+    def paint(self, painter, option, widget):
+        if self.cacheMode() != self.CacheMode.NoCache:
+            instrument.count('ItemCache.render')
+        super().paint(painter, option, widget)
+
     def deleteNodeItem(self, batch=None):
         '''
         - Delete this item's data in node of graph database
@@ -4639,6 +5400,7 @@ class Leaf(QtWidgets.QGraphicsItem):
     boundingrect = QtCore.QRectF()
 
     def __init__(self, stem):
+        t = instrument.start('Leaf')
         super().__init__(parent=stem)
         self.stem = stem
         iconified = stem.node.get('iconified', False)
@@ -4654,9 +5416,7 @@ class Leaf(QtWidgets.QGraphicsItem):
                 if k['kind'] == 'Stroke':
                     item = InkItem(uid=u, stem=self.stem, parent=self)
                 elif k['kind'] == 'Text':
-                    item = TextItem(uid=u, stem=self.stem, parent=self)
-                    # This is needed to make alignments work:
-                    item.setTextWidth(item.boundingRect().width())
+                    item = StaticTextItem(uid=u, stem=self.stem, parent=self)
                 elif k['kind'] == 'Image':
                     item = PixmapItem(uid=u, stem=self.stem, parent=self)
 
@@ -4668,6 +5428,21 @@ class Leaf(QtWidgets.QGraphicsItem):
         self.tags = stem.node.get('tags', set())
 
         self.setBoundingRect()
+        self.applyCaching()
+        instrument.stop('Leaf', t)
+
+    def applyCaching(self):
+        '''
+        Set the cache mode of the content by the scene's policy (see itemCacheMode)
+        '''
+        scene = self.stem.scene()
+        for child in self.childItems():
+            if isinstance(child, ContentItem):
+                mode, size = itemCacheMode(child, scene.cachescale, scene.cacherotated)
+                # setting the mode throws away the cache, even when unchanged
+                if child.cacheMode() != mode or getattr(child, '_cachesize', None) != size:
+                    child.setCacheMode(mode, size)
+                    child._cachesize = size
 
     def e(self):
         return self.titlerect.bottomRight()
@@ -4685,7 +5460,7 @@ class Leaf(QtWidgets.QGraphicsItem):
         for child in self.childItems():
             rect = rect.united(self.mapRectFromItem(child, child.boundingRect()))
 
-            if not isinstance(child, QtWidgets.QGraphicsTextItem):
+            if not isinstance(child, (QtWidgets.QGraphicsTextItem, StaticTextItem)):
                 rect = rect.united(self.mapRectFromItem(child, child.childrenBoundingRect()))
 
         return rect
@@ -4705,6 +5480,24 @@ class Leaf(QtWidgets.QGraphicsItem):
         return self.boundingrect
 
 
+class LeafProxy(Leaf):
+    '''
+    Stands in for the leaf of a stem off screen in a virtual scene. It has the
+    geometry the leaf had when last built but none of its items.
+    '''
+##----------------------------------------------------------------------
+
+    def __init__(self, stem, titlerect, boundingrect):
+        QtWidgets.QGraphicsItem.__init__(self, parent=stem)
+        self.stem = stem
+        self.titlerect = titlerect
+        self.boundingrect = boundingrect
+        self.tags = stem.node.get('tags', set())
+
+    def applyCaching(self):
+        pass
+
+
 class OpenCloseWidget(QtWidgets.QGraphicsPathItem):
 
     def __init__(self, stem):
@@ -4723,21 +5516,16 @@ class OpenCloseWidget(QtWidgets.QGraphicsPathItem):
 
     def setSymbol(self):
 
-        childnodes = self.stem.node.outN('e.kind="Child"')
-        childstems = self.stem.childStems2
-
+        # Children as counted by the last renew of the stem's children
         # If no children .. don't show widget
-        if len(childnodes) == 0:
+        if self.stem.childcount == 0:
             self.hide()
             return
         else:
             self.show()
 
-        # Analyse children visibilities...
-        # Set to open if at least one is hidden
-        self.open = True
-        for child in childnodes:
-            self.open = self.open and 'hide' not in child
+        # Set to closed if at least one is hidden
+        self.open = self.stem.hiddencount == 0
 
         # parent = self.stem.parentStem()
         # if parent is None:
@@ -4779,13 +5567,13 @@ class OpenCloseWidget(QtWidgets.QGraphicsPathItem):
                 if dohide and 'hide' in child.get('tags', set()):
                     continue
                 child['hide'] = True
-                child.save(batch=batch, setchange=True)
+                child.save(batch=batch, setchange=True, defer=True)
         else:
             for child in childnodes:
                 if dohide and 'hide' in child.get('tags', set()):
                     continue
                 child.discard('hide')
-                child.save(batch=batch, setchange=True)
+                child.save(batch=batch, setchange=True, defer=True)
 
         self.stem.renew(create=False, position=False)
 
@@ -4920,6 +5708,9 @@ class StemItem(QtWidgets.QGraphicsItem):
 
         # Keep reference to QT child stems
         self.childStems2 = []
+        # Number of children in the map and how many are collapsed (have no StemItem)
+        self.childcount = 0
+        self.hiddencount = 0
 
         self.index = 0
 
@@ -4962,11 +5753,10 @@ class StemItem(QtWidgets.QGraphicsItem):
         # Widget for stem actions
         #
         # self.actionWidget = QtWidgets.QGraphicsEllipseItem(-10,0,10,10,self)
-        self.actionWidget = ActionWidget(self)
+        # Created when first selected (see paint)
+        self.actionWidget = None
         # self.actionWidget.setPen(QtGui.QPen(QtCore.Qt.GlobalColor.black, 1))
         # self.actionWidget.setBrush(QtGui.QBrush(QtGui.QColor(200,0,0,100)))
-        self.actionWidget.hide()
-        self.actionWidget.setZValue(90)
 
         #
         # Widget to add children
@@ -4981,11 +5771,10 @@ class StemItem(QtWidgets.QGraphicsItem):
         # path.lineTo(loc+QtCore.QPointF(0, 10))
         # self.childWidget.setPath(path)
         # self.childWidget = QtWidgets.QGraphicsEllipseItem(10,0,10,10,self)
-        self.childWidget = ChildWidget(self)
+        # Created when first selected (see paint)
+        self.childWidget = None
         # self.childWidget.setPen(QtGui.QPen(QtCore.Qt.GlobalColor.black, 1))
         # self.childWidget.setBrush(QtGui.QBrush(QtGui.QColor(0,200,0,100)))
-        self.childWidget.hide()
-        self.childWidget.setZValue(90)
 
         #
         # Widget to relocate stem
@@ -5032,6 +5821,7 @@ class StemItem(QtWidgets.QGraphicsItem):
             children = add/delete children
              recurse = renew down tree with same parameters
         '''
+        t = instrument.start('StemItem.renew')
 
         #
         # Reload the data
@@ -5048,8 +5838,11 @@ class StemItem(QtWidgets.QGraphicsItem):
             parent = self.parentStem()
             if parent is not None:
                 parent.childStems2.remove(self)
+                parent.hiddencount += 1
+                parent.openclose.setSymbol()
             # NB: unlike InkScene, removeItem here will not remove db item
             self.scene().removeItem(self)
+            instrument.stop('StemItem.renew', t)
             return
 
         p = self.base()
@@ -5059,7 +5852,7 @@ class StemItem(QtWidgets.QGraphicsItem):
             # Set the scale to the parent
             scale = self.style('scale')
             self.node['scale'] = scale
-            self.node.save()
+            self.node.save(defer=True)
         T = scaleRotateMove(float(scale), self.node.get('angle', 0.0), p.x(), p.y())
         self.setTransform(T)
 
@@ -5084,12 +5877,24 @@ class StemItem(QtWidgets.QGraphicsItem):
         # Manage the children
         #
         if children:
-            # Fetch from database
-            childNodes = self.node.outN('e.kind = "Child"')
-
-            # Exorcise ghost children
+            # While loading the number of children of every stem is known,
+            # don't query for the children of stems without any
+            counts = self.scene().childcounts
+            if len(counts) > 0 and counts.get(self.node['uid'], 0) == 0:
+                childNodes = []
+                self.childcount = self.hiddencount = 0
+            else:
+                # Fetch from database, only new children need their data decoded.
+                # Collapsed children are only counted, their stems are built when opened
+                allchildNodes = self.node.graph.childNodes(self.node['uid'])
+                childNodes = [n for n in allchildNodes if n['_hidden'] is None]
+                self.childcount = len(allchildNodes)
+                self.hiddencount = self.childcount-len(childNodes)
+            childuids = {n['uid'] for n in childNodes}
+
+            # Exorcise ghost (and collapsed) children
             for qc in list(self.childStems2):
-                if qc.node['uid'] not in childNodes:
+                if qc.node['uid'] not in childuids:
 
                     self.scene().removeItem(qc)
                     self.childStems2.remove(qc)
@@ -5098,7 +5903,7 @@ class StemItem(QtWidgets.QGraphicsItem):
             currentchilduids = [q.node['uid'] for q in self.childStems2]
             for n in childNodes:
                 if n['uid'] not in currentchilduids:
-                    child = StemItem(node=n, scene=self.scene(), parent=self)
+                    child = StemItem(node=n.item, scene=self.scene(), parent=self)
                     self.childStems2.append(child)
 
         #
@@ -5116,15 +5921,37 @@ class StemItem(QtWidgets.QGraphicsItem):
         if create or children:
             self.openclose.setSymbol()
 
-    def createLeaf(self):
+        if position:
+            # Stems may have moved into view, check again on the next repaint
+            self.scene().realisedrect = QtCore.QRectF()
+
+        instrument.stop('StemItem.renew', t)
+
+    def createLeaf(self, proxy=None):
+        '''
+        Build the leaf and its decorations. With proxy the leaf is only a
+        LeafProxy if the scene is virtual and has its geometry, by default
+        stems keep the kind of leaf they have.
+        '''
+        t = instrument.start('StemItem.createLeaf')
 
         # TODO check to see what needs to be changed instead of obliterating
 
+        if proxy is None:
+            proxy = self.leaf is None or isinstance(self.leaf, LeafProxy)
+        geometry = None
+        if proxy and self.depth > 0:
+            geometry = self.scene().leafGeometry(self)
+
         # First clear any old leaf items
         if self.leaf is not None:
             self.scene().removeItem(self.leaf)
 
-        self.leaf = Leaf(stem=self)
+        if geometry is not None:
+            self.leaf = LeafProxy(self, *geometry)
+        else:
+            self.leaf = Leaf(stem=self)
+            self.scene().builtLeaf(self)
         self.leaf.setZValue(10)
 
         # TODO removing this means central node in wrong place
@@ -5133,8 +5960,10 @@ class StemItem(QtWidgets.QGraphicsItem):
         #
         # Create stem index text to show order
         #
-        if self.depth == 0:
-            # No stem index on root
+        if self.indexBack is not None:
+            self.scene().removeItem(self.indexBack)
+        if self.depth == 0 or isinstance(self.leaf, LeafProxy):
+            # No stem index on root (or off screen)
             self.indexText = None
             self.indexBack = None
         else:
@@ -5194,6 +6023,10 @@ class StemItem(QtWidgets.QGraphicsItem):
         #
         if self.tagitems is not None:
             self.scene().removeItem(self.tagitems)
+            self.tagitems = None
+        if isinstance(self.leaf, LeafProxy):
+            instrument.stop('StemItem.createLeaf', t)
+            return
         self.tagitems = QtWidgets.QGraphicsItemGroup(self)
         tags = self.getTags()
         offset = 0
@@ -5228,6 +6061,8 @@ class StemItem(QtWidgets.QGraphicsItem):
             # TODO position the tags on central node somewhere visible
             self.tagitems.hide()
 
+        instrument.stop('StemItem.createLeaf', t)
+
     def positionLeaf(self):
         #
         # Position leaf
@@ -5281,6 +6116,35 @@ class StemItem(QtWidgets.QGraphicsItem):
         # self.openclose.setSymbol()
         self.redrawTail()
 
+    def realise(self):
+        '''
+        Build the leaf of a stem that only has a LeafProxy
+        '''
+        if not isinstance(self.leaf, LeafProxy):
+            return
+        titlerect = self.leaf.titlerect
+        self.createLeaf(proxy=False)
+        if self.leaf.titlerect != titlerect:
+            # The cached geometry was out of date, move the children along
+            for child in self.childStems2:
+                child.renew(reload=False, create=False, children=False)
+
+    def release(self):
+        '''
+        Swap the leaf of the stem for a LeafProxy to save memory, returns
+        False if the stem has to stay built (root, selected or being edited)
+        '''
+        scene = self.scene()
+        if self.depth == 0 or isinstance(self.leaf, LeafProxy) or self.isBeingEdited or self.isSelected():
+            return False
+        if any(item.hasFocus() for item in self.leaf.childItems()):
+            return False
+        # Note the geometry as it is now, the node may have changed since the leaf was built
+        scene.builtLeaf(self)
+        self.createLeaf(proxy=True)
+        scene.builtstems.pop(self, None)
+        return True
+
     def redrawTail(self):
         if self.depth > 0:
             Proot = self.mapFromParent(self.parentStem().tip())
@@ -5305,7 +6169,8 @@ class StemItem(QtWidgets.QGraphicsItem):
         self.childStems2.sort(key=lambda x: x.posangle())
         for i, child in enumerate(self.childStems2):
             child.index = i
-            child.indexText.setText(str(i))
+            if child.indexText is not None:
+                child.indexText.setText(str(i))
 
     def style(self, key):
 
@@ -5485,7 +6350,7 @@ class StemItem(QtWidgets.QGraphicsItem):
             # Direction or position may have changed
             batch = graphydb.generateUUID()
             for stem in stems:
-                stem.node.save(batch=batch, setchange=True)
+                stem.node.save(batch=batch, setchange=True, defer=True)
 
                 if stem.parentStem() is not None:
                     stem.parentStem().reindexChildren()
@@ -5728,9 +6593,10 @@ class StemItem(QtWidgets.QGraphicsItem):
         '''
         return title strings
         '''
+        self.realise()
         out = []
         for item in self.leaf.childItems():
-            if isinstance(item, TextItem):
+            if isinstance(item, StaticTextItem):
                 out.append(str(item.toPlainText()))
 
         return out
@@ -5783,6 +6649,7 @@ class StemItem(QtWidgets.QGraphicsItem):
 
         newstem = StemItem(newnode, parent=self)
         self.childStems2.append(newstem)
+        self.childcount += 1
 
         self.scene().showEditDialog.emit(newstem)
 
@@ -5845,6 +6712,11 @@ class StemItem(QtWidgets.QGraphicsItem):
     def paint(self, painter, option, widget):
 
         if self.isSelected():
+            if self.actionWidget is None:
+                self.actionWidget = ActionWidget(self)
+                self.actionWidget.setZValue(90)
+                self.childWidget = ChildWidget(self)
+                self.childWidget.setZValue(90)
             self.selectpath.show()
             t = self.tip()
             dW = 16  # distance from tip (don't obscure the open/close widget)
@@ -5859,7 +6731,7 @@ class StemItem(QtWidgets.QGraphicsItem):
             # self.childWidget.setPos(t.x()+self.direction()*dW, 0)
             self.childWidget.setPos(tt)
             self.childWidget.show()
-        else:
+        elif self.actionWidget is not None:
             self.selectpath.hide()
             self.actionWidget.hide()
             self.childWidget.hide()
@@ -120,7 +120,7 @@ from collections.abc import MutableMapping
 import apsw
 import logging
 from datetime import datetime
-import functools, itertools
+import itertools
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 
@@ -130,9 +130,13 @@ __version__ = 0.42
 RESERVED = ['uid','kind','ctime','mtime','startuid','enduid']
 '''Reserved keyword that cannot be used in node and edge data.'''
 
-FETCHKEYWORDS = ['WHERE','CHAIN','ORDER','LIMIT','GROUP', 'COUNT', 'DISTINCT', 'OFFSET', 'DEBUG']
+FETCHKEYWORDS = ['WHERE','CHAIN','ORDER','LIMIT','GROUP', 'COUNT', 'DISTINCT', 'OFFSET', 'DEBUG', 'LAZY', 'COLUMNS']
 '''Keywords used in `graphydb.Graph.fetch`, everything else is a parameter.'''
 
+PROFILE = None
+'''If set, called as `PROFILE(name, start, end, args)` with the `time.perf_counter` times 
+of each `Graph.fetch` and `Node.save`. Used to instrument the queries made.'''
+
 #-------------------------------------------------------------------------------- 
 def generateUUID():
     '''
@@ -202,43 +206,57 @@ def cleandata(fulldata):
 
 def diff(d1,d2,changedkeys):
     '''
-    Calculate a simple diff that takes dict d1 to d2.
+    Calculate a diff that takes dict d1 to d2.
     Only keys in the set changedkeys are considered.
     Keys starting with underscore are ignored.
+    
+    Keys added or removed are under '+' and '-' (changed values are in both),
+    keys holding dicts in both d1 and d2 are diffed in turn and kept under '~'
+    so a small change deep inside a big value only stores what changed.
+    '''
+    change = _dictdiff(d1, d2, {k for k in changedkeys if k[0] != '_'})
+    
+    if set(change.keys()) == {'+', '-'} and change['+'].keys() == change['-'].keys() == {'mtime'}:
+        change = {}
+        
+    return change
+
+def _dictdiff(d1, d2, keys=None):
+    '''
+    Diff of d1 to d2 for `graphydb.diff`, over all keys if keys is None
     '''
     remove = {}
     add = {}
+    nested = {}
     
     for k in d1.keys()|d2.keys():
-        if k[0] == '_':
-            continue
-        elif k in changedkeys:
-            ## only consider keys explicitly marked as changed
+        if keys is None or k in keys:
             if k not in d2:
                 remove[k] = d1[k]
             elif k not in d1:
                 add[k] = d2[k]
             elif d1[k]!=d2[k]:
                 ## only stored if values are actually different
-                remove[k] = d1[k]
-                add[k] = d2[k]
-            
-    if len(remove) == 1 and 'mtime' in remove and len(add) == 1 and 'mtime' in add:
-        remove = {}
-        add = {}
+                if isinstance(d1[k], dict) and isinstance(d2[k], dict):
+                    nested[k] = _dictdiff(d1[k], d2[k])
+                else:
+                    remove[k] = d1[k]
+                    add[k] = d2[k]
         
     change = {}
     if len(add)>0:
         change['+'] = add
     if len(remove)>0:
         change['-'] = remove
+    if len(nested)>0:
+        change['~'] = nested
         
     return change
 
 def patch(d, change, reverse=False):
     '''
-    Patch a dict based on a change dict.
-    Return a patched shallow copy.
+    Patch a dict based on a change dict (from `graphydb.diff`).
+    Return a patched copy, only dicts changed under '~' are copied as well.
     '''
     d2=dict(d)
     if reverse:
@@ -249,6 +267,8 @@ def patch(d, change, reverse=False):
         for k in change.get('-',{}).keys():
             del d2[k]
         d2.update(change.get('+',{}))
+    for k, c in change.get('~',{}).items():
+        d2[k] = patch(d2[k], c, reverse)
     return d2
 #-------------------------------------------------------------------------------- 
 class GraphyDBException(Exception):
@@ -268,23 +288,36 @@ class IndexedSet:
     for the object. This uid is what will be used to index the object and in set comparisons.
     
     Items are maintained in order and are indexed so can be looked up by uid. Internally, the data is 
-    stored in a dict `_index` *and* list `_list`, but these shouldn't be modified directly as
-    they need to be kept in sync.
-    
-    Speed of set operations are about 10x slower than native sets but with a much faster
-    creation time for populating the collection. Since set operations are already really fast, 
-    the collection has been optimised to reduce the creation time to have overall performance.
+    stored in an insertion ordered dict `_index` which is the single source of truth. A plain list of 
+    the items `_list` is only built when positional access is needed and is dropped (set to `None`)
+    whenever an operation would leave it stale, so removals and overwrites are O(1) and the cost of 
+    compacting the list is only paid once on the next positional access. Neither should be modified directly.
+    
+    Set operations work on the dicts directly and preserve order: items from the left operand first
+    followed by new items from the right. Where both sides hold an item with the same uid the
+    one from the left is kept.
     '''
+
+    __slots__ = ('_index', '_list')
         
-    def __init__(self, iterable=[]):
+    def __init__(self, iterable=()):
         '''
         Takes an interable of objects with a `__uid__()` method. 
         '''
+        ## N.B. with duplicate uids the position of the first and value of the last is kept
         self._index = {n.__uid__():n for n in iterable}
-        self._list = list(iterable)
-        if len(self._list) != len(self._index.keys()):
-            ## iterable contains duplicates. Base the list on the _index.
-            self._list = list(self._index.values())
+        self._list = None
+
+    @classmethod
+    def fromdict(cls, index):
+        '''
+        Bulk constructor from a dict of `{uid: item}`, which is used as is (not copied).
+        Avoids calling `__uid__()` on every item.
+        '''
+        new = cls.__new__(cls)
+        new._index = index
+        new._list = None
+        return new
 
     def copy(self):
         '''
@@ -293,12 +326,15 @@ class IndexedSet:
         This means any mutable objects inside the 
         collected object with be references to the original.
         '''
-        ## N.B. in __init__ a shallow copy is made anyway  
-        ## but it's faster to copy the parsed structures
-        new = self.__class__()
-        new._index = self._index.copy()
-        new._list = self._list.copy()
-        return new
+        return self.fromdict(self._index.copy())
+
+    def _items(self):
+        '''
+        Return the list of items, rebuilding it from the index if stale.
+        '''
+        if self._list is None:
+            self._list = list(self._index.values())
+        return self._list
 
     #
     # list methods
@@ -308,38 +344,52 @@ class IndexedSet:
         '''
         Sort items in place. Returns reference.
         '''
-        self._list.sort(key=key, reverse=reverse)
+        if key is None:
+            items = sorted(self._index.items(), key=lambda kv: kv[1], reverse=reverse)
+        else:
+            items = sorted(self._index.items(), key=lambda kv: key(kv[1]), reverse=reverse)
+        self._index = dict(items)
+        self._list = [v for k,v in items]
         return self
         
     def __getitem__(self, key):
-        if isinstance(key, slice):
-            return self.__class__(self._list[key])
-        elif isinstance(key, str):
+        if isinstance(key, str):
             return self._index[key]
+        elif isinstance(key, slice):
+            return self.__class__(self._items()[key])
+        elif self._list is None and key == 0 and len(self._index) > 0:
+            ## common case (e.g. `one`), don't build the list
+            return next(iter(self._index.values()))
+        elif self._list is None and key == -1 and len(self._index) > 0:
+            return next(reversed(self._index.values()))
         else:
-            return self._list[key]
+            return self._items()[key]
         
     def __iter__(self):  
-        return iter(self._list)
+        ## iterate over the list so the set can be modified while iterating
+        return iter(self._items())
     
     def reverse(self):
         '''
         Reverse item order in place. Returns reference.
         '''
-        self._list.reverse()
+        self._index = dict(reversed(self._index.items()))
+        if self._list is not None:
+            self._list.reverse()
         return self
 
     def __delitem__(self, i):
+        items = self._items()
         if isinstance(i, slice):
-            values = self._list[i]
+            values = items[i]
         else:
-            values = [self._list[i]]
+            values = [items[i]]
         for v in values:
             del self._index[v.__uid__()]
-        del self._list[i]
+        del items[i]
     
     def __repr__(self):
-        return "{{{}}}".format(self._list.__repr__()) 
+        return "{{{}}}".format(self._items().__repr__()) 
 
     def append(self, item):
         '''
@@ -347,10 +397,12 @@ class IndexedSet:
         overwriting and moving to end if present (by uid).
         Returns reference.
         '''
-        self.discard(item)
         uid = item.__uid__()
+        if self._index.pop(uid, None) is not None:
+            self._list = None
         self._index[uid] = item
-        self._list.append(item)  
+        if self._list is not None:
+            self._list.append(item)  
         return self
     
     #
@@ -361,8 +413,8 @@ class IndexedSet:
         '''
         Clear all the contents. Returns reference.
         '''
-        self._list = list()
         self._index = dict()
+        self._list = None
         return self
     
     def add(self, item):
@@ -372,27 +424,30 @@ class IndexedSet:
         Returns reference.
         '''
         uid = item.__uid__()
-        if uid in self._index:
-            current = self._index[uid]
-            self._index[uid] = item
-            idx = self._list.index(current)
-            self._list[idx] = item
-        else:
-            self._list.append(item)
-            self._index[uid]=item
+        current = self._index.get(uid)
+        self._index[uid] = item
+        if current is None:
+            if self._list is not None:
+                self._list.append(item)
+        elif current is not item:
+            self._list = None
         return self
 
+    def _drop(self, actualitem):
+        ## keep the list if the item was last (pop from end), otherwise it's stale
+        if self._list is not None:
+            if len(self._list) > 0 and self._list[-1] is actualitem:
+                self._list.pop()
+            else:
+                self._list = None
+
     def remove(self, item):
         '''
         Remove item (with same uid) from the collection.
         Raise KeyError if item not present.
         Returns reference.
         '''
-        uid = item.__uid__()
-        ## make sure it is the item in collection with same uid
-        actualitem = self._index[uid]
-        self._list.remove(actualitem)
-        del self._index[uid]
+        self._drop(self._index.pop(item.__uid__()))
         return self
      
     def discard(self, item):
@@ -401,12 +456,9 @@ class IndexedSet:
         Ignore if item not present.
         Returns reference.
         '''
-        uid = item.__uid__()
-        if uid in self._index:
-            ## make sure it is the item in collection with same uid
-            actualitem = self._index[uid]
-            self._list.remove(actualitem)
-            del self._index[uid]
+        actualitem = self._index.pop(item.__uid__(), None)
+        if actualitem is not None:
+            self._drop(actualitem)
         return self
     
     def __lt__(self, other):
@@ -421,33 +473,76 @@ class IndexedSet:
         return self._index.keys().__gt__(other._index.keys())
     def __ge__(self, other):
         return self._index.keys().__ge__(other._index.keys())
-    def __cmp__(self, other):
-        return self._index.keys().__cmp__(other._index.keys())
 
     def union(self, *others):
-        return functools.reduce(lambda x,y:x|y,others, self) 
+        return self.copy().__ior__(*others)
     def intersection(self, *others):
-        return functools.reduce(lambda x,y:x&y,others, self)
+        return self.copy().intersection_update(*others)
     def difference(self, *others):
-        return functools.reduce(lambda x,y:x-y,others, self)   
-
+        return self.copy().difference_update(*others)
     def symmetric_difference(self, other):
-        ## N.B. keys() has no symmetric_difference() so convert to full set first
-        keys = set(self._index.keys()).symmetric_difference(other._index.keys())
-        return self.__class__(conditionalyield(keys,self._index,other._index))
+        return self.copy().symmetric_difference_update(other)
 
     def __and__(self, other):
-        keys = self._index.keys().__and__(other._index.keys())
-        return self.__class__(conditionalyield(keys,self._index,other._index))
+        return self.intersection(other)
     def __xor__(self, other):
-        keys = self._index.keys().__xor__(other._index.keys())
-        return self.__class__(conditionalyield(keys,self._index,other._index))
+        return self.symmetric_difference(other)
     def __or__(self, other):
-        keys = self._index.keys().__or__(other._index.keys())
-        return self.__class__(conditionalyield(keys, self._index, other._index))
+        return self.union(other)
     def __sub__(self, other):
-        keys = self._index.keys().__sub__(other._index.keys())
-        return self.__class__(conditionalyield(keys, self._index, other._index))
+        return self.difference(other)
+
+    #
+    # in-place set methods
+    #
+
+    def __ior__(self, *others):
+        '''
+        Add items from others not already present (by uid). Returns reference.
+        '''
+        index = self._index
+        for other in others:
+            new = {k:v for k,v in other._index.items() if k not in index}
+            index.update(new)
+            if self._list is not None:
+                self._list.extend(new.values())
+        return self
+
+    def intersection_update(self, *others):
+        '''
+        Keep only the items also in all of others. Returns reference.
+        '''
+        for other in others:
+            oindex = other._index
+            self._index = {k:v for k,v in self._index.items() if k in oindex}
+        self._list = None
+        return self
+
+    def difference_update(self, *others):
+        '''
+        Remove the items in any of others. Returns reference.
+        '''
+        for other in others:
+            oindex = other._index
+            self._index = {k:v for k,v in self._index.items() if k not in oindex}
+        self._list = None
+        return self
+
+    def symmetric_difference_update(self, other):
+        '''
+        Keep items in either but not both sets. Returns reference.
+        '''
+        index = self._index
+        oindex = other._index
+        new = {k:v for k,v in index.items() if k not in oindex}
+        new.update({k:v for k,v in oindex.items() if k not in index})
+        self._index = new
+        self._list = None
+        return self
+
+    __iand__ = intersection_update
+    __isub__ = difference_update
+    __ixor__ = symmetric_difference_update
             
     #
     # common methods
@@ -466,7 +561,14 @@ class IndexedSet:
         '''
         Retrieves the item at location `idx` and also removes it. Defaults to end of list.
         '''
-        item = self._list.pop(idx)
+        if idx == -1:
+            if len(self._index) == 0:
+                raise IndexError('pop from empty set')
+            uid, item = self._index.popitem()
+            if self._list is not None:
+                self._list.pop()
+            return item
+        item = self._items().pop(idx)
         del self._index[item.__uid__()]
         return item
            
@@ -475,10 +577,13 @@ class IndexedSet:
         Uodate the existing items with the items in `*iterables`.
         Returns reference.
         '''
-        _add = self.add
+        index = self._index
         for iterable in iterables:
-            for value in iterable:
-                _add(value)
+            if isinstance(iterable, IndexedSet):
+                index.update(iterable._index)
+            else:
+                index.update((v.__uid__(), v) for v in iterable)
+        self._list = None
         return self
     
 #-------------------------------------------------------------------------------- 
@@ -486,6 +591,10 @@ class Graph:
     '''
     A graph composed of nodes and edges, both stored in SQLite database.
     '''
+
+    FLUSHAFTER = 2.0
+    '''Deferred saves (see `graphydb.Graph.defersave`) are written out once the oldest is this many seconds old.'''
+
     def __init__(self, path=':memory:'):
         '''
         Instantiating it without argument creates an in-memory database, 
@@ -497,6 +606,10 @@ class Graph:
         '''
         self.path = path
         self.changed = False
+        ## deferred saves {uid: (kind, ctime, mtime, json data)} and their change records
+        self._pending = {}
+        self._pendingchanges = []
+        self._pendingsince = None
         if os.path.exists(path):
             ## connect to existing database
             self.connection = apsw.Connection(self.path)
@@ -583,9 +696,21 @@ class Graph:
         
     def addchange(self, new=None, old=None, batch=None):
         
-        if new is None and old is None:
+        change = self._changerecord(new, old, batch)
+        if change is None:
             return
             
+        cursor=self.cursor()
+        row=cursor.execute('''INSERT INTO changes (change) VALUES (?)''', [change])
+        self.deleteoldchanges()
+
+    def _changerecord(self, new=None, old=None, batch=None):
+        '''
+        The JSON change record for undo or None if nothing changed
+        '''
+        if new is None and old is None:
+            return None
+            
         change = {}
         if new is None:
             ## this is a delete
@@ -599,7 +724,7 @@ class Graph:
             ## item internals have changed
             d = diff(old.data, new.data, new._changedkeys)
             if len(d) == 0:
-                return
+                return None
             
             change['uid'] = new['uid']
             change.update(d)
@@ -609,11 +734,165 @@ class Graph:
         if batch is not None:
             change['batch'] = batch
             
-        change = json.dumps(change)
-            
-        cursor=self.cursor()
-        row=cursor.execute('''INSERT INTO changes (change) VALUES (?)''', [change])
-        self.deleteoldchanges()
+        return json.dumps(change)
+
+    def defersave(self, node, batch=None, setchange=True):
+        '''
+        Queue a node to be written by `graphydb.Graph.flush`, used by `Node.save(defer=True)`.
+        
+        Repeated saves of the same node before the flush are merged into one write. The undo
+        change is still worked out now, against the node as last saved, so every save undoes
+        exactly as if it had been written straight away.
+        
+        Pending saves are flushed before the database is next used through `graphydb.Graph.cursor`
+        (so reads always see them), when the oldest is `FLUSHAFTER` seconds old, and on 
+        `graphydb.Graph.close`. Subclasses can also flush on an idle timer by overriding 
+        `graphydb.Graph.flushlater`.
+        '''
+        uid = node['uid']
+        data = json.dumps(cleandata(node.data))
+        
+        if setchange:
+            if uid in self._pending:
+                olddata = json.loads(self._pending[uid][3])
+            else:
+                olddata = None
+                ## not through self.cursor() which would flush the other pending saves
+                for row in self.connection.cursor().execute('SELECT data FROM nodes WHERE uid = ?', [uid]):
+                    olddata = json.loads(row[0])
+            old = None if olddata is None else Node(olddata, graph=self, changed=False)
+            change = self._changerecord(new=node, old=old, batch=batch)
+            if change is not None:
+                self._pendingchanges.append(change)
+        
+        ## most recently saved last
+        self._pending.pop(uid, None)
+        self._pending[uid] = (node['kind'], node['ctime'], node['mtime'], data)
+        
+        if self._pendingsince is None:
+            self._pendingsince = time.time()
+        if time.time()-self._pendingsince > self.FLUSHAFTER:
+            self.flush()
+        else:
+            self.flushlater()
+
+    def flushlater(self):
+        '''
+        Called after a save is deferred. Does nothing here, override to schedule a flush.
+        '''
+        pass
+
+    def flush(self):
+        '''
+        Write out the deferred saves in a single transaction. Returns the number of nodes written.
+        '''
+        if len(self._pending) == 0 and len(self._pendingchanges) == 0:
+            return 0
+        
+        if PROFILE is not None:
+            start = time.perf_counter()
+        
+        pending, changes = self._pending, self._pendingchanges
+        self._pending, self._pendingchanges, self._pendingsince = {}, [], None
+        
+        try:
+            cursor = self.cursor()
+            with self.connection:
+                cursor.executemany("INSERT OR REPLACE INTO nodes(uid, kind, ctime, mtime, data) VALUES(?,?,?,?,?)",
+                                   [(uid,)+row for uid, row in pending.items()])
+                if len(changes) > 0:
+                    cursor.executemany('''INSERT INTO changes (change) VALUES (?)''', [(c,) for c in changes])
+                    self.deleteoldchanges()
+        except:
+            ## keep them to try again
+            self._pending, self._pendingchanges, self._pendingsince = pending, changes, time.time()
+            raise
+        
+        if PROFILE is not None:
+            PROFILE('Graph.flush', start, time.perf_counter(), {'nodes': len(pending), 'changes': len(changes)})
+        
+        return len(pending)
+
+    def deleteOutFrom(self, uids, keep=(), batch=None, setchange=True):
+        '''
+        Delete the nodes with the given uids, everything reachable from them along out
+        edges, and every edge touching the deleted nodes, in a few set based statements.
+
+        - `keep`: node kinds that are only deleted if nothing outside the deleted set
+          still links to them (e.g. shared data nodes).
+        - `setchange`: record a single compact change so the whole delete can be undone
+          in one step.
+
+        Returns the number of nodes deleted.
+        '''
+        uids = list(uids)
+        if len(uids) == 0:
+            return 0
+
+        cursor = self.cursor()
+        with self.connection:
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS deleteuids(uid TEXT PRIMARY KEY);
+                DELETE FROM temp.deleteuids;
+            ''')
+            ## full descendant set, UNION (not UNION ALL) stops at cycles
+            cursor.execute('''
+                INSERT INTO temp.deleteuids
+                WITH RECURSIVE descendants(uid) AS (
+                    SELECT value FROM json_each(?)
+                    UNION
+                    SELECT e.enduid FROM edges e JOIN descendants d ON e.startuid = d.uid
+                )
+                SELECT d.uid FROM descendants d JOIN nodes n ON n.uid = d.uid
+            ''', [json.dumps(uids)])
+
+            if len(keep) > 0:
+                ## spare kept nodes that are still linked from outside the set
+                cursor.execute('''
+                    DELETE FROM temp.deleteuids WHERE uid IN (
+                        SELECT n.uid FROM nodes n JOIN temp.deleteuids d ON n.uid = d.uid
+                        WHERE n.kind IN (SELECT value FROM json_each(?))
+                        AND EXISTS (SELECT 1 FROM edges e WHERE e.enduid = n.uid
+                            AND e.startuid NOT IN (SELECT uid FROM temp.deleteuids)))
+                ''', [json.dumps(list(keep))])
+
+            EDGES = '''
+                SELECT uid FROM edges WHERE startuid IN (SELECT uid FROM temp.deleteuids)
+                UNION SELECT uid FROM edges WHERE enduid IN (SELECT uid FROM temp.deleteuids)'''
+
+            if setchange:
+                nodes = [json.loads(d) for d, in cursor.execute(
+                    'SELECT data FROM nodes WHERE uid IN (SELECT uid FROM temp.deleteuids)')]
+                edges = [json.loads(d) for d, in cursor.execute(
+                    'SELECT data FROM edges WHERE uid IN ({})'.format(EDGES))]
+
+            fts = {}
+            for table in ['edgefts', 'nodefts']:
+                if cursor.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?", [table]).fetchone()[0] > 0:
+                    where = 'uid IN ({})'.format(EDGES if table == 'edgefts' else 'SELECT uid FROM temp.deleteuids')
+                    if setchange:
+                        ## the FTS values can't be rebuilt from the data, keep them for undo
+                        columns = [x[1] for x in cursor.execute('PRAGMA table_info({})'.format(table)).fetchall()]
+                        fts[table] = [dict(zip(columns, row)) for row in cursor.execute(
+                            'SELECT {} FROM {} WHERE {}'.format(",".join(columns), table, where))]
+                    cursor.execute('DELETE FROM {} WHERE {}'.format(table, where))
+
+            cursor.execute('DELETE FROM edges WHERE uid IN ({})'.format(EDGES))
+            cursor.execute('DELETE FROM nodes WHERE uid IN (SELECT uid FROM temp.deleteuids)')
+            n = self.connection.changes()
+            cursor.execute('DELETE FROM temp.deleteuids')
+
+            if setchange and n > 0:
+                if batch is None:
+                    batch = generateUUID()
+                change = {'uid': uids[0], '-*': {'nodes': nodes, 'edges': edges, 'fts': fts},
+                          'time': time.time(), 'rev': generateUUID(), 'batch': batch}
+                cursor.execute('''INSERT INTO changes (change) VALUES (?)''', [json.dumps(change)])
+                self.deleteoldchanges()
+
+        if n > 0:
+            self.changed = True
+        return n
 
     def undo(self):
         '''
@@ -622,12 +901,28 @@ class Graph:
         changes = []
         changebatch=reversed(self.lastchanges())
         for i, change in changebatch:
-            if '+' in change and '-' not in change:
+            if '-*' in change:
+                ## bulk delete, restore nodes before the edges that reference them
+                action = "+"
+                cursor = self.cursor()
+                cursor.executemany("INSERT OR REPLACE INTO nodes(uid, kind, ctime, mtime, data) VALUES(?,?,?,?,?)",
+                    [(d['uid'], d['kind'], d['ctime'], d['mtime'], json.dumps(d)) for d in change['-*']['nodes']])
+                cursor.executemany("INSERT OR REPLACE INTO edges(uid, startuid, kind, enduid, ctime, mtime, data) VALUES(?,?,?,?,?,?,?)",
+                    [(d['uid'], d['startuid'], d['kind'], d['enduid'], d['ctime'], d['mtime'], json.dumps(d)) for d in change['-*']['edges']])
+                for table, rows in change['-*'].get('fts', {}).items():
+                    for row in rows:
+                        cursor.execute('INSERT INTO {}({}) VALUES ({})'.format(
+                            table, ",".join(row.keys()), ",".join(['?']*len(row))), list(row.values()))
+                self.changed = True
+                changes.extend((action, d['uid']) for d in change['-*']['nodes']+change['-*']['edges'])
+                self.deletechange(i)
+                continue
+            elif '+' in change and '-' not in change and '~' not in change:
                 ## change was to add item so undo removes it
                 action = "-"
                 item = self.getuid(change['uid'])
                 item.delete(setchange=False) 
-            elif '-' in change and '+' not in change:
+            elif '-' in change and '+' not in change and '~' not in change:
                 ## change was to remove item so undo adds it
                 action = "+"
                 data = change['-']
@@ -636,7 +931,7 @@ class Graph:
                 else:
                     item = Node(data, graph=self)
                 item.save(setchange=False)
-            elif '-' in change and '+' in change:
+            elif '~' in change or ('-' in change and '+' in change):
                 ## change was to add and remove internals so undo reverses them
                 action = "*"
                 item = self.getuid(change['uid'])
@@ -652,6 +947,7 @@ class Graph:
         '''
         Clean up database, reclaim space if changed.
         '''
+        self.flush()
         cursor=self.cursor()
         if self.changed:
             # Only reclaim space if DB changed (otherwise just looking changes it)
@@ -718,12 +1014,21 @@ class Graph:
         cursor=self.cursor()
         settings = cursor.execute('INSERT OR REPLACE INTO cache(key, value) VALUES(?,?)', (key, json.dumps(value)) )
 
+    def uncache(self, key):
+        '''
+        Remove the item cached under key, if there is one.
+        '''
+        cursor=self.cursor()
+        cursor.execute('DELETE FROM cache WHERE key = ?', [key])
+
     def cursor(self):
         '''
-        Return an APSW cursor.
+        Return an APSW cursor, after writing out any deferred saves.
         
         This can be used to excute SQL queries directly on the database.
         '''
+        if len(self._pending) > 0:
+            self.flush()
         return self.connection.cursor()
     
     @property
@@ -755,7 +1060,8 @@ class Graph:
                 sizestr = "%dM"%(size/1000000)
             S['File size']= sizestr
             
-        sversion = cursor.execute('SELECT sqlite_version()').fetchone()[0] 
+        # fetchall so the statement completes, left open it stops VACUUM on close
+        sversion = cursor.execute('SELECT sqlite_version()').fetchall()[0][0]
         S['SQLite version'] = sversion
         S['GraphyDB version'] = self.getsetting('GraphyDB version')
         
@@ -831,55 +1137,11 @@ class Graph:
     
         return aliases, collect
     
-    def fetch(self, CHAIN='(n)', WHERE=None, **args):
+    def _fetchquery(self, CHAIN, WHERE, args):
         '''
-        This is the workhorse for fetching nodes and edges from the database. It's a thin wrapper around
-        SQL so most of the SQL operators are available.
-        
-        **Keywords**
-        
-        - `CHAIN`: Description of how to join together nodes and edges for the query. 
-                   A chain is composed of links read from left to right separated by spaces. 
-                   Each link can be a node "(n)" or and edge "-(e)>" or "<(e)-". 
-                   e.g. "(n1) -[e:Document,title]> (n2)".
-                   The variable in the brackets is an alias for the link that can then be used 
-                   in other parts of the query and should be unique. 
-                   Square brackets indicate the link to be collected (otherwise defaults to right-most link).
-                   Square brackets can also have other aliases separated by commas, these should be defined in parameters passed
-                   to the function.
-        - `WHERE`: A string, or list of strings with SQL conditions. If it's a list the items will be ANDed together
-        - `GROUP`: String to follow SQLs GROUP BY
-        - `ORDER`: String to follow SQLs ORDER BY
-        - `LIMIT`: An interger to limit the numer of items returned
-        - `OFFSET`: Return items from offset, used in combination with `LIMIT`
-        - `COUNT`: The number of items satisfying the query will be returned
-        - `DISTINCT`: Distinct uids will be collected. [Defaults to `True`]
-        - `DEBUG`: If this is set to `True` the generated SQL and parameters will be returned without making the query.
-        
-        For convenience `CHAIN` and `WHERE` are the first two implicit parameters.
-        
-        **Parameters**
-        
-        Every other keyword is treated as a parameter for defining returned values, FTS searches or SQL escaped parameters. 
-        
-        Any extra aliases in the collected item should be defined as a parameter. The result will be available as a key 
-        in the item with the alias preceded by an underscore (i.e. an unsaved value). 
-        
-        If a parameter is the same as a link-alias with "_fts" appended then the value is to be
-        used in an FTS match. 
-        
-        Values to be SQL escaped whould be inserted by name (e.g. ':p1') where appropriate and the value given by a parameter
-        (e.g. p1=10).
-        
-        **Example**
-        
-            # Fetch the nodes of kind "Person" that are  
-            # connected by edges of kind "Author" to other 
-            # nodes of kind "Document" with tiles containing "Quantum"
-            # and also collect the author order
-            g.fetch('(n:Document) <(e:Author)- [p:Person,aorder]', n_fts='title: Quantum', aorder='e.data.order')
+        Build the SQL for `Graph.fetch` and `Graph.iterfetch`.
+        Returns the SQL, its parameters, the collected link and the names of the collected columns.
         '''
-        
         ## extract the SQL pieces with sensible defaults
         WHERE=ensurelist(WHERE)
         ORDER=args.get('ORDER', None)
@@ -888,7 +1150,8 @@ class Graph:
         OFFSET=args.get('OFFSET', None)
         COUNT=args.get('COUNT', False)
         DISTINCT=args.get('DISTINCT', True)    
-        DEBUG=args.get('DEBUG', False)
+        LAZY=args.get('LAZY', False)
+        COLUMNS=args.get('COLUMNS', None)
 
         ## everything else is a parameter of some sort
         PARAM = {k:v for k,v in args.items() if k not in FETCHKEYWORDS}
@@ -925,8 +1188,12 @@ class Graph:
         ##
         ## SELECT
         ##
-        collect['distinct'] = 'DISTINCT' if DISTINCT else ''
+        ## COLUMNS returns every row, rows with the same values aren't merged
+        collect['distinct'] = 'DISTINCT' if DISTINCT and (COLUMNS is None or COUNT) else ''
         colkeys = collect['columns'].copy()
+        if LAZY:
+            ## uid and kind are available without decoding the data
+            colkeys = ['uid', 'kind'] + colkeys
         colsql = ['{}.{}'.format(collect['alias'],c) for c in colkeys]
         for k,v in collect.get('extra',{}).items():
             colkeys.append(k)
@@ -934,6 +1201,9 @@ class Graph:
             v = expandfts(v, ftsexpansions)
             colsql.append(v)
 
+        if COLUMNS is not None:
+            colsql = [expandfts(jsonextract(c), ftsexpansions) for c in ensurelist(COLUMNS)]
+
         collect['collectcolumns'] = ', '.join(colsql)
         if COUNT:
             SQL.append('SELECT COUNT({distinct} {alias}.uid) FROM {table} {alias}'.format(**collect))
@@ -996,6 +1266,70 @@ class Graph:
             SQL.append(' OFFSET {}'.format(OFFSET))
     
         SQL = ''.join(SQL)
+
+        return SQL, PARAM, collect, colkeys
+
+    def fetch(self, CHAIN='(n)', WHERE=None, **args):
+        '''
+        This is the workhorse for fetching nodes and edges from the database. It's a thin wrapper around
+        SQL so most of the SQL operators are available.
+        
+        **Keywords**
+        
+        - `CHAIN`: Description of how to join together nodes and edges for the query. 
+                   A chain is composed of links read from left to right separated by spaces. 
+                   Each link can be a node "(n)" or and edge "-(e)>" or "<(e)-". 
+                   e.g. "(n1) -[e:Document,title]> (n2)".
+                   The variable in the brackets is an alias for the link that can then be used 
+                   in other parts of the query and should be unique. 
+                   Square brackets indicate the link to be collected (otherwise defaults to right-most link).
+                   Square brackets can also have other aliases separated by commas, these should be defined in parameters passed
+                   to the function.
+        - `WHERE`: A string, or list of strings with SQL conditions. If it's a list the items will be ANDed together
+        - `GROUP`: String to follow SQLs GROUP BY
+        - `ORDER`: String to follow SQLs ORDER BY
+        - `LIMIT`: An interger to limit the numer of items returned
+        - `OFFSET`: Return items from offset, used in combination with `LIMIT`
+        - `COUNT`: The number of items satisfying the query will be returned
+        - `DISTINCT`: Distinct uids will be collected. [Defaults to `True`]
+        - `DEBUG`: If this is set to `True` the generated SQL and parameters will be returned without making the query.
+        - `LAZY`: Collect `graphydb.LazyNode` or `graphydb.LazyEdge` proxies that only decode the data on first access 
+                  (other than `uid` and `kind`). Good for when most items are only checked for membership.
+        - `COLUMNS`: Don't build items at all, return a list with a tuple of the given columns for each row, 
+                  e.g. `COLUMNS=['n.uid', 'n.data.title']`. If a single string is given a list of values is returned.
+                  `DISTINCT` doesn't apply, rows with the same values are all returned.
+        
+        For convenience `CHAIN` and `WHERE` are the first two implicit parameters.
+        
+        **Parameters**
+        
+        Every other keyword is treated as a parameter for defining returned values, FTS searches or SQL escaped parameters. 
+        
+        Any extra aliases in the collected item should be defined as a parameter. The result will be available as a key 
+        in the item with the alias preceded by an underscore (i.e. an unsaved value). 
+        
+        If a parameter is the same as a link-alias with "_fts" appended then the value is to be
+        used in an FTS match. 
+        
+        Values to be SQL escaped whould be inserted by name (e.g. ':p1') where appropriate and the value given by a parameter
+        (e.g. p1=10).
+        
+        **Example**
+        
+            # Fetch the nodes of kind "Person" that are  
+            # connected by edges of kind "Author" to other 
+            # nodes of kind "Document" with tiles containing "Quantum"
+            # and also collect the author order
+            g.fetch('(n:Document) <(e:Author)- [p:Person,aorder]', n_fts='title: Quantum', aorder='e.data.order')
+        '''
+        
+        COUNT=args.get('COUNT', False)
+        DEBUG=args.get('DEBUG', False)
+        LAZY=args.get('LAZY', False)
+        COLUMNS=args.get('COLUMNS', None)
+
+        SQL, PARAM, collect, colkeys = self._fetchquery(CHAIN, WHERE, args)
+
         ##
         ## Return sql statement if debug
         ##
@@ -1003,43 +1337,136 @@ class Graph:
             return SQL, PARAM
         
         cursor=self.cursor()
+
+        if PROFILE is None:
+            rows = cursor.execute(SQL, PARAM)
+        else:
+            ## read all rows first so the decoding is timed separately
+            start = time.perf_counter()
+            rows = iter(cursor.execute(SQL, PARAM).fetchall())
+            queried = time.perf_counter()
             
-        ## faster to first create list
-        items = []
+        ## faster to first create a dict and bulk construct the set
+        items = {}
         
         ##
         ## COUNT
         ##
         if COUNT:
-            c = cursor.execute(SQL, PARAM).fetchone()[0]
-            return c
+            result = next(rows)[0]
+
+        ##
+        ## COLUMNS
+        ##
+        elif COLUMNS is not None:
+            if isinstance(COLUMNS, str):
+                result = [row[0] for row in rows]
+            else:
+                result = [tuple(row) for row in rows]
+
+        ##
+        ## LAZY
+        ##
+        elif LAZY:
+            Lazy = LazyNode if collect['type']=='node' else LazyEdge
+            extrakeys = colkeys[3:]
+            for row in rows:
+                extra = {'_'+c:v for c,v in zip(extrakeys, row[3:])} if extrakeys else None
+                items[row[0]] = Lazy(self, row[0], row[1], row[2], extra)
+            if collect['type']=='node':
+                result = NSet.fromdict(items)
+            else:
+                result = ESet.fromdict(items)
         
         ##
         ## COLLECT
         ##        
         elif collect['type']=='node':
-            for row in cursor.execute(SQL, PARAM):
-                args = json.loads(row[colkeys.index('data')])
-                for c,v in zip(colkeys, row):
-                    if c == 'data':
-                        continue                        
-                    else:
-                        args['_'+c] = v
-                N = Node(args, graph=self, changed=False)
-                items.append(N)
-            return NSet(items)
+            for row in rows:
+                N = self._rowitem(Node, row, colkeys)
+                items[N.data['uid']] = N
+            result = NSet.fromdict(items)
         
         else:
-            for row in cursor.execute(SQL, PARAM):
-                args = json.loads(row[colkeys.index('data')])
-                for c,v in zip(colkeys, row):
-                    if c == 'data':
-                        continue                        
-                    else:
-                        args['_'+c] = v
-                E = Edge(args, graph=self, changed=False)
-                items.append(E)
-            return ESet(items)
+            for row in rows:
+                E = self._rowitem(Edge, row, colkeys)
+                items[E.data['uid']] = E
+            result = ESet.fromdict(items)
+
+        if PROFILE is not None:
+            end = time.perf_counter()
+            PROFILE('Graph.fetch', start, end, {'sql': SQL, 'rows': 1 if COUNT else len(result),
+                                                'query ms': 1000*(queried-start), 'decode ms': 1000*(end-queried)})
+
+        return result
+
+    def _rowitem(self, itemclass, row, colkeys):
+        '''
+        Build a Node or Edge from a fetched row
+        '''
+        args = json.loads(row[colkeys.index('data')])
+        for c,v in zip(colkeys, row):
+            if c == 'data':
+                continue                        
+            else:
+                args['_'+c] = v
+        return itemclass(args, graph=self, changed=False)
+
+    def iterfetch(self, CHAIN='(n)', WHERE=None, CHUNK=None, **args):
+        '''
+        Generator version of `Graph.fetch` taking the same arguments. Items are yielded one at a time
+        so memory use doesn't grow with the number of items.
+
+        - `CHUNK`: if given, items are fetched in pages of this size ordered by uid (keyset pagination), 
+                   each page a separate query. Use this if the items are being modified while iterating, 
+                   e.g. saved, as the database is not read under an open cursor. Each item is
+                   yielded once whatever `DISTINCT` is.
+
+        `COUNT`, `COLUMNS` and `DEBUG` are not supported.
+
+            for n in g.iterfetch('[n:Stem]', CHUNK=500):
+                n['seen'] = True
+                n.save()
+        '''
+        for k in ['COUNT', 'COLUMNS', 'DEBUG']:
+            if args.get(k, False):
+                raise GraphyDBException("{} not supported by iterfetch".format(k))
+
+        if CHUNK is None:
+            SQL, PARAM, collect, colkeys = self._fetchquery(CHAIN, WHERE, args)
+            if args.get('LAZY', False):
+                Lazy = LazyNode if collect['type']=='node' else LazyEdge
+                extrakeys = colkeys[3:]
+                for row in self.cursor().execute(SQL, PARAM):
+                    extra = {'_'+c:v for c,v in zip(extrakeys, row[3:])} if extrakeys else None
+                    yield Lazy(self, row[0], row[1], row[2], extra)
+            else:
+                itemclass = Node if collect['type']=='node' else Edge
+                for row in self.cursor().execute(SQL, PARAM):
+                    yield self._rowitem(itemclass, row, colkeys)
+            return
+
+        for k in ['ORDER', 'LIMIT', 'OFFSET', 'GROUP']:
+            if k in args:
+                raise GraphyDBException("{} can't be used with CHUNK".format(k))
+
+        ## find the alias of the collected item for the uid ordering
+        aliases, collect = self._parsechain(CHAIN, {k:v for k,v in args.items() if k not in FETCHKEYWORDS})
+        alias = collect['alias']
+
+        ## one row per uid, whatever DISTINCT or the extra columns, so a short page means the end
+        ## and the next page can start after the last uid
+        WHERE = ensurelist(WHERE)+['{}.uid > :iterfetch_lastuid'.format(alias)]
+        args['GROUP'] = '{}.uid'.format(alias)
+        args['ORDER'] = '{}.uid'.format(alias)
+        args['LIMIT'] = int(CHUNK)
+        lastuid = ''
+        while True:
+            chunk = self.fetch(CHAIN, list(WHERE), iterfetch_lastuid=lastuid, **args)
+            yield from chunk
+            if len(chunk) < CHUNK:
+                break
+            lastuid = chunk[-1]['uid']
 
     def exists(self, uid):
         '''
@@ -1080,9 +1507,9 @@ class Graph:
         Convenience method to create a new `graphydb.Edge` linked to the database.
         '''
         
-        if isinstance(startuid, Node):
+        if isinstance(startuid, (Node, LazyNode)):
             startuid = startuid['uid']
-        if isinstance(enduid, Node):
+        if isinstance(enduid, (Node, LazyNode)):
             enduid = enduid['uid']  
         args.update({'kind':kind,'startuid':startuid, 'enduid':enduid })
             
@@ -1330,16 +1757,28 @@ class Node(GraphyDBItem):
             raise GraphyDBException("Must supply Node kind")        
         super().__init__(data, graph=graph, changed=changed)
         
-    def save(self, force=False, batch=None, setchange=True):
+    def save(self, force=False, batch=None, setchange=True, defer=False):
         '''
         Save the data to the database. Any keys that begin with "_" will *not* be saved.
         
         - `force`: if `True` will save regardless if item marked as changed.
+        - `defer`: queue the write to be merged with other saves (see `graphydb.Graph.defersave`).
         '''
         ## ignore if unforced and not changed
         if not force and not self.changed:
             return self        
         
+        if PROFILE is not None:
+            start = time.perf_counter()
+
+        if defer:
+            self.graph.defersave(self, batch=batch, setchange=setchange)
+            self.setChanged(False)
+            self.graph.changed = True
+            if PROFILE is not None:
+                PROFILE('Node.save', start, time.perf_counter(), {'kind': self['kind'], 'undo': setchange, 'deferred': True})
+            return self
+
         cursor = self.graph.cursor()
         data = cleandata(self.data)
                 
@@ -1354,6 +1793,9 @@ class Node(GraphyDBItem):
         
         self.setChanged(False)
         self.graph.changed = True
+
+        if PROFILE is not None:
+            PROFILE('Node.save', start, time.perf_counter(), {'kind': self['kind'], 'undo': setchange})
         return self
         
         
@@ -1391,11 +1833,12 @@ class Node(GraphyDBItem):
         ## modify the dict or lists withing the dict
         if args.get('COUNT', False):
             ## COUNT=True will fail as it doesn't check uniqueness across   
-            ## in and out sets fetch actual items and count in python
+            ## in and out sets so fetch just the uids and count in python
             args['COUNT'] = False
+            args['COLUMNS'] = 'e.uid'
             ine = self.inE(**copy.deepcopy(args))
             oute = self.outE(**copy.deepcopy(args))            
-            return len(ine|oute)
+            return len(set(ine).union(oute))
         else:
             ine = self.inE(**copy.deepcopy(args))
             oute = self.outE(**copy.deepcopy(args))            
@@ -1436,11 +1879,12 @@ class Node(GraphyDBItem):
         ## modify the dict or lists withing the dict 
         if args.get('COUNT', False):
             ## COUNT=True will fail as it doesn't check uniqueness across    
-            ## in and out sets fetch actual items and count in python
+            ## in and out sets so fetch just the uids and count in python
             args['COUNT'] = False
+            args['COLUMNS'] = 'n.uid'
             inn = self.inN(**copy.deepcopy(args))
             outn = self.outN(**copy.deepcopy(args))              
-            return len(inn|outn)
+            return len(set(inn).union(outn))
         else:
             inn = self.inN(**copy.deepcopy(args))
             outn = self.outN(**copy.deepcopy(args))            
@@ -1568,13 +2012,103 @@ class Edge(GraphyDBItem):
         return '({startuid})-[{uid}:{kind}]->({enduid})'.format(**self.data)
        
 
-#--------------------------------------------------------------------------------    
+#--------------------------------------------------------------------------------
+class LazyItem:
+    '''
+    Lightweight read-only proxy for a fetched row (see `LAZY` in `Graph.fetch`). Holds the raw
+    JSON and only decodes it into a full `graphydb.Node` or `graphydb.Edge` the first time a key
+    other than `uid`, `kind` or an extra collected alias (e.g. `_title`) is accessed. Any other 
+    attribute is passed through to the full item.
+    '''
+
+    __slots__ = ('graph', '_uid', '_kind', '_raw', '_extra', '_item')
+
+    ## set in derived classes
+    _itemclass = None
+
+    def __init__(self, graph, uid, kind, raw, extra=None):
+        self.graph = graph
+        self._uid = uid
+        self._kind = kind
+        self._raw = raw
+        self._extra = extra
+        self._item = None
+
+    def __uid__(self):
+        return self._uid
+
+    @property
+    def item(self):
+        '''
+        The full item, decoded on first access.
+        '''
+        if self._item is None:
+            data = json.loads(self._raw)
+            if self._extra is not None:
+                data.update(self._extra)
+            self._item = self._itemclass(data, graph=self.graph, changed=False)
+            self._raw = None
+        return self._item
+
+    def __getitem__(self, key):
+        if key == 'uid':
+            return self._uid
+        elif key == 'kind':
+            return self._kind
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        return self.item[key]
+
+    def get(self, key, default=None):
+        if key == 'uid':
+            return self._uid
+        elif key == 'kind':
+            return self._kind
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        return self.item.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.item[key] = value
+
+    def __contains__(self, key):
+        return key in ('uid', 'kind') or key in self.item
+
+    def __iter__(self):
+        return iter(self.item)
+
+    def __len__(self):
+        return len(self.item)
+
+    def __getattr__(self, name):
+        ## only called for attributes not found on the proxy, unset slots must not
+        ## go to self.item as it reads them (e.g. in copy.copy)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.item, name)
+
+    def __repr__(self):
+        if self._item is None:
+            return "{}({})".format(self.__class__.__name__, self._uid)
+        return repr(self._item)
+
+class LazyNode(LazyItem):
+    __slots__ = ()
+    _itemclass = Node
+
+class LazyEdge(LazyItem):
+    __slots__ = ()
+    _itemclass = Edge
+
+#--------------------------------------------------------------------------------
 class GraphyDBItemSet(IndexedSet):
     '''
     Super class of sets `graphydb.NSet` and `graphydb.ESet` holding nodes and edges.
     Operations between sets will be based entirely on the items  `__uid__()` not on their content.
     Methods will return a reference to itself where appropriate to allow chaining of commands.
     '''
+
+    __slots__ = ()
     
     def setGraph(self, graph, changed=True):
         '''
@@ -1607,18 +2141,18 @@ class GraphyDBItemSet(IndexedSet):
             fruits = ['Orange','Apple','Pear']
             barset = fooset.filter(lambda n: n['fruit'] in fruits])
         '''
-        ## ensure we have the same type of set: either NSet or Eset
-        out = self.__class__()
-        
         ## this way is about twice as slow as using filter
         ## but we can make it insensitive to missing keys etc
-        for item in self:
+        index = {}
+        for uid, item in self._index.items():
             try:
                 if function(item):
-                    out.add(item)
+                    index[uid] = item
             except:
                 pass
-        return out
+
+        ## ensure we have the same type of set: either NSet or Eset
+        return self.fromdict(index)
     
     def filter_fnmatch(self, **attr):
         '''
@@ -1628,9 +2162,9 @@ class GraphyDBItemSet(IndexedSet):
             barset = fooset.filter_fnmatch(title='Once Upon *')
         '''
         
-        out = self.__class__()
+        index = {}
         
-        for item in self:
+        for uid, item in self._index.items():
             found = True
             for key, pattern in attr.items():
                 try:
@@ -1639,9 +2173,9 @@ class GraphyDBItemSet(IndexedSet):
                     found = False
                     break  
             if found:
-                out.add(item)
+                index[uid] = item
                 
-        return out
+        return self.fromdict(index)
     
     @property
     def one(self):
@@ -1695,6 +2229,8 @@ class ESet(GraphyDBItemSet):
     '''
     A set holding edges with some agregate functionality.
     '''
+
+    __slots__ = ()
     
     @property
     def end(self):
@@ -1732,7 +2268,9 @@ class ESet(GraphyDBItemSet):
 class NSet(GraphyDBItemSet):
     '''
     A set holding nodes with some agregate functionality.
-    '''    
+    '''
+
+    __slots__ = ()
     
     def inE(self, WHERE=None, **args):
         '''
@@ -0,0 +1,326 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Opt-in timers and counters around the hot paths, to see why a map is slow.
+
+Nothing is recorded until enable() is called, from the Profiler dock or by
+starting with --profile. Code being timed does
+
+    t = instrument.start('StemItem.renew')
+    ... work ...
+    instrument.stop('StemItem.renew', t)
+
+and start() returns None straight away when disabled. Database queries are
+timed through the graphydb.PROFILE hook.
+
+Timings go to a ring buffer of trace events that can be saved in Chrome's
+trace event format (open in chrome://tracing or https://ui.perfetto.dev),
+and to totals per name shown by ProfilerWidget along with the frame times
+and the number of queries made since the last mouse press or key press.
+'''
+
+import time, json, os, threading, collections, logging
+
+from PyQt6 import QtCore, QtWidgets
+
+from . import graphydb, config
+
+CONFIG = config.get_config()
+
+ENABLED = False
+
+# trace events kept, the oldest are dropped
+MAXEVENTS = 200000
+
+# frame times kept for the overlay
+MAXFRAMES = 120
+
+_lock = threading.Lock()
+_events = collections.deque(maxlen=MAXEVENTS)
+_totals = {}
+_open = collections.Counter()
+_frames = collections.deque(maxlen=MAXFRAMES)
+_interaction = collections.Counter()
+_counts = collections.Counter()
+_origin = time.perf_counter()
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+    graphydb.PROFILE = record if on else None
+    logging.info("Profiling %s", "on" if on else "off")
+
+
+def reset():
+    global _origin
+    with _lock:
+        _events.clear()
+        _totals.clear()
+        _open.clear()
+        _frames.clear()
+        _interaction.clear()
+        _counts.clear()
+        _origin = time.perf_counter()
+
+
+def start(name):
+    '''
+    Start timing name, returns the start time or None if not enabled
+    '''
+    if not ENABLED:
+        return None
+    _open[name] += 1
+    return time.perf_counter()
+
+
+def stop(name, t, **args):
+    '''
+    Stop timing name started at t (from start()), args are kept with the event
+    '''
+    if t is None:
+        return
+    end = time.perf_counter()
+    _open[name] = max(0, _open[name]-1)
+    # only the outermost of recursive calls counts to the total
+    record(name, t, end, args, outermost=_open[name] == 0)
+
+
+def record(name, start, end, args=None, outermost=True):
+    with _lock:
+        _events.append((name, start, end, threading.get_ident(), args))
+        calls, total, worst = _totals.get(name, (0, 0.0, 0.0))
+        _totals[name] = (calls+1, total+(end-start if outermost else 0.0), max(worst, end-start))
+        _interaction[name] += 1
+        if args is not None and 'rows' in args:
+            _interaction['rows'] += args['rows']
+
+
+def count(name, n=1):
+    '''
+    Add n to the counter name (when enabled)
+    '''
+    if not ENABLED:
+        return
+    with _lock:
+        _counts[name] += n
+
+
+def counts():
+    with _lock:
+        return collections.Counter(_counts)
+
+
+def frame(t):
+    '''
+    End of a repaint started at t
+    '''
+    if t is None:
+        return
+    _frames.append(time.perf_counter()-t)
+    stop('NexusView.paint', t)
+
+
+def interaction(kind):
+    '''
+    Start counting the calls for a new interaction (mouse press, key press ...)
+    '''
+    if not ENABLED:
+        return
+    with _lock:
+        _interaction.clear()
+        t = time.perf_counter()
+        _events.append((kind, t, None, threading.get_ident(), None))
+
+
+def frames():
+    '''
+    Return (last, mean, worst) frame time in seconds of the recent repaints
+    '''
+    if len(_frames) == 0:
+        return 0.0, 0.0, 0.0
+    times = list(_frames)
+    return times[-1], sum(times)/len(times), max(times)
+
+
+def interaction_counts():
+    with _lock:
+        return collections.Counter(_interaction)
+
+
+def slowest(n=20):
+    '''
+    Return [(name, calls, total, worst), ...] with the largest total time first
+    '''
+    with _lock:
+        rows = [(name,)+v for name, v in _totals.items()]
+    rows.sort(key=lambda r: r[2], reverse=True)
+    return rows[:n]
+
+
+def chrome_trace():
+    '''
+    The recorded events as a Chrome trace event dict
+    '''
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+        origin = _origin
+
+    trace = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'Nexus'}}]
+    for name, start, end, tid, args in events:
+        e = {'name': name, 'cat': name.split('.')[0], 'pid': pid, 'tid': tid, 'ts': 1e6*(start-origin)}
+        if end is None:
+            e.update(ph='i', s='p')
+        else:
+            e.update(ph='X', dur=1e6*(end-start))
+        if args:
+            e['args'] = args
+        trace.append(e)
+
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def save_trace(path):
+    with open(path, 'w') as fp:
+        json.dump(chrome_trace(), fp)
+
+
+#----------------------------------------------------------------------
+class ProfilerWidget(QtWidgets.QWidget):
+#----------------------------------------------------------------------
+    '''
+    Live frame times, the queries of the current interaction and the
+    slowest call sites. Put in a dock of the main window.
+    '''
+
+    INPUT = {
+        QtCore.QEvent.Type.MouseButtonPress: 'input: mouse',
+        QtCore.QEvent.Type.TabletPress: 'input: tablet',
+        QtCore.QEvent.Type.TouchBegin: 'input: touch',
+        QtCore.QEvent.Type.KeyPress: 'input: key',
+        QtCore.QEvent.Type.Wheel: 'input: wheel',
+    }
+
+    def __init__(self, view, parent=None):
+        super().__init__(parent)
+        self.view = view
+
+        layout = QtWidgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        self.recordBox = QtWidgets.QCheckBox(self.tr("Record"))
+        self.recordBox.setChecked(ENABLED)
+        self.recordBox.toggled.connect(enable)
+        layout.addWidget(self.recordBox)
+
+        self.frameLabel = QtWidgets.QLabel()
+        layout.addWidget(self.frameLabel)
+        self.interactionLabel = QtWidgets.QLabel()
+        self.interactionLabel.setToolTip(self.tr("Calls since the last mouse, key or pen press"))
+        layout.addWidget(self.interactionLabel)
+
+        hlayout = QtWidgets.QHBoxLayout()
+        layout.addLayout(hlayout)
+        self.cacheBox = QtWidgets.QCheckBox(self.tr("Cache items"))
+        self.cacheBox.setToolTip(self.tr("Draw complex leaf content from cached pixmaps"))
+        self.cacheBox.setChecked(CONFIG['item_cache'])
+        self.cacheBox.toggled.connect(self.setItemCache)
+        hlayout.addWidget(self.cacheBox)
+        self.cacheLabel = QtWidgets.QLabel()
+        self.cacheLabel.setToolTip(self.tr("Cached items drawn and how many had to be rendered again"))
+        hlayout.addWidget(self.cacheLabel, 1)
+
+        self.table = QtWidgets.QTreeWidget()
+        self.table.setHeaderLabels([self.tr("Name"), self.tr("Calls"), self.tr("Total ms"),
+                                    self.tr("Mean ms"), self.tr("Worst ms")])
+        self.table.setRootIsDecorated(False)
+        layout.addWidget(self.table)
+
+        hlayout = QtWidgets.QHBoxLayout()
+        layout.addLayout(hlayout)
+        button = QtWidgets.QPushButton(self.tr("Reset"))
+        button.clicked.connect(self.reset)
+        hlayout.addWidget(button)
+        button = QtWidgets.QPushButton(self.tr("Save Trace..."))
+        button.setToolTip(self.tr("Save as Chrome trace events (chrome://tracing or ui.perfetto.dev)"))
+        button.clicked.connect(self.saveTrace)
+        hlayout.addWidget(button)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.refresh)
+
+        self.watchViewport()
+        view.installEventFilter(self)
+
+    def watchViewport(self):
+        # again when the view gets a new viewport (switching to or from OpenGL)
+        self.view.viewport().installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        kind = self.INPUT.get(event.type())
+        if kind is not None:
+            interaction(kind)
+        return False
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+
+    def reset(self):
+        reset()
+        self.refresh()
+
+    def setItemCache(self, on):
+        CONFIG['item_cache'] = on
+        self.view.scene().applyItemCaching()
+
+    def refresh(self):
+        self.recordBox.setChecked(ENABLED)
+
+        last, mean, worst = frames()
+        self.frameLabel.setText(self.tr("Frame: {:.1f} ms (mean {:.1f} ms, worst {:.1f} ms)").format(
+            1000*last, 1000*mean, 1000*worst))
+
+        counts = interaction_counts()
+        self.interactionLabel.setText(self.tr("Interaction: {} queries, {} rows, {} saves, {} renews").format(
+            counts['Graph.fetch'], counts['rows'], counts['Node.save'], counts['StemItem.renew']))
+
+        draws, renders = _counts['ItemCache.draw'], _counts['ItemCache.render']
+        self.cacheLabel.setText(self.tr("{} draws, {} renders ({:.0f}% hits)").format(
+            draws, renders, 100*(1-renders/draws) if draws > 0 else 0))
+
+        self.table.clear()
+        for name, calls, total, worst in slowest():
+            item = QtWidgets.QTreeWidgetItem([name, str(calls), "%.1f" % (1000*total),
+                                              "%.2f" % (1000*total/calls), "%.1f" % (1000*worst)])
+            for column in range(1, 5):
+                item.setTextAlignment(column, QtCore.Qt.AlignmentFlag.AlignRight)
+            self.table.addTopLevelItem(item)
+
+    def saveTrace(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, self.tr("Save Trace"), "nexus-trace.json",
+                                                        self.tr("Trace (*.json)"))
+        if path == '':
+            return
+        save_trace(path)
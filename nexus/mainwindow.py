@@ -18,22 +18,19 @@
 
 
 import xml.etree.ElementTree as et
-import sys,  zipfile,  io,  os, time, random, hashlib, json, shutil
+import sys,  zipfile,  io,  os, time, random, hashlib, json, shutil, base64
 from pathlib import Path
-from PyQt6 import QtCore, QtGui, QtOpenGL, QtSvg, QtWidgets, QtPrintSupport
-from PyQt6.QtMultimedia import QMediaCaptureSession, QAudioInput, QMediaRecorder, QMediaDevices, QAudioInput
+from PyQt6 import QtCore, QtGui, QtWidgets
 import gzip
 from functools import reduce
 import webbrowser, tempfile
 
 import webbrowser, urllib.parse, logging
-from . import graphics, resources, interpreter, graphydb, nexusgraph, config
+from . import graphics, interpreter, graphydb, nexusgraph, config, viewrender, instrument
 from math import sqrt, log, sinh, cosh, tanh, atan2, fmod, pi, cos, sin
 import re, subprocess
 import apsw
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-
 CONFIG = config.get_config()
 
 ## Used to preserve links in svg generation
@@ -316,8 +313,8 @@ def convert_to_full_tree(g):
     tagnodes.delete(disconnect=True, setchange=False)
 
     # Now expand out the items into separate nodes
-    stems = g2.fetch('[n:Stem]')
-    for s in stems:
+    # stems are saved as we go so fetch them in chunks
+    for s in g2.iterfetch('[n:Stem]', CHUNK=200):
         # Add content items
         for k in list(s.keys()):
             if k == 'tip':
@@ -375,9 +372,8 @@ def convert_to_partial_tree(g):
     # Clear undo chnages as they may not make sense anymore
     g.clearchanges()
 
-    stems = g.fetch('[n:Stem]')
-
-    for s in stems:
+    # stems are saved as we go so fetch them in chunks
+    for s in g.iterfetch('[n:Stem]', CHUNK=200):
         # Get content items - all have edge "In"
         edges = s.bothE('e.kind = "In"')
         content = {}
@@ -418,7 +414,232 @@ def convert_to_partial_tree(g):
     return g
 
 
+def convert_to_packed_strokes(g):
+    '''
+    Convert <0.92 to 0.92 style where pen strokes are packed strings (see
+    nexusgraph.StrokeToData) rather than lists of points
+    '''
+
+    # Keep a copy for earlier versions of Nexus, which can't read packed strokes
+    path = Path(g.path)
+    oldformat = path.with_suffix(".nex_pre092")
+    if oldformat.exists():
+        logging.warning("Not backing up pre 0.92 file, '%s' already exists", oldformat)
+    else:
+        logging.info("Backing up pre 0.92 file")
+        shutil.copy2(path, oldformat)
+
+    # Strokes in the undo history are left as lists, they can still be read
+    with g.connection:
+        for s in g.iterfetch('[n:Stem]', CHUNK=200):
+            content = s.get('content', {})
+            packed = False
+            for data in content.values():
+                if data.get('kind') == 'Stroke' and isinstance(data.get('stroke'), list):
+                    data['stroke'] = nexusgraph.StrokeToData(data['stroke'])
+                    packed = True
+            if packed:
+                s.keyChanged('content')
+                s.save(setchange=False)
+
+        g.savesetting('version', graphics.VERSION)
+
+    return g
+
+
+def load_or_convert_map(filename, message=logging.info, pack=True):
+    '''
+    Open the map at filename, converting it from the old zip format or earlier
+    versions if needed. message is called with progress messages.
+
+    Pen strokes in maps older than 0.92 are only packed (rewriting the whole
+    map) when pack is True. Maps that are just read, as when exporting, can
+    skip it as DataToStroke reads strokes in either format.
+
+    If the map is already open its connection is shared, hand it back with
+    nexusgraph.release_graph() when done.
+    '''
+    g = nexusgraph.shared_graph(filename)
+    if g is not None:
+        return g
+
+    try:
+        g = nexusgraph.NexusGraph(filename)
+        g.stats  # this will throw an Exception if it fails
+    except apsw.NotADBError:
+        message("{} is not a graphydb, converting...".format(filename))
+        g = convert_xml_to_graph(filename)
+
+    version = g.getsetting('version')
+    if version < 0.8:
+        message("{} version < 0.8, converting...".format(filename))
+        g = convert_to_full_tree(g)
+    if version < 0.9:
+        message("{} version < 0.9, converting...".format(filename))
+        g = convert_to_partial_tree(g)
+    if version < 0.92 and pack:
+        message("{} version < 0.92, packing pen strokes...".format(filename))
+        g = convert_to_packed_strokes(g)
+
+    return nexusgraph.share_graph(g)
+
+
+def add_application_fonts():
+    '''
+    Make the bundled ETBembo fonts available
+    '''
+    QtGui.QFontDatabase.addApplicationFont(":/images/et-book-roman-line-figures.ttf")
+    QtGui.QFontDatabase.addApplicationFont(":/images/et-book-bold-line-figures.ttf")
+    QtGui.QFontDatabase.addApplicationFont(":/images/et-book-display-italic-old-style-figures.ttf")
+    QtGui.QFontDatabase.addApplicationFont(":/images/et-book-semi-bold-old-style-figures.ttf")
+    QtGui.QFontDatabase.addApplicationFont(":/images/et-book-roman-old-style-figures.ttf")
+
+
+def export_svg(scene, path, precision=1, merge=True, compress=None, sides=None, size=(1920, 1080)):
+    '''
+    Write the scene to an SVG file at path, with working links and the
+    javascript for zooming and panning. Stems tagged "hide" are left out.
+
+    Path coordinates are rounded to precision decimal places, merge joins
+    paths and groups with the same style and compress writes gzipped svgz
+    (by default if path ends in .svgz). With sides, the (left, right) sides
+    of a view, only the view is drawn to fit size (width, height) pixels.
+    '''
+    # Build every stem of a virtual scene
+    scene.realiseStems()
+
+    # Remove background so it doesn't appear in svg
+    backgroundbrush = scene.backgroundBrush()
+    scene.setBackgroundBrush(QtGui.QBrush())
+
+    # Deselect everything
+    scene.clearSelection()
+
+    hiddenstems = []
+    R = QtCore.QRectF()
+    for child in scene.allChildStems(includeroot=False):
+        if 'hide' in child.getTags() and child.isVisible():
+            child.hide()
+            hiddenstems.append(child)
+        else:
+            R = R.united(child.boundingRect())
+
+
+    # Links are broken in SVGgenerator ... work around this
+    links = {}
+    textitems = []
+    linknumber = 0
+    shortlinknumber = 0
+    for stem in scene.allChildStems():
+        for textitem in stem.leaf.childItems():
+            if isinstance(textitem, graphics.StaticTextItem):
+                html = textitem.toHtml()
+                objs = et.fromstring(html)
+                # find any links
+                for link in objs.iter('a'):
+                    # QT puts a span with the link style in the text part!
+                    # SVGgenerator converts this to a drawn line :(
+                    span = link.find('span')
+                    if span is not None:
+                        text = span.text
+
+                        # replace some of text by index to form key
+                        # just replace first 3 out of 5 to avoid changing lengths too much
+                        # and causing wraping issues
+                        # change all if url text is smaller
+
+                        L = 5
+                        if len(text) >= L:
+                            randkey = text[:-L] + "%03d" % linknumber
+                            linknumber += 1
+                        else:
+                            randkey = "%02d" % shortlinknumber
+                            shortlinknumber += 1
+
+                        # store key - [url, original text]
+                        links[randkey] = {'url': link.attrib['href'], 'text': text}
+
+                        # replace text by random key so we can pick it up later in the svg
+                        span.text = randkey
+
+                        # set item's xml from html (may end up doing multiple times if multiple links)
+                        textitem.setHtml(et.tostring(objs).decode('utf-8'))
+
+                        # store item and html to restore after svg generation
+                        # duplicates won't matter
+                        textitems.append((textitem, html))
+
+                        # change the a-link to span and remove the undelying span
+                        # so we avoid the stupid underline decoration
+                        # link.clear()
+                        # link.tag = 'span'
+
+                        # replace text by random key so we can pick it up later in the svg
+                        # link.text = randkey
+
+    # Get the title of the root node
+    title = scene.root().titles()[0]
+
+    if sides is None:
+        # grab source rect, this will be same as target
+        # which makes transforms easy
+        sourceRect = scene.itemsBoundingRect()
+        viewBox = sourceRect.toRect()
+        offset = (-R.left(), -R.top())
+    else:
+        W, H = size
+        viewBox = QtCore.QRect(0, 0, W, H)
+        offset = (0, 0)
+
+    # Let Qt write to a temporary file, then clean it up in a single pass
+    fd, rawpath = tempfile.mkstemp(suffix='.svg')
+    os.close(fd)
+
+    from PyQt6 import QtSvg
+    generator = QtSvg.QSvgGenerator()
+
+    generator.setFileName(rawpath)
+    generator.setViewBox(viewBox)
+    generator.setTitle(title)
+    if sides is None:
+        generator.setDescription("A Nexus mindmap")
+    else:
+        generator.setSize(viewBox.size())
+        generator.setDescription("A Nexus mindmap view")
+
+    painter = QtGui.QPainter(generator)
+    if sides is None:
+        scene.render(painter, sourceRect, sourceRect)
+    else:
+        T = viewrender.view_transform(sides[0], sides[1], W, H)
+        viewrender.render_page(scene, painter, T, W, H)
+    painter.end()
+
+    # return text strings to previous
+    for textitem, html in textitems:
+        textitem.setHtml(html)
+
+    directory = Path(path).parent
+    if not directory.exists():
+        directory.mkdir(parents=True)
+
+    # tidy up, put back the links and wrap in a group for zooming and panning
+    from . import svgwriter
+    rewriter = svgwriter.SVGRewriter(links=links, offset=offset, script=NAVJS,
+                                     precision=precision, merge=merge)
+    try:
+        rewriter.rewrite(rawpath, path, compress=compress)
+    finally:
+        os.remove(rawpath)
+
+    for child in hiddenstems:
+        child.show()
+
+    scene.setBackgroundBrush(backgroundbrush)
+
+
 def createViewImage(view, width, height, removebackground=False):
+    t = instrument.start('createViewImage')
 
     # Get the size of your graphicsview
     rect = view.viewport().rect()
@@ -447,6 +668,7 @@ def createViewImage(view, width, height, removebackground=False):
         # Return previous background
         view.scene().setBackgroundBrush(oldbrush)
 
+    instrument.stop('createViewImage', t, width=width, height=height)
     return image
 
 #----------------------------------------------------------------------
@@ -528,20 +750,21 @@ class NexusApplication(QtWidgets.QApplication):
         self.windows = []
 
         self.setAttribute(QtCore.Qt.ApplicationAttribute.AA_DontShowIconsInMenus)
+        # Every pen sample is wanted for ink, don't let Qt merge tablet moves
+        self.setAttribute(QtCore.Qt.ApplicationAttribute.AA_CompressTabletEvents, False)
         menu = QtWidgets.QMenu(self.tr("&Window"))
         menu.aboutToShow.connect(self.updateWindowMenu)
 
-        QtGui.QFontDatabase.addApplicationFont(":/images/et-book-roman-line-figures.ttf")
-        QtGui.QFontDatabase.addApplicationFont(":/images/et-book-bold-line-figures.ttf")
-        QtGui.QFontDatabase.addApplicationFont(":/images/et-book-display-italic-old-style-figures.ttf")
-        QtGui.QFontDatabase.addApplicationFont(":/images/et-book-semi-bold-old-style-figures.ttf")
-        QtGui.QFontDatabase.addApplicationFont(":/images/et-book-roman-old-style-figures.ttf")
+        add_application_fonts()
 
         self.windowMenu = menu
 
         self.streaming = False
         self.streaming_ready_time = 0
 
+        # Don't lose deferred saves if quitting without the windows closing
+        self.aboutToQuit.connect(self.flushMaps)
+
     def updateWindowMenu(self):
         # First update indicators for active window
         activewindow = self.activeWindow()
@@ -564,6 +787,10 @@ class NexusApplication(QtWidgets.QApplication):
             act.triggered.connect(window.activateWindowViaMenu)
             self.windowMenu.addAction(act)
 
+    def flushMaps(self):
+        for window in self.windowList():
+            window.scene.graph.flush()
+
     def windowList(self):
         mainwindows = []
         for widget in self.topLevelWidgets():
@@ -579,8 +806,10 @@ class NexusApplication(QtWidgets.QApplication):
         logging.debug("raise or open: '%s'", fileName)
         if len(fileName) == 0:
             return None
+        # the same file through a relative path or a link is the same map
+        target = Path(fileName).resolve()
         for window in self.windowList():
-            if window.scene.graph.path == fileName:
+            if Path(window.scene.graph.path).resolve() == target:
                 w = window
                 logging.debug("Raising %s", fileName)
                 break
@@ -662,12 +891,14 @@ class NexusApplication(QtWidgets.QApplication):
     def toggleStreaminServer(self, start):
         if start:
 
+            from . import streaming
+
             logging.info('Starting streaming server...')
             self.streaming = True
             self.view_image = QtGui.QImage()
 
             self.streaming_thread = QtCore.QThread(parent=self)
-            self.streaming_daemon = StreamingDaemon(self)
+            self.streaming_daemon = streaming.StreamingDaemon(self)
             self.streaming_daemon.moveToThread(self.streaming_thread)
 
             self.streaming_thread.started.connect(self.streaming_daemon.run)
@@ -675,7 +906,7 @@ class NexusApplication(QtWidgets.QApplication):
 
             dialog = QtWidgets.QMessageBox()
             dialog.setText("Streaming")
-            dialog.setDetailedText(f"Nexus now streaming on\nhttp://{HOST}:{PORT}")
+            dialog.setDetailedText(f"Nexus now streaming on\nhttp://{streaming.HOST}:{streaming.PORT}")
             dialog.exec()
 
         else:
@@ -698,6 +929,7 @@ class NexusApplication(QtWidgets.QApplication):
             # Ignore if not streaming
             return
 
+        t = instrument.start('createViewImage')
         # Get the size of your graphicsview
         rect = view.viewport().rect()
 
@@ -726,73 +958,7 @@ class NexusApplication(QtWidgets.QApplication):
 
         self.view_image = image
         self.streaming_ready_time = time.time()
-
-#----------------------------------------------------------------------
-HOST, PORT = '127.0.0.1', 12345
-
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == "/":
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(bytes('<html><head></head><body style="background-color: rgba(0,0,0,0)!important;">', 'utf-8'))
-            self.wfile.write(bytes(f'<img src="http://{HOST}:{PORT}/stream.mjpg"/>', 'utf-8'))
-            self.wfile.write(bytes('</body></html>', 'utf-8'))
-            return
-
-        elif self.path == "/stream.mjpg":
-            self.send_response(200)
-            self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0')
-            self.send_header('Pragma', 'no-cache')
-            # self.send_header('Connection', 'close')
-            self.send_header("Content-type", "multipart/x-mixed-replace; boundary=frame")
-            self.end_headers()
-            interval = 0.05
-            self.served_image_timestamp = time.time() + interval
-            while self.server.app.streaming:
-                if self.served_image_timestamp + interval < time.time() \
-                   and self.served_image_timestamp < self.server.app.streaming_ready_time + 3*interval:
-                    self.wfile.write(bytes("--frame", 'utf-8'))
-                    self.send_header('Content-type', 'image/png')
-                    view_bytes = self.getImageBytes()
-                    self.send_header('Content-length', str(len(view_bytes)))
-                    self.end_headers()
-                    self.wfile.write(view_bytes)
-                    self.wfile.write(b'\r\n')
-                    self.served_image_timestamp = time.time()
-                else:
-                    time.sleep(interval)
-                    pass
-            return
-
-        else:
-            self.send_error(404)
-            self.end_headers()
-
-    def getImageBytes(self):
-
-        tic = time.time()
-        # Convert QImage to bytes
-        buffer = QtCore.QBuffer()
-        buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
-        ok = self.server.app.view_image.save(buffer, "PNG")
-        view_bytes = buffer.data().data()
-        toc = time.time()
-
-        return view_bytes
-
-
-class StreamingDaemon(QtCore.QObject):
-    def __init__(self, app):
-        super().__init__()
-        self.app = app
-
-    def run(self):
-        self._server = HTTPServer((HOST, PORT), RequestHandler)
-        self._server.app = self.app
-        self._server.serve_forever()
-
+        instrument.stop('createViewImage', t, width=1920, height=1080)
 
 #----------------------------------------------------------------------
 class MainWindow(QtWidgets.QMainWindow):
@@ -840,6 +1006,16 @@ class MainWindow(QtWidgets.QMainWindow):
         dock.dockLocationChanged.connect(self.views.locationChanged)
         dock.close()
 
+        #
+        # Profiler widget
+        #
+        dock = QtWidgets.QDockWidget(self.tr("Profiler"), self)
+        self.profilerAct = dock.toggleViewAction()
+        self.profiler = instrument.ProfilerWidget(self.view, dock)
+        dock.setWidget(self.profiler)
+        self.addDockWidget(QtCore.Qt.DockWidgetArea.RightDockWidgetArea, dock)
+        dock.close()
+
         self.createActions()
 
         self.createMenus()
@@ -849,6 +1025,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.scene.statusMessage.connect(self.showMessage)
         self.scene.linkClicked.connect(self.linkClicked)
+        self.scene.graph.watcher.changed.connect(self.onMapChanged)
 
         QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.CursorShape.WaitCursor)
 
@@ -909,36 +1086,15 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.setMode()
 
-        # Initialize file system watcher
-        # Not working - see notes in onFileChanged()
-        # self.file_watcher = QtCore.QFileSystemWatcher()
-        # self.file_watcher.addPath(fileName)
-        # logging.info(f"Watching file {fileName} for external changes.")
-        # self.file_watcher.fileChanged.connect(self.onFileChanged)
-
-    def onFileChanged(self):
-        '''
-        Update the current map if the file has changed externally (e.g. on a shared folder)
-        '''
-        logging.warn("File Changed externally!")
-
-        # Problems
-        # - DB seems to get locked into read-only state
-        # - Trying to renew connection as read-write can wipe the data!
-        # - This will also detect changes from this instance and saves are initiated from everywhere in the code
-        # Would have to write a pre- abd post- save hook to switch off watcher
-        # TODO how to elegantly recover?
-        # TODO switch off for own saves
-        # TODO What happens with open dialog?
-        # TODO Should this be on the application instance and we just add and remove files?
-
-        # graph = self.scene.root().node.graph
-        # import time
-        # time.sleep(5)
-        # graph.connection.close()
-        # #print("establishing new connection to ", graph.path)
-        # graph.connection = apsw.Connection(graph.path)
-        # self.scene.root().renew()
+    def onMapChanged(self, uids, kinds):
+        '''
+        Update the map after it was changed externally (e.g. on a shared folder),
+        only the stems affected are renewed
+        '''
+        self.scene.refreshStems(uids)
+        if len(kinds & {'View', 'Transition'}) > 0:
+            self.views.resetViewsFromGraph()
+        self.showMessage("Map changed externally, updated")
 
     def setDefaultSettings(self):
         '''
@@ -976,7 +1132,8 @@ class MainWindow(QtWidgets.QMainWindow):
     def closeEvent(self, event):
 
         self.writeSettings()
-        self.scene.graph.close()
+        self.scene.saveLeafGeometry()
+        nexusgraph.release_graph(self.scene.graph)
         event.accept()
 
     def activateWindowViaMenu(self):
@@ -1014,6 +1171,7 @@ class MainWindow(QtWidgets.QMainWindow):
             # Create graph file under original name and copy contents across
             self.showMessage("Copying %s -> %s" % (str(curpath), str(path)))
             g2 = nexusgraph.NexusGraph(str(path))
+            graph.flush()
             with g2.connection.backup("main", graph.connection, "main") as b:
                 while not b.done:
                     b.step(100)
@@ -1037,14 +1195,13 @@ class MainWindow(QtWidgets.QMainWindow):
         directory = Path(dialog.selectedFiles()[0])
 
         def getlinks(g, basepath):
-            stems = g.fetch('[n:Stem]')
             mappath = Path(g.path).parent
             links = set()
-            for stem in stems:
+            for stem in g.iterfetch('[n:Stem]'):
                 if 'tags' in stem and 'hide' in stem['tags']:
                     continue
-                for k, v in stem.items():
-                    if k.startswith('item') and v['kind'] == "Text":
+                for v in stem.get('content', {}).values():
+                    if v['kind'] == "Text":
                         # find any links
                         try:
                             objs = et.fromstring(v['source'])
@@ -1079,8 +1236,9 @@ class MainWindow(QtWidgets.QMainWindow):
             # pick a file and load it
             link = links.pop()
 
-            g = self.loadOrConvertMap(str(basepath.joinpath(link)))
+            g = self.loadOrConvertMap(str(basepath.joinpath(link)), pack=False)
             newlinks = getlinks(g, basepath)
+            nexusgraph.release_graph(g)
 
             # mark file as visited
             maps.add(link)
@@ -1098,20 +1256,26 @@ class MainWindow(QtWidgets.QMainWindow):
 
             # Copy entire graph to memory to modify so we don't mess up undo etc
             g = nexusgraph.NexusGraph()
-            gf = nexusgraph.NexusGraph(str(basepath.joinpath(m)))
+            gf = self.loadOrConvertMap(str(basepath.joinpath(m)), pack=False)
+            gf.flush()
             with g.connection.backup("main", gf.connection, "main") as b:
                 while not b.done:
                     b.step(100)
+            nexusgraph.release_graph(gf)
 
             for n in g.fetch('[n:Stem]', 'n.data.hide = 1'):
                 n.discard('hide').save()
             scene = graphics.NexusScene()
             scene.graph = g
+            scene.childcounts = g.childCounts()
             rootnodes = g.fetch('(r:Root) -(e:Child)> [n:Stem]')
 
-            for n in rootnodes:
-                root = graphics.StemItem(node=n, scene=scene)
-                root.renew(reload=False)
+            try:
+                for n in rootnodes:
+                    root = graphics.StemItem(node=n, scene=scene)
+                    root.renew(reload=False)
+            finally:
+                scene.childcounts = {}
 
             svgtarget = directory.joinpath(m).with_suffix('.svg')
             self.exportSVG(scene, str(svgtarget))
@@ -1156,234 +1320,63 @@ class MainWindow(QtWidgets.QMainWindow):
             pa, ext = os.path.splitext(str(self.scene.graph.path))
 
             fileName, dummy = QtWidgets.QFileDialog.getSaveFileName(self,
-                self.tr("Export SVG"), pa+'.svg', filter="SVG files (*.svg) ;; All files (*)")
+                self.tr("Export SVG"), pa+'.svg',
+                filter="SVG files (*.svg) ;; Compressed SVG files (*.svgz) ;; All files (*)")
             if len(fileName) == 0:
                 return False
             path, ext = os.path.splitext(str(fileName))
-            path += '.svg'
+            path += '.svgz' if ext.lower() == '.svgz' else '.svg'
 
         self.showMessage("Exporting SVG to %s" % path)
         logging.info("Exporting SVG to %s" % path)
 
-        # Remove background so it doesn't appear in svg
-        backgroundbrush = scene.backgroundBrush()
-        scene.setBackgroundBrush(QtGui.QBrush())
-
         # Clean up scene ready for export
         frames = False
         if self.viewsFramesAct.isChecked():
             frames = True
             self.viewsFramesAct.trigger()
 
-        # Deselect everything
-        scene.clearSelection()
+        export_svg(scene, path)
 
-        hiddenstems = []
-        R = QtCore.QRectF()
-        for child in scene.allChildStems(includeroot=False):
-            if 'hide' in child.getTags() and child.isVisible():
-                child.hide()
-                hiddenstems.append(child)
-            else:
-                R = R.united(child.boundingRect())
-
-
-        # Links are broken in SVGgenerator ... work around this
-        links = {}
-        textitems = []
-        linknumber = 0
-        shortlinknumber = 0
-        for stem in scene.allChildStems():
-            for textitem in stem.leaf.childItems():
-                if isinstance(textitem, graphics.TextItem):
-                    html = textitem.toHtml()
-                    objs = et.fromstring(html)
-                    # find any links
-                    for link in objs.iter('a'):
-                        # QT puts a span with the link style in the text part!
-                        # SVGgenerator converts this to a drawn line :(
-                        span = link.find('span')
-                        if span is not None:
-                            text = span.text
-
-                            # replace some of text by index to form key
-                            # just replace first 3 out of 5 to avoid changing lengths too much
-                            # and causing wraping issues
-                            # change all if url text is smaller
-
-                            L = 5
-                            if len(text) >= L:
-                                randkey = text[:-L] + "%03d" % linknumber
-                                linknumber += 1
-                            else:
-                                randkey = "%02d" % shortlinknumber
-                                shortlinknumber += 1
-
-                            # store key - [url, original text]
-                            links[randkey] = {'url': link.attrib['href'], 'text': text}
-
-                            # replace text by random key so we can pick it up later in the svg
-                            span.text = randkey
-
-                            # set item's xml from html (may end up doing multiple times if multiple links)
-                            textitem.setHtml(et.tostring(objs).decode('utf-8'))
-
-                            # store item and html to restore after svg generation
-                            # duplicates won't matter
-                            textitems.append((textitem, html))
-
-                            # change the a-link to span and remove the undelying span
-                            # so we avoid the stupid underline decoration
-                            # link.clear()
-                            # link.tag = 'span'
-
-                            # replace text by random key so we can pick it up later in the svg
-                            # link.text = randkey
-
-        # Get the title of the root node
-        title = scene.root().titles()[0]
+        if frames:
+            self.viewsFramesAct.trigger()
 
-        # grab source rect, this will be same as target
-        # which makes transforms easy
-        sourceRect = scene.itemsBoundingRect()
+    def exportTiles(self):
 
-        WIDTH = sourceRect.width()
-        HEIGHT = sourceRect.height()
+        pa, ext = os.path.splitext(str(self.scene.graph.path))
+        fileName, dummy = QtWidgets.QFileDialog.getSaveFileName(self,
+            self.tr("Export web tiles"), pa+'-tiles', filter="All files (*)")
+        if len(fileName) == 0:
+            return False
 
-        buff = QtCore.QBuffer()
-        buff.open(QtCore.QIODevice.OpenModeFlag.ReadWrite)
+        from . import export, tiles
 
-        generator = QtSvg.QSvgGenerator()
+        self.showMessage("Exporting web tiles to %s" % fileName)
+        logging.info("Exporting web tiles to %s" % fileName)
 
-        generator.setFileName(path)
-        generator.setOutputDevice(buff)
-        generator.setViewBox(sourceRect.toRect())
-        generator.setTitle(title)
-        generator.setDescription("A Nexus mindmap")
+        frames = False
+        if self.viewsFramesAct.isChecked():
+            frames = True
+            self.viewsFramesAct.trigger()
 
-        painter = QtGui.QPainter(generator)
-        scene.render(painter, sourceRect, sourceRect)
-        painter.end()
+        progress = QtWidgets.QProgressDialog("Rendering tiles...", "Abort", 0, 1, self)
+        progress.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(500)
+        app = QtWidgets.QApplication.instance()
 
-        # return text strings to previous
-        for textitem, html in textitems:
-            textitem.setHtml(html)
-
-        et.register_namespace("", "http://www.w3.org/2000/svg")
-        et.register_namespace("xlink", "http://www.w3.org/1999/xlink")
-        # why does this only sometimes get linked?
-
-        root = et.fromstring(buff.data())
-
-        # QT produces a whole lot of empty groups with lots of attributes.
-        # Collapse them here
-        for parentg in root.findall('{http://www.w3.org/2000/svg}g'):
-            for g in parentg.findall('{http://www.w3.org/2000/svg}g'):
-                if len(g) == 0:
-                    parentg.remove(g)
-
-        # wrap graphical elements in group for zooming and panning
-        G = et.Element('g')
-        G.set('id', 'viewcontrol')
-        G.set('transform', 'matrix(1,0,0,1,{},{})'.format(int(-R.left()), int(-R.top())))
-        for e in list(root):
-            if e.tag in ['{http://www.w3.org/2000/svg}g']:
-                G.append(e)
-                root.remove(e)
-        root.append(G)
-
-        # this plays havock with zoom
-        if 'viewBox' in root.attrib:
-            del root.attrib['viewBox']
-
-        root.set('id', 'nexusmap')
-        root.set('width', '100%')
-        root.set('height', '100%')
-
-        # go through and change links to nex files to actual links to svg files
-        for txtxml in root.iter('{http://www.w3.org/2000/svg}text'):
-            if txtxml.text in links:
-                url = links[txtxml.text]['url']
-
-                # convert .nex to .svgz
-                basename, ext = os.path.splitext(url)
-                if ext == '.nex':
-                    url = basename+'.svg'
-
-                text = links[txtxml.text]['text']
-
-                linkxml = et.Element('a', {'{http://www.w3.org/1999/xlink}href': url,
-                                           'fill': 'blue'})
-                linkxml.text = text
-                txtxml.text = ''
-                txtxml.append(linkxml)
-
-        # TODO how to delete them entirely?
-        for g in root.iter('{http://www.w3.org/2000/svg}g'):
-            # remove default value
-            # TODO problems if nested withon an opacity!=1 ?
-            if g.get('fill-opacity', '') == '1':
-                del g.attrib['fill-opacity']
-
-            # remove font attributes from groups that have only paths or images
-            # and line attributes (and font since in text) from only text groups
-            onlypath = True
-            onlytext = True
-            for c in g:
-                if c.tag not in ['{http://www.w3.org/2000/svg}path',
-                                 '{http://www.w3.org/2000/svg}image']:
-                    onlypath = False
-                elif c.tag not in ['{http://www.w3.org/2000/svg}text']:
-                    onlytext = False
-            if onlypath:
-                for a in ['font-family', 'font-size', 'font-weight',
-                          'font-style']:
-                    if a in g.attrib:
-                        del g.attrib[a]
-            if onlytext:
-                for a in ['fill', 'stroke', 'stroke-linecap', 'stroke-linejoin',
-                          'stroke-opacity', 'stroke-width',
-                          'font-family', 'font-size', 'font-style',
-                          'font-weight']:
-                    if a in g.attrib:
-                        del g.attrib[a]
-
-        # truncate numbers - don't need full precision
-        # TODO % rounding would be better
-        simpledec = re.compile(r'\d*\.\d+')
-
-        def mround(match):
-            return "{:.1f}".format(float(match.group()))
-
-        for p in root.iter('{http://www.w3.org/2000/svg}path'):
-            d = p.get('d')
-            d2 = re.sub(simpledec, mround, d)
-            p.set('d', d2)
-
-            # remove default values
-            if p.get('vector-effect', '') == 'none':
-                del p.attrib['vector-effect']
-
-        script = et.Element('script')
-        script.text = NAVJS
-        script.tail = "\n"
-        root.append(script)
-
-        tree = et.ElementTree(root)
-
-        directory = Path(path).parent
-        if not directory.exists():
-            directory.mkdir(parents=True)
-
-        with open(path, 'wb') as f:
-            tree.write(f, method='html')
+        def update(done, total):
+            progress.setMaximum(total)
+            progress.setValue(done)
+            app.processEvents()
+            return not progress.wasCanceled()
+
+        page = tiles.export_tiles(self.scene, fileName, export.view_sides(self.scene.graph), progress=update)
+        progress.close()
 
         if frames:
             self.viewsFramesAct.trigger()
-        for child in hiddenstems:
-            child.show()
 
-        scene.setBackgroundBrush(backgroundbrush)
+        self.showMessage("Exported web tiles to %s" % page)
 
     def about(self):
         QtWidgets.QMessageBox.about(self, self.tr("About Nexus"),
@@ -1426,6 +1419,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.exportLinkedSVGsAct.setStatusTip(self.tr("Recursively export all linked maps as SVG"))
         self.exportLinkedSVGsAct.triggered.connect(self.exportLinkedSVGs)
 
+        self.exportTilesAct = QtGui.QAction(QtGui.QIcon(":/images/export.svg"),
+                                            self.tr("Export web tiles..."), self)
+        self.exportTilesAct.setStatusTip(self.tr("Export the map as zoomable tiles with a viewer page"))
+        self.exportTilesAct.triggered.connect(self.exportTiles)
+
         self.exportTextAct = QtGui.QAction(QtGui.QIcon(":/images/export.svg"),
                                            self.tr("Export text..."), self)
         self.exportTextAct.setStatusTip(self.tr("Export text as outline"))
@@ -1580,6 +1578,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.clearUndoHistoryAct.setStatusTip(self.tr("Clear all undo history"))
         self.clearUndoHistoryAct.triggered.connect(self.sceneClearUndoHistory)
 
+        # ----------------------------------------------------------------------------------
+        self.searchMapsAct = QtGui.QAction(self.tr("Search All Maps..."), self)
+        self.searchMapsAct.setShortcut(self.tr("Ctrl+Shift+F"))
+        self.searchMapsAct.setStatusTip(self.tr("Search the text and tags of all maps in a folder"))
+        self.searchMapsAct.triggered.connect(self.searchMaps)
+
         # ----------------------------------------------------------------------------------
         self.aboutAct = QtGui.QAction(self.tr("About"), self)
         self.aboutAct.setMenuRole(QtGui.QAction.MenuRole.AboutRole)
@@ -1729,6 +1733,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.viewFullscreenPresentationAct.setCheckable(True)
         self.viewFullscreenPresentationAct.setChecked(True)
         
+        # ----------------------------------------------------------------------------------
+        self.openGLAct = QtGui.QAction(self.tr("Use OpenGL"), self)
+        self.openGLAct.setCheckable(True)
+        self.openGLAct.setChecked(self.view.viewport().inherits('QOpenGLWidget'))
+        self.openGLAct.triggered.connect(self.setOpenGL)
+
         # ----------------------------------------------------------------------------------
         self.setBackgroundAct = QtGui.QAction(self.tr("Set Background..."), self)
         self.setBackgroundAct.triggered.connect(self.sceneSetBackground)
@@ -1770,6 +1780,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.fileMenu.addSeparator()
         self.fileMenu.addAction(self.exportSVGAct)
         self.fileMenu.addAction(self.exportLinkedSVGsAct)
+        self.fileMenu.addAction(self.exportTilesAct)
         self.fileMenu.addAction(self.exportTextAct)
         self.fileMenu.addSeparator()
         self.fileMenu.addAction(self.closeAct)
@@ -1799,6 +1810,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.editMenu.addAction(self.setOpacityAct)
         self.editMenu.addAction(self.toggleIconifyAct)
         self.editMenu.addSeparator()
+        self.editMenu.addAction(self.searchMapsAct)
+        self.editMenu.addSeparator()
         self.editMenu.addAction(self.clearUndoHistoryAct)
 
         self.viewMenu = self.menuBar().addMenu(self.tr("&View"))
@@ -1816,6 +1829,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.viewMenu.addAction(self.viewsFramesAct)
         self.viewMenu.addAction(self.viewRotateAct)
         self.viewMenu.addAction(self.viewFullscreenPresentationAct)
+        self.viewMenu.addAction(self.openGLAct)
         self.viewMenu.addAction(self.setBackgroundAct)
         self.viewMenu.addAction(self.hidePointerAct)
         self.viewMenu.addAction(self.runStreamingServerAct)
@@ -1825,6 +1839,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.viewMenu.addAction(self.viewsHomeAct)
         self.viewMenu.addAction(self.viewsNextAct)
         self.viewMenu.addAction(self.viewsPreviousAct)
+        self.viewMenu.addSeparator()
+        self.viewMenu.addAction(self.profilerAct)
 
         self.recMenu = self.menuBar().addMenu(self.tr("&Recording"))
         self.recMenu.addAction(self.recStartAct)
@@ -1963,29 +1979,13 @@ class MainWindow(QtWidgets.QMainWindow):
         if len(parents) == 0:
             self.scene.root().renew()
 
-    def loadOrConvertMap(self, filename):
+    def loadOrConvertMap(self, filename, pack=True):
         '''
         Load the old zip format
         Create a graphydb in memory
         Move to file
         '''
-
-        try:
-            g = nexusgraph.NexusGraph(filename)
-            g.stats  # this will throw an Exception if it fails
-        except apsw.NotADBError:
-            self.showMessage("{} is not a graphydb, converting...".format(filename))
-            g = convert_xml_to_graph(filename)
-
-        version = g.getsetting('version')
-        if version < 0.8:
-            self.showMessage("{} version < 0.8, converting...".format(filename))
-            g = convert_to_full_tree(g)
-        if version < 0.9:
-            self.showMessage("{} version < 0.9, converting...".format(filename))
-            g = convert_to_partial_tree(g)
-
-        return g
+        return load_or_convert_map(filename, message=self.showMessage, pack=pack)
 
     def loadMap(self, filename):
         '''
@@ -2004,10 +2004,23 @@ class MainWindow(QtWidgets.QMainWindow):
 
             # Find base items and create trees
             # TODO there should only be 1 root item - check
+            scene.childcounts = g.childCounts()
+            # Big maps only build the stems near the view
+            threshold = CONFIG['virtual_scene_stems']
+            if 0 <= threshold <= sum(scene.childcounts.values()):
+                scene.virtual = True
+                scene.loadLeafGeometry()
+
             rootnodes = g.fetch('(r:Root) -(e:Child)> [n:Stem]')
-            for n in rootnodes:
-                root = graphics.StemItem(node=n, scene=scene)
-                root.renew(reload=False)
+            try:
+                for n in rootnodes:
+                    root = graphics.StemItem(node=n, scene=scene)
+                    root.renew(reload=False)
+            finally:
+                scene.childcounts = {}
+
+            scene.saveLeafGeometry()
+            scene.trimLeaves()
 
         except ValueError as e:
             error = 'Failed to open file "%s": %s' % (filename, e)
@@ -2069,84 +2082,39 @@ class MainWindow(QtWidgets.QMainWindow):
     def printViews(self, printer):
 
         VIEWS = self.views.viewsModel.rowCount(0)
-        VIEWSIDES = self.view.getViewSides()
         painter = QtGui.QPainter(printer)
 
-        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
-        painter.setRenderHint(QtGui.QPainter.RenderHint.TextAntialiasing)
-        painter.setRenderHint(QtGui.QPainter.RenderHint.SmoothPixmapTransform)
-
         self.scene.clearSelection()
         scenebrush = self.scene.backgroundBrush()
         self.scene.setBackgroundBrush(QtGui.QBrush(QtCore.Qt.BrushStyle.NoBrush))
 
-        # targetRect = QtCore.QRectF(0, 0, painter.device().width(), painter.device().height())
-        targetRect = QtCore.QRectF(0, 0, painter.device().width(),
-                                   painter.device().height())
-
-        # keep a record of the visible stems, will hide stems not in view to save space.
-        visibleStems = []
-        for stem in self.scene.allChildStems():
-            if stem.isVisible():
-                visibleStems.append(stem)
-
         W = painter.device().width()
         H = painter.device().height()
 
+        # as in presentation mode the sides of each view span the page width
+        pages = []
         for ii in range(VIEWS):
             viewitem = self.views.viewsModel.item(ii)
-            self.view.setViewSides(viewitem)
-
-            rect = self.view.viewport().rect()
-
-            # adjust height so same proportions as target
-            dh = rect.height()-int(rect.width()*H/W)
-            rect.setTop(int(rect.top()+dh/2))
-            rect.setBottom(int(rect.bottom()-dh/2))
-
-            self.highResRender(painter, viewitem, rect, targetRect, visibleStems)
-            # self.lowResRender(painter, rect, targetRect)
-
-            # TODO hide any view rects
-
+            pages.append(viewrender.view_transform(viewitem['left'], viewitem['right'], W, H))
+
+        # embed each image once, at no more than the resolution the pages need
+        self.scene.realiseStems()
+        images = viewrender.ImageDownsampler(self.scene,
+                                             oversample=max(1.0, viewrender.IMAGEDPI/printer.resolution()))
+        for T in pages:
+            images.need(T, W, H)
+        images.apply()
+
+        for ii, T in enumerate(pages):
+            # only stems near the page are drawn, those just outside are culled
+            viewrender.render_page(self.scene, painter, T, W, H)
             if ii < VIEWS-1:
                 self.printer.newPage()
 
         painter.end()
-        self.view.setViewSides(VIEWSIDES)
+        images.restore()
         self.scene.setBackgroundBrush(scenebrush)
 
-    def highResRender(self, painter, viewitem, rect, targetRect, visibleStems):
-
-        # hide items not in view
-        inview = []
-        for item in viewitem['_rect'].collidingItems():
-            if isinstance(item, graphics.StemItem):
-                inview.append(item)
-                # if parents hide so do the children
-                inview.extend(item.allParentStems())
-                # add any children not explicitly hidden since at the very least the tails will be visible
-                for child in item.childStems2:
-                    if child in visibleStems:
-                        inview.append(child)
-
-        for stem in visibleStems:
-            if stem not in inview:
-                stem.hide()
-
-        #
-        # The following prints at full resolution (vector graphics?)
-        # Printout can get to ~100Mb though
-        #
-        self.view.setRenderHints(QtGui.QPainter.RenderHint.Antialiasing |
-                                 QtGui.QPainter.RenderHint.TextAntialiasing |
-                                 QtGui.QPainter.RenderHint.SmoothPixmapTransform)
-        self.view.render(painter, targetRect, rect)
-
-        # show items previously visible (or collidingItems won't register them for next view)
-        for stem in visibleStems:
-            stem.show()
-
     def lowResRender(self, painter, rect, targetRect, factor=4):
 
         W = targetRect.width()
@@ -2168,6 +2136,7 @@ class MainWindow(QtWidgets.QMainWindow):
         painter.drawImage(targetRect, image, QtCore.QRectF(0, 0, W*factor, H*factor))
 
     def printIt(self, views=False):
+        from PyQt6 import QtPrintSupport
 
         self.printer = QtPrintSupport.QPrinter(QtPrintSupport.QPrinter.PrinterMode.HighResolution)
         self.printer = QtPrintSupport.QPrinter()
@@ -2392,6 +2361,42 @@ class MainWindow(QtWidgets.QMainWindow):
         self.scene.backgroundDialog.raise_()
         self.scene.backgroundDialog.activateWindow()
 
+    def searchMaps(self):
+        app = QtWidgets.QApplication.instance()
+        if not hasattr(app, 'searchDialog'):
+            app.searchDialog = MapSearchDialog()
+        app.searchDialog.setDirectory(Path(self.scene.graph.path).parent)
+        app.searchDialog.show()
+        app.searchDialog.raise_()
+        app.searchDialog.activateWindow()
+
+    def showStem(self, uid):
+        '''
+        Select the stem with the given uid and zoom to it, unhiding
+        any collapsed branches on the way
+        '''
+        stems = [s for s in self.scene.allChildStems() if s.node['uid'] == uid]
+
+        if len(stems) == 0:
+            node = self.scene.graph.getuid(uid)
+            if node is None:
+                self.showMessage("Stem not found in map")
+                return
+            batch = graphydb.generateUUID()
+            while node is not None:
+                if 'hide' in node:
+                    node.discard('hide')
+                    node.save(batch=batch, setchange=True)
+                node = node.inN('e.kind="Child"').one
+            self.scene.root().renew(reload=False, create=False, position=False)
+            stems = [s for s in self.scene.allChildStems() if s.node['uid'] == uid]
+            if len(stems) == 0:
+                return
+
+        self.sceneDeselectAll()
+        stems[0].setSelected(True)
+        self.view.zoomSelection()
+
     def strippedName(self, fullFileName):
         return QtCore.QFileInfo(fullFileName).fileName()
 
@@ -2536,6 +2541,18 @@ class MainWindow(QtWidgets.QMainWindow):
         # TODO fix selection
         # self.views.viewsListView.setCurrentIndex(viewitem.index())
 
+    def setOpenGL(self, on):
+        '''
+        Switch the map view and input dialog between OpenGL and software drawing
+        '''
+        CONFIG['opengl_viewport'] = on
+        used = graphics.setOpenGLViewport(self.view, on)
+        graphics.setOpenGLViewport(self.editDialog.view, used)
+        self.profiler.watchViewport()
+        self.openGLAct.setChecked(used)
+        if on and not used:
+            self.showMessage("OpenGL is not available")
+
     def timedView(self):
 
         if self.viewcurrentstep > len(self.viewsteps)-1:
@@ -2708,6 +2725,7 @@ class MainWindow(QtWidgets.QMainWindow):
         #
         # Recording setup
         #
+        from PyQt6.QtMultimedia import QMediaDevices, QMediaRecorder
         devices = QMediaDevices()
         inputs = devices.audioInputs()
         self.audio_inputs = {a.description(): a for a in inputs}
@@ -2740,9 +2758,9 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def audioRecorderStateChange(self):
 
-        if self.recorder.recorderState() == QMediaRecorder.RecorderState.RecordingState:
+        if self.recorder.recorderState() == self.recorder.RecorderState.RecordingState:
             logging.debug("Recording")
-        elif self.recorder.recorderState() == QMediaRecorder.RecorderState.PausedState:
+        elif self.recorder.recorderState() == self.recorder.RecorderState.PausedState:
             logging.debug("Paused")
         else:
             logging.debug("Stopped")
@@ -2791,8 +2809,10 @@ class MainWindow(QtWidgets.QMainWindow):
         Start recording has been triggered
         '''
 
+        from PyQt6.QtMultimedia import QMediaCaptureSession, QAudioInput
+
         print(f'STATE {self.recorder.recorderState()}')
-        if self.recorder.recorderState() == QMediaRecorder.RecorderState.StoppedState:
+        if self.recorder.recorderState() == self.recorder.RecorderState.StoppedState:
             # This is the initial state of the recorder
 
             self.audiosession = QMediaCaptureSession(self)
@@ -3137,6 +3157,111 @@ class FilterEdit(QtWidgets.QLineEdit):
         self.runfilter.emit(str(self.text()))
 
 
+class MapSearchDialog(QtWidgets.QDialog):
+    '''
+    Search the text and tags of all maps below a directory
+    '''
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle(self.tr("Search All Maps"))
+        from . import mapindex
+        self.index = mapindex.MapIndex()
+
+        layout = QtWidgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        dirlayout = QtWidgets.QHBoxLayout()
+        self.directoryEdit = QtWidgets.QLineEdit()
+        self.directoryEdit.setToolTip("Folder to search, including sub-folders")
+        dirbutton = QtWidgets.QPushButton(self.tr("Choose..."))
+        dirbutton.clicked.connect(self.chooseDirectory)
+        dirlayout.addWidget(self.directoryEdit)
+        dirlayout.addWidget(dirbutton)
+        layout.addLayout(dirlayout)
+
+        self.queryEdit = QtWidgets.QLineEdit()
+        self.queryEdit.setPlaceholderText("words, \"a phrase\", prefix*, tags:todo")
+        self.queryEdit.returnPressed.connect(self.search)
+        layout.addWidget(self.queryEdit)
+
+        self.results = QtWidgets.QListWidget()
+        self.results.itemActivated.connect(self.openResult)
+        layout.addWidget(self.results)
+
+        self.resize(600, 400)
+
+        settings = QtCore.QSettings("Ectropy", "Nexus")
+        self.directoryEdit.setText(settings.value("search/directory", ""))
+
+    def setDirectory(self, directory):
+        if len(self.directoryEdit.text()) == 0:
+            self.directoryEdit.setText(str(directory))
+
+    def chooseDirectory(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, self.tr("Choose folder"),
+                                                               self.directoryEdit.text())
+        if len(directory) > 0:
+            self.directoryEdit.setText(directory)
+
+    def search(self):
+        directory = Path(self.directoryEdit.text()).expanduser()
+        query = self.queryEdit.text().strip()
+        if len(query) == 0 or not directory.is_dir():
+            return
+
+        settings = QtCore.QSettings("Ectropy", "Nexus")
+        settings.setValue("search/directory", str(directory))
+
+        progress = QtWidgets.QProgressDialog("Indexing maps...", "Abort", 0, 1, self)
+        progress.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(500)
+        app = QtWidgets.QApplication.instance()
+
+        def update(done, total, path):
+            progress.setMaximum(total)
+            progress.setValue(done)
+            progress.setLabelText("Indexing %s" % Path(path).name)
+            app.processEvents()
+            return not progress.wasCanceled()
+
+        self.index.crawl(directory, progress=update)
+        progress.close()
+
+        self.results.clear()
+        try:
+            hits = self.index.search(query, directory=directory)
+        except apsw.SQLError as e:
+            self.results.addItem("Bad search: %s" % e)
+            return
+
+        base = directory.resolve()
+        for hit in hits:
+            path = Path(hit['path'])
+            if not path.is_relative_to(base):
+                continue
+            text = "%s: %s" % (path.relative_to(base), hit['snippet'])
+            if len(hit['tags']) > 0:
+                text += "  [%s]" % hit['tags']
+            item = QtWidgets.QListWidgetItem(text)
+            item.setData(QtCore.Qt.ItemDataRole.UserRole, (hit['path'], hit['uid']))
+            self.results.addItem(item)
+
+        if self.results.count() == 0:
+            self.results.addItem("No matches")
+
+    def openResult(self, item):
+        hit = item.data(QtCore.Qt.ItemDataRole.UserRole)
+        if hit is None:
+            return
+        path, uid = hit
+        app = QtWidgets.QApplication.instance()
+        window = app.raiseOrOpen(path)
+        if window is not None:
+            window.showStem(uid)
+
+
 class PreferencesDialog(QtWidgets.QDialog):
     '''
     Main preferences dialog
@@ -3153,16 +3278,23 @@ class ViewsModel(QtCore.QAbstractListModel):
     home = 0  # home is the first view by default
     athome = None  # the location of the previous view will be stored here on switch
 
+    # asked for the preview of a view (by uid) that hasn't been rendered yet
+    previewRequested = QtCore.pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
         self.views = []
+        self.icons = {}
 
     def data(self, index, role):
         if role == QtCore.Qt.ItemDataRole.DecorationRole:
-            # See below for the data structure.
             v = self.views[index.row()]
-            # Return the todo text only.
-            return v['_icon']
+            icon = self.icons.get(v['uid'])
+            if icon is None:
+                # Only rows actually being drawn ask for an icon, so previews
+                # are rendered on demand
+                self.previewRequested.emit(v['uid'])
+            return icon
 
     def rowCount(self, index):
         return len(self.views)
@@ -3187,6 +3319,25 @@ class ViewsModel(QtCore.QAbstractListModel):
     def itemFromIndex(self, index):
         return self.views[index.row()]
 
+    def rowFromUid(self, uid):
+        for row, v in enumerate(self.views):
+            if v['uid'] == uid:
+                return row
+        return None
+
+    def setIcon(self, uid, icon):
+        '''
+        Set (or with icon None, clear) the preview for view uid
+        '''
+        if icon is None:
+            self.icons.pop(uid, None)
+        else:
+            self.icons[uid] = icon
+        row = self.rowFromUid(uid)
+        if row is not None:
+            index = self.createIndex(row, 0)
+            self.dataChanged.emit(index, index)
+
     def _cleanlimits(self,  viewnumber):
         '''
         clamp limits for requested view number
@@ -3444,6 +3595,8 @@ class ViewsListView(QtWidgets.QListView):
         self.setSelectionRectVisible(True)
         self.setSelectionMode(self.SelectionMode.ExtendedSelection)
         self.setSpacing(0)
+        # all previews are the same size, saves asking the model for every row
+        self.setUniformItemSizes(True)
         self.setVerticalScrollMode(self.ScrollMode.ScrollPerPixel)
         self.setHorizontalScrollMode(self.ScrollMode.ScrollPerPixel)
 
@@ -3538,31 +3691,44 @@ class ViewsWidget(QtWidgets.QWidget):
         self.toolbar.addAction(self.resetViewAct)
         self.toolbar.addAction(self.deleteViewAct)
 
+        # previews are rendered one at a time when the event loop is idle
+        self.previewQueue = []
+        self.previewTimer = QtCore.QTimer(self)
+        self.previewTimer.setInterval(0)
+        self.previewTimer.timeout.connect(self.renderNextPreview)
+        self.viewsModel.previewRequested.connect(self.queuePreview)
+
         self.resetViewsFromGraph()
 
     def resetViewsFromGraph(self):
         # first clear the existing data
         self.viewsModel.views.clear()
+        self.viewsModel.icons.clear()
+        self.previewQueue.clear()
 
         g = self.scene.graph
 
         # load all views in graphdb
         allviewnodes = g.fetch('[n:View]')
 
+        # the chain of transitions as start -> end uids, no need for the edges themselves
+        transitions = dict(g.fetch('-[e:Transition]>', COLUMNS=['e.startuid', 'e.enduid']))
+        targets = set(transitions.values())
+
         # first view found without an incomming transition is the rootview
         viewnodes = []
         for viewnode in allviewnodes:
-            if len(viewnode.inE('e.kind = "Transition"')) == 0:
+            if viewnode['uid'] not in targets:
                 viewnodes.append(viewnode)
                 break
 
         if len(viewnodes) > 0:
             # now collect chain
-            nextview = viewnodes[0]
+            nextuid = viewnodes[0]['uid']
             while True:
-                nextview = nextview.outN('e.kind = "Transition"').one
-                if nextview is not None:
-                    viewnodes.append(nextview)
+                nextuid = transitions.get(nextuid)
+                if nextuid in allviewnodes and allviewnodes[nextuid] not in viewnodes:
+                    viewnodes.append(allviewnodes[nextuid])
                 else:
                     break
 
@@ -3571,6 +3737,7 @@ class ViewsWidget(QtWidgets.QWidget):
             if viewnode not in viewnodes:
                 logging.warn("Found view not in chain, deleting.")
                 viewnode.delete(setchange=False)
+                g.uncache('viewpreview:'+viewnode['uid'])
 
         # DEPRECATED[v0.86]
         for viewnode in viewnodes:
@@ -3643,10 +3810,8 @@ class ViewsWidget(QtWidgets.QWidget):
                 node['right'] = d['right']
                 node.save(setchange=False)
 
-                icon = self.createPreview(d)
-                node['_icon'] = icon
-                index = self.viewsModel.createIndex(0, 0)
-                self.viewsModel.dataChanged.emit(index, index)
+                # drop the old preview, a new one is rendered when next drawn
+                self.viewsModel.setIcon(node['uid'], None)
 
     def addView(self, node):
 
@@ -3666,12 +3831,6 @@ class ViewsWidget(QtWidgets.QWidget):
         # connect proxy signalling object
         rectitem.rectangleChanged.signal.connect(self.updateFromRectangle)
 
-        #
-        # Add an icon for the view
-        #
-        icon = self.createPreview({k: node[k] for k in ('left', 'right')})
-        node['_icon'] = icon
-
         #
         # Add this view after any selected views or append
         #
@@ -3698,6 +3857,66 @@ class ViewsWidget(QtWidgets.QWidget):
         matrix = graphics.Transform().setTRS(cx, cy, r, 1/s)
         return matrix
 
+    def queuePreview(self, uid):
+        if uid not in self.previewQueue:
+            self.previewQueue.append(uid)
+        self.previewTimer.start()
+
+    def previewHash(self, node):
+        '''
+        Hash of everything that goes into the preview of a view: its sides
+        and the stems that fall within it
+        '''
+        rect = node['_rect'].sceneBoundingRect()
+        stems = [(item.node['uid'], item.node['mtime'], item.isVisible())
+                 for item in self.scene.items(rect) if isinstance(item, graphics.StemItem)]
+        stems.sort()
+        state = json.dumps([node['left'], node['right'], stems])
+        return hashlib.sha1(state.encode('utf-8')).hexdigest()
+
+    def renderNextPreview(self):
+        '''
+        Render (or load from the map's cache) one queued preview
+        '''
+        if len(self.previewQueue) == 0:
+            self.previewTimer.stop()
+            return
+
+        # skip rows scrolled out of sight again, they'll ask when redrawn
+        viewport = self.viewsListView.viewport().rect()
+        while len(self.previewQueue) > 0:
+            uid = self.previewQueue.pop(0)
+            row = self.viewsModel.rowFromUid(uid)
+            if row is None or uid in self.viewsModel.icons:
+                continue
+            if viewport.intersects(self.viewsListView.visualRect(self.viewsModel.createIndex(row, 0))):
+                break
+        else:
+            return
+
+        node = self.viewsModel.item(row)
+        g = self.scene.graph
+        key = 'viewpreview:'+uid
+        h = self.previewHash(node)
+
+        try:
+            cached = g.cached(key)
+        except KeyError:
+            cached = {}
+
+        if cached.get('hash') == h:
+            image = QtGui.QImage.fromData(base64.b64decode(cached['png']), 'PNG')
+        else:
+            image = self.createPreview({k: node[k] for k in ('left', 'right')})
+
+            data = QtCore.QByteArray()
+            buffer = QtCore.QBuffer(data)
+            buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+            image.save(buffer, 'PNG')
+            g.cache(key, {'hash': h, 'png': base64.b64encode(bytes(data)).decode('ascii')})
+
+        self.viewsModel.setIcon(uid, QtGui.QIcon(QtGui.QPixmap.fromImage(image)))
+
     def createPreview(self, node):
 
         # temporarily deselect selected items
@@ -3727,9 +3946,6 @@ class ViewsWidget(QtWidgets.QWidget):
         # restore view
         self.view.setViewSides(sides)
 
-        # icon = QtGui.QIcon(pixmap)
-        icon = QtGui.QIcon(QtGui.QPixmap.fromImage(image))
-
         # restore visible rects
         for rect in visiblerects:
             rect.setVisible(True)
@@ -3738,7 +3954,7 @@ class ViewsWidget(QtWidgets.QWidget):
         for item in selected:
             item.setSelected(True)
 
-        return icon
+        return image
 
     def relinkViews(self):
         '''
@@ -3753,31 +3969,31 @@ class ViewsWidget(QtWidgets.QWidget):
         # Check first view node is sensible
         # There should be no incomming edges
         node = self.viewsModel.item(0)
-        in_edges = node.inE('e.kind="Transition"')
-        if len(in_edges) > 0:
-            print(in_edges)
+        if node.inE('e.kind="Transition"', COUNT=True) > 0:
             logging.error('First view has incomming edge, reloading all views from graph.')
             self.resetViewsFromGraph()
 
         # Check last view node is sensible
         # There should be no outgoing edges
         node = self.viewsModel.item(rows-1)
-        out_edges = node.outE('e.kind="Transition"')
-        if len(out_edges) > 0:
-            print(out_edges)
+        if node.outE('e.kind="Transition"', COUNT=True) > 0:
             logging.error('Last view has outgoing edge, reloading all views from graph.')
             self.resetViewsFromGraph()
 
         # Check for row in 0..rows-2
         # Should link to next view only
+        g = self.scene.graph
+        transitions = g.fetch('-[e:Transition]>', COLUMNS=['e.startuid', 'e.enduid'])
+        ends = {}
+        for start, end in transitions:
+            ends.setdefault(start, []).append(end)
+
         for row in range(rows-1):
             node = self.viewsModel.item(row)
             nextnode = self.viewsModel.item(row+1)
-            es = node.outE('e.kind="Transition"')
-            if len(es) != 1 or es[0] != nextnode:
-                # NB python will run 2nd clause only if fist is False
-                # could also be = not (len(es)==1 and es[0]==nextnode)
-                self.scene.graph.Edge(node, "Transition", nextnode).save(setchange=False)
+            if ends.get(node['uid']) != [nextnode['uid']]:
+                es = node.outE('e.kind="Transition"', LAZY=True)
+                g.Edge(node, "Transition", nextnode).save(setchange=False)
                 # this will delete all edges in set es
                 es.delete(setchange=False)
 
@@ -3796,9 +4012,8 @@ class ViewsWidget(QtWidgets.QWidget):
         sides = self.view.getViewSides()
         node['left'] = sides['left']
         node['right'] = sides['right']
-        icon = self.createPreview({k: sides[k] for k in ('left', 'right')})
-        node['_icon'] = icon
         node.save(setchange=True)
+        self.viewsModel.setIcon(node['uid'], None)
 
         # reset the rectangle
         rectitem = node['_rect']
@@ -3820,6 +4035,7 @@ class ViewsWidget(QtWidgets.QWidget):
 
         for item in itemstodelete:
             item.delete(disconnect=True, setchange=False)
+            self.scene.graph.uncache('viewpreview:'+item['uid'])
             self.scene.removeItem(item['_rect'])
             self.viewsModel.removeItem(item)
 
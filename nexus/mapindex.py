@@ -0,0 +1,233 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Cross-map search index.
+
+A separate sqlite database (not one of the maps) holding the text, tags and
+outgoing links of every stem in a set of crawled directories. Maps are only
+re-read when their modification time changes so re-crawling a large folder
+of maps is cheap.
+
+    index = MapIndex()
+    index.crawl('~/Notes')
+    for hit in index.search('entropy'):
+        print(hit['path'], hit['uid'], hit['snippet'])
+'''
+
+from pathlib import Path
+import logging, os, platform, time
+import urllib.parse
+
+import apsw
+from bs4 import BeautifulSoup
+
+from . import nexusgraph
+
+
+def default_index_path():
+    '''
+    Location of the index database, next to the user config file
+    '''
+    if platform.system() == "Darwin":
+        base = Path("~/Library/Application Support/Nexus").expanduser()
+    else:
+        base = Path("~/.config/nexus").expanduser()
+
+    return base.joinpath("mapindex.db")
+
+
+def stem_text(stem):
+    '''
+    Return (text, links) for a stem node.
+
+    text is the plain text of all the Text content items, links the set of
+    hrefs found in them.
+    '''
+    texts = []
+    links = set()
+    for item in stem.get('content', {}).values():
+        if item.get('kind') != 'Text':
+            continue
+        soup = BeautifulSoup(item.get('source', ''), "html.parser")
+        texts.append(soup.get_text(" ", strip=True))
+        for a in soup.find_all('a', href=True):
+            links.add(a['href'])
+
+    return " ".join(t for t in texts if len(t) > 0), links
+
+
+def resolve_link(href, mappath):
+    '''
+    Resolve a link to another .nex file relative to mappath.
+    Returns (path, uid) or None if the link is not to a map.
+    '''
+    bits = urllib.parse.urlparse(href)
+    if bits.scheme not in ['', 'file', 'nexus']:
+        return None
+
+    path = urllib.parse.unquote(bits.path)
+    if not path.endswith('.nex'):
+        return None
+
+    target = Path(path)
+    if not target.is_absolute():
+        target = Path(mappath).parent.joinpath(target)
+
+    return os.path.normpath(str(target)), (bits.fragment or None)
+
+
+#----------------------------------------------------------------------
+class MapIndex:
+#----------------------------------------------------------------------
+
+    def __init__(self, path=None):
+
+        if path is None:
+            path = default_index_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.path = str(path)
+        self.connection = apsw.Connection(self.path)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS maps(path TEXT PRIMARY KEY, mtime REAL, indexed REAL);
+            CREATE TABLE IF NOT EXISTS links(path TEXT, uid TEXT, target TEXT, targetuid TEXT);
+            CREATE INDEX IF NOT EXISTS links_path ON links(path);
+            CREATE INDEX IF NOT EXISTS links_target ON links(target);
+            CREATE VIRTUAL TABLE IF NOT EXISTS stems USING fts5(path UNINDEXED, uid UNINDEXED, text, tags);
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def indexed(self):
+        '''
+        Return dict of {path: mtime} for all maps in the index
+        '''
+        return dict(self.connection.execute('SELECT path, mtime FROM maps'))
+
+    def crawl(self, directory, progress=None):
+        '''
+        Bring the index up to date with all the .nex files under directory.
+
+        Only maps whose mtime has changed are re-read, maps that have vanished
+        are dropped. progress is an optional callable(done, total, path)
+        returning False to abort. Returns the number of maps (re)indexed.
+        '''
+        directory = Path(directory).expanduser().resolve()
+        known = {p: m for p, m in self.indexed().items()
+                 if Path(p).is_relative_to(directory)}
+
+        found = {}
+        for f in directory.rglob('*.nex'):
+            try:
+                found[str(f)] = f.stat().st_mtime
+            except OSError:
+                continue
+
+        with self.connection:
+            for p in set(known) - set(found):
+                self.remove(p)
+
+        stale = [p for p, m in found.items() if known.get(p) != m]
+        for ii, p in enumerate(sorted(stale)):
+            if progress is not None and progress(ii, len(stale), p) is False:
+                break
+            self.update(p, found[p])
+
+        return len(stale)
+
+    def remove(self, path):
+        self.connection.execute('DELETE FROM stems WHERE path=?', (path,))
+        self.connection.execute('DELETE FROM links WHERE path=?', (path,))
+        self.connection.execute('DELETE FROM maps WHERE path=?', (path,))
+
+    def update(self, path, mtime=None):
+        '''
+        (Re)index a single map
+        '''
+        path = str(path)
+        if not os.path.isfile(path):
+            # gone since it was listed, opening it would create an empty map
+            with self.connection:
+                self.remove(path)
+            return
+        if mtime is None:
+            mtime = os.stat(path).st_mtime
+
+        logging.debug("Indexing %s", path)
+        stemrows = []
+        linkrows = []
+        g = None
+        try:
+            g = nexusgraph.NexusGraph(path)
+            for stem in g.fetch('[n:Stem]'):
+                text, hrefs = stem_text(stem)
+                tags = " ".join(stem.get('tags', []))
+                stemrows.append((path, stem['uid'], text, tags))
+                for href in hrefs:
+                    link = resolve_link(href, path)
+                    if link is not None:
+                        linkrows.append((path, stem['uid'], link[0], link[1]))
+        except (apsw.Error, ValueError) as e:
+            # Old zip format maps or otherwise unreadable, record the mtime
+            # so we don't keep retrying
+            logging.warning("Could not index %s: %s", path, e)
+        finally:
+            if g is not None:
+                g.connection.close()
+
+        with self.connection:
+            self.remove(path)
+            self.connection.executemany('INSERT INTO stems(path, uid, text, tags) VALUES(?,?,?,?)', stemrows)
+            self.connection.executemany('INSERT INTO links(path, uid, target, targetuid) VALUES(?,?,?,?)', linkrows)
+            self.connection.execute('INSERT INTO maps(path, mtime, indexed) VALUES(?,?,?)',
+                                    (path, mtime, time.time()))
+
+    def search(self, query, limit=200, directory=None):
+        '''
+        Full text search over all indexed stems, or those of maps under directory.
+
+        query is in sqlite FTS5 syntax, e.g. "tags:todo entropy". Returns a list
+        of dicts with path, uid, snippet and tags, best matches first.
+        '''
+        prefix = None
+        if directory is not None:
+            prefix = os.path.join(str(Path(directory).expanduser().resolve()), '')
+        cursor = self.connection.execute('''
+            SELECT path, uid, snippet(stems, 2, '[', ']', '...', 12), tags
+            FROM stems WHERE stems MATCH ? AND (?2 IS NULL OR substr(path, 1, length(?2)) = ?2)
+            ORDER BY rank LIMIT ?3''', (query, prefix, limit))
+
+        return [{'path': p, 'uid': u, 'snippet': s, 'tags': t} for p, u, s, t in cursor]
+
+    def linksTo(self, path):
+        '''
+        Return list of (path, uid) of stems linking to map at path
+        '''
+        cursor = self.connection.execute('SELECT path, uid FROM links WHERE target=?',
+                                         (os.path.normpath(str(path)),))
+        return list(cursor)
+
+    def linksFrom(self, path):
+        '''
+        Return list of (uid, target, targetuid) for links out of map at path
+        '''
+        cursor = self.connection.execute('SELECT uid, target, targetuid FROM links WHERE path=?',
+                                         (str(path),))
+        return list(cursor)
@@ -18,12 +18,11 @@
 
 
 from . import graphydb, config, graphics, devonthink
-import logging, re, base64, hashlib, os, json, copy
-import bleach
-from bleach.linkifier import Linker
+import logging, re, base64, hashlib, os, json, copy, struct, sys
+from array import array
+from itertools import accumulate
+import apsw
 import urllib.parse
-from urllib.request import urlopen
-import ssl
 
 
 from PyQt6 import QtCore, QtGui
@@ -55,6 +54,57 @@ def ImageToData(image):
 
     return dataenc
 
+# Pen strokes are packed into a base64 string of a header (format, flags,
+# number of points), the x then y coordinates in units of 1/STROKESCALE as
+# differences from the previous point, int16 or int32 if any don't fit, and
+# then the pressures as uint8. All little endian.
+STROKESCALE = 100
+STROKEHEADER = struct.Struct('<BBI')
+STROKEPRESSURE = 1
+STROKEWIDE = 2
+
+def StrokeToData(points):
+    '''
+    Return a packed string of stroke points [[x, y, pressure], ...] or [[x, y], ...]
+    '''
+    flags = STROKEPRESSURE if len(points[0]) > 2 else 0
+    xs = [round(p[0]*STROKESCALE) for p in points]
+    ys = [round(p[1]*STROKESCALE) for p in points]
+    deltas = [b-a for a, b in zip([0]+xs, xs)]+[b-a for a, b in zip([0]+ys, ys)]
+    if min(deltas) < -32768 or max(deltas) > 32767:
+        flags |= STROKEWIDE
+    coords = array('i' if flags & STROKEWIDE else 'h', deltas)
+    pressures = array('B', [min(255, max(0, round(255*p[2]))) for p in points] if flags & STROKEPRESSURE else [])
+    if sys.byteorder == 'big':
+        coords.byteswap()
+
+    raw = STROKEHEADER.pack(1, flags, len(points))+coords.tobytes()+pressures.tobytes()
+    return base64.b64encode(raw).decode('ascii')
+
+def DataToStroke(dataenc):
+    '''
+    Return the stroke points [(x, y, pressure), ...] or [(x, y), ...] from a
+    packed string. Strokes from older maps, still as lists, are returned as is.
+    '''
+    if not isinstance(dataenc, str):
+        return dataenc
+
+    raw = base64.b64decode(dataenc)
+    version, flags, n = STROKEHEADER.unpack_from(raw)
+    coords = array('i' if flags & STROKEWIDE else 'h')
+    start = STROKEHEADER.size
+    end = start+2*n*coords.itemsize
+    coords.frombytes(raw[start:end])
+    if sys.byteorder == 'big':
+        coords.byteswap()
+
+    scale = 1/STROKESCALE
+    xs = [x*scale for x in accumulate(coords[:n])]
+    ys = [y*scale for y in accumulate(coords[n:])]
+    if flags & STROKEPRESSURE:
+        return list(zip(xs, ys, [z/255 for z in raw[end:end+n]]))
+    return list(zip(xs, ys))
+
 class CopyFormat:
     '''
     Class to hold and serialise internal copy/paste data
@@ -94,6 +144,39 @@ class NexusGraph(graphydb.Graph):
     Adding some convenience functions on top of Graph specialised to Nexus
     '''
 
+    # deferred saves are written after this long without another (ms)
+    FLUSHIDLE = 500
+
+    _flushtimer = None
+
+    def flushlater(self):
+        '''
+        Write the deferred saves once things go quiet (see Graph.defersave)
+        '''
+        if self._flushtimer is None:
+            self._flushtimer = QtCore.QTimer()
+            self._flushtimer.setSingleShot(True)
+            self._flushtimer.setInterval(self.FLUSHIDLE)
+            self._flushtimer.timeout.connect(self.flush)
+        self._flushtimer.start()
+
+    def childNodes(self, uid):
+        '''
+        Child nodes of the node with uid, lazily decoded, with "_hidden" set
+        for collapsed ones without decoding them
+        '''
+        return self.fetch('-(e)> [n,hidden]', ['e.startuid = :node_uid', 'e.kind = "Child"'],
+                          node_uid=uid, hidden='n.data.hide', LAZY=True)
+
+    def childCounts(self):
+        '''
+        Return {uid: number of children} for every node with children from a
+        single query on the edges
+        '''
+        cursor = self.cursor()
+        rows = cursor.execute('SELECT startuid, COUNT(*) FROM edges WHERE kind = "Child" GROUP BY startuid')
+        return dict(rows)
+
     def findImageData(self, sha1):
         '''
         ImageData nodes should have unique sha1
@@ -167,13 +250,8 @@ class NexusGraph(graphydb.Graph):
         '''
         if len(nodes)==0:
             return
-        children = nodes.outN()
-        for n in nodes:
-            if n['kind'] in ['ImageData'] and n.inE(COUNT=True)>0:
-                # Don't delete data nodes with remaining links
-                continue
-            n.delete(disconnect=True, batch=batch, setchange=setchange)
-        self.deleteOutFromNodes(children, batch=batch, setchange=setchange)
+        # Don't delete data nodes with remaining links
+        self.deleteOutFrom([n['uid'] for n in nodes], keep=['ImageData'], batch=batch, setchange=setchange)
 
 
     def getNodeLink(self, node=None):
@@ -423,6 +501,7 @@ class NexusGraph(graphydb.Graph):
 
 
     def itemFromHtml(self, html):
+        import bleach
         ## sanitise the input
         html = bleach.clean(html, strip=True,
                             protocols = list(bleach.ALLOWED_PROTOCOLS)+['papers3', 'omnifocus', 'zotero']
@@ -440,6 +519,9 @@ class NexusGraph(graphydb.Graph):
 
 
     def itemFromText(self, text):
+        import bleach, ssl
+        from bleach.linkifier import Linker
+        from urllib.request import urlopen
 
         # first linkify any perculiar protocols
         link_re = re.compile(
@@ -482,3 +564,197 @@ class NexusGraph(graphydb.Graph):
 
         return copydata, 'OK'
 
+
+
+##----------------------------------------------------------------------
+## Maps open in this process, one connection per file shared by all its users
+##----------------------------------------------------------------------
+
+_shared = {}
+
+def _key(path):
+    return os.path.realpath(path)
+
+def shared_graph(path):
+    '''
+    Return the open graph for the map at path, counting another user, or None
+    if it isn't open
+    '''
+    g = _shared.get(_key(path))
+    if g is not None:
+        g.users += 1
+    return g
+
+def share_graph(g):
+    '''
+    Make g the connection shared by everything opening its map and start
+    watching for changes made to the file by other connections
+    '''
+    g.users = 1
+    g.watcher = MapWatcher(g)
+    _shared[_key(g.path)] = g
+    return g
+
+def release_graph(g):
+    '''
+    One less user of a shared graph, the last one closes it
+    '''
+    g.users = getattr(g, 'users', 1)-1
+    if g.users > 0:
+        return
+    if _shared.get(_key(g.path)) is g:
+        del _shared[_key(g.path)]
+    if getattr(g, 'watcher', None) is not None:
+        g.watcher.stop()
+        g.watcher = None
+    g.close()
+    g.connection.close()
+
+
+##----------------------------------------------------------------------
+class MapWatcher(QtCore.QObject):
+##----------------------------------------------------------------------
+    '''
+    Notice commits to a map by other connections, e.g. another copy of Nexus
+    or a sync client, and report the nodes and edges that changed.
+
+    SQLite's data_version only changes for other connections' commits. The
+    map is then compared with what was last seen by the uid and rowid of
+    each item, which the uid index holds: items are saved by replacing their
+    row, so a changed item has a new rowid. Only the rows that changed are
+    read. Rows written by this process are noted by an update hook as they
+    are written and aren't reported back.
+
+    If the file is replaced (as sync clients tend to do) the connection is
+    opened again, deferred saves are written to the new file and the items
+    are compared by their mtime as well.
+
+    changed is emitted with the set of node uids touched (including both ends
+    of changed edges) and the set of the kinds of items that changed.
+    '''
+
+    changed = QtCore.pyqtSignal(set, set)
+
+    # ms between checks
+    INTERVAL = 1000
+
+    # extra columns read from each table
+    TABLES = {'nodes': '', 'edges': ', startuid, enduid'}
+
+    def __init__(self, graph):
+        super().__init__()
+        self.graph = graph
+        self.fileid = self.currentFileid()
+        self.watch()
+        # {table: {uid: (rowid, mtime, kind, (startuid, enduid) or ())}}
+        self.items = {table: self.read(table) for table in self.TABLES}
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.INTERVAL)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.graph.connection.setupdatehook(None)
+
+    def watch(self):
+        '''
+        Start noting the rows written through graph.connection
+        '''
+        # {table: rowids} written and deleted by this process since the last check
+        self.written = {table: set() for table in self.TABLES}
+        self.deleted = {table: set() for table in self.TABLES}
+        self.graph.connection.setupdatehook(self.updated)
+        self.version = self.dataVersion()
+
+    def updated(self, op, dbname, table, rowid):
+        # Called by SQLite for every row this connection changes
+        if table in self.TABLES:
+            if op == apsw.SQLITE_DELETE:
+                self.deleted[table].add(rowid)
+            else:
+                self.written[table].add(rowid)
+
+    def currentFileid(self):
+        try:
+            stat = os.stat(self.graph.path)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    def dataVersion(self):
+        # Not through graph.cursor() which would flush deferred saves
+        for row in self.graph.connection.cursor().execute('PRAGMA data_version'):
+            return row[0]
+
+    def read(self, table, uids=None):
+        '''
+        Return {uid: (rowid, mtime, kind, (startuid, enduid) or ())} of all the items in table or those in uids
+        '''
+        sql = 'SELECT uid, rowid, mtime, kind{} FROM {}'.format(self.TABLES[table], table)
+        args = []
+        if uids is not None:
+            sql += ' WHERE uid IN (SELECT value FROM json_each(?))'
+            args = [json.dumps(list(uids))]
+        cursor = self.graph.connection.cursor()
+        return {row[0]: (row[1], row[2], row[3], tuple(row[4:])) for row in cursor.execute(sql, args)}
+
+    def reopen(self):
+        '''
+        Connect to the file that replaced the map, return the items in it
+        '''
+        logging.info("%s was replaced, reopening", self.graph.path)
+        self.graph.connection.setupdatehook(None)
+        self.graph.connection.close(True)
+        self.graph.connection = apsw.Connection(self.graph.path)
+        self.watch()
+        if len(self.graph._pending) > 0:
+            logging.warning("%s was replaced, writing unsaved changes to the new file", self.graph.path)
+            self.graph.flush()
+        return {table: self.read(table) for table in self.TABLES}
+
+    def poll(self):
+        fileid = self.currentFileid()
+        if fileid is None:
+            # probably in the middle of being replaced, try again later
+            return
+
+        if fileid != self.fileid:
+            self.fileid = fileid
+            items = self.reopen()
+        elif self.dataVersion() == self.version:
+            return
+        else:
+            self.version = self.dataVersion()
+            items = {}
+            for table in self.TABLES:
+                seen = self.items[table]
+                rowids = dict(self.graph.connection.cursor().execute('SELECT uid, rowid FROM {}'.format(table)))
+                items[table] = {uid: seen[uid] for uid in rowids.keys() & seen.keys() if seen[uid][0] == rowids[uid]}
+                items[table].update(self.read(table, [uid for uid in rowids if uid not in items[table]]))
+
+        uids = set()
+        kinds = set()
+        for table in self.TABLES:
+            seen, current = self.items[table], items[table]
+            for uid in seen.keys() | current.keys():
+                old, new = seen.get(uid), current.get(uid)
+                if old == new:
+                    continue
+                elif new is not None and new[0] in self.written[table]:
+                    # saved by this process
+                    continue
+                elif new is None and old[0] in self.deleted[table]:
+                    continue
+                for item in (old, new):
+                    if item is not None:
+                        kinds.add(item[2])
+                        uids.update(item[3] or (uid,))
+            self.written[table].clear()
+            self.deleted[table].clear()
+
+        self.items = items
+        if len(uids) > 0:
+            logging.info("%s changed externally, %d nodes affected", self.graph.path, len(uids))
+            self.changed.emit(uids, kinds)
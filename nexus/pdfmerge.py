@@ -0,0 +1,158 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Join PDF files written by QPdfWriter into one.
+
+This is not a general PDF library, it relies on what Qt writes: a single
+uncompressed cross reference table, a flat page tree and no incremental
+updates. Objects of each file are renumbered and their pages put under a
+new page tree. Stream data is copied untouched.
+'''
+
+import re
+
+OBJHEADER = re.compile(rb'\s*\d+\s+\d+\s+obj\s*')
+REFERENCE = re.compile(rb'(\d+) 0 R\b')
+STREAMSTART = re.compile(rb'>>\s*stream\r?\n')
+XREFENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+
+
+def read_pdf(path):
+    '''
+    Return (version, objects, trailer) of a PDF, objects being a dict
+    {number: body} with the "obj"/"endobj" wrapping removed
+    '''
+    with open(path, 'rb') as fp:
+        data = fp.read()
+
+    version = data[5:8]
+    m = re.search(rb'startxref\s+(\d+)\s+%%EOF\s*$', data)
+    if m is None:
+        raise ValueError("%s: no cross reference table found" % path)
+    xref = int(m.group(1))
+    if not data.startswith(b'xref', xref):
+        raise ValueError("%s: cross reference streams are not supported" % path)
+
+    trailerstart = data.index(b'trailer', xref)
+    offsets = {}
+    lines = data[xref+4:trailerstart].split(b'\n')
+    number = 0
+    for line in lines:
+        line = line.strip()
+        entry = XREFENTRY.match(line)
+        if entry is not None:
+            if entry.group(3) == b'n':
+                offsets[number] = int(entry.group(1))
+            number += 1
+        elif len(line) > 0:
+            # subsection header "first count"
+            number = int(line.split()[0])
+
+    # each object runs up to the start of the next one
+    starts = sorted(offsets.values())+[xref]
+    ends = {s: e for s, e in zip(starts, starts[1:])}
+    objects = {}
+    for number, start in offsets.items():
+        chunk = data[start:ends[start]]
+        chunk = chunk[OBJHEADER.match(chunk).end():chunk.rindex(b'endobj')]
+        objects[number] = chunk.rstrip()
+
+    trailer = data[trailerstart:m.start()]
+    return version, objects, trailer
+
+
+def renumber(body, mapping):
+    '''
+    Rewrite the object references in body, leaving any stream data alone
+    '''
+    def sub(m):
+        return b'%d 0 R' % mapping.get(int(m.group(1)), 0)
+
+    stream = STREAMSTART.search(body)
+    if stream is None:
+        return REFERENCE.sub(sub, body)
+    return REFERENCE.sub(sub, body[:stream.end()])+body[stream.end():]
+
+
+def reference(body, key):
+    m = re.search(rb'/'+key+rb'\s+(\d+) 0 R', body)
+    return int(m.group(1)) if m is not None else None
+
+
+def merge_pdfs(paths, target):
+    '''
+    Write the pages of the PDF files paths, in order, to target. The document
+    information (title, creator, ...) is taken from the first file.
+    '''
+    CATALOG, PAGES, INFO = 1, 2, 3
+    version = b'1.4'
+    info = b'<<\n>>'
+    kids = []
+    bodies = {}
+    following = 4
+
+    for ii, path in enumerate(paths):
+        v, objects, trailer = read_pdf(path)
+        version = max(version, v)
+
+        root = reference(trailer, b'Root')
+        infonum = reference(trailer, b'Info')
+        catalog = objects[root]
+        pagesnum = reference(catalog, b'Pages')
+        dropped = {root, pagesnum, infonum, reference(catalog, b'Metadata'), reference(catalog, b'Names')}
+        if ii == 0 and infonum is not None:
+            info = objects[infonum]
+
+        mapping = {pagesnum: PAGES}
+        for number in sorted(objects):
+            if number not in dropped:
+                mapping[number] = following
+                following += 1
+
+        for number, body in objects.items():
+            if number not in dropped:
+                bodies[mapping[number]] = renumber(body, mapping)
+
+        pagetree = objects[pagesnum]
+        start = pagetree.index(b'/Kids')
+        kidlist = pagetree[start:pagetree.index(b']', start)]
+        kids.extend(mapping[int(n)] for n in REFERENCE.findall(kidlist))
+
+    bodies[CATALOG] = b'<<\n/Type /Catalog\n/Pages %d 0 R\n>>' % PAGES
+    bodies[PAGES] = b'<<\n/Type /Pages\n/Kids [%s]\n/Count %d\n>>' % (
+        b' '.join(b'%d 0 R' % k for k in kids), len(kids))
+    bodies[INFO] = info
+
+    with open(target, 'wb') as fp:
+        fp.write(b'%PDF-'+version+b'\n%\xe2\xe3\xcf\xd3\n')
+        offsets = {}
+        for number in range(1, following):
+            offsets[number] = fp.tell()
+            fp.write(b'%d 0 obj\n' % number)
+            fp.write(bodies[number])
+            fp.write(b'\nendobj\n')
+
+        xref = fp.tell()
+        fp.write(b'xref\n0 %d\n0000000000 65535 f \n' % following)
+        for number in range(1, following):
+            fp.write(b'%010d 00000 n \n' % offsets[number])
+        fp.write(b'trailer\n<<\n/Size %d\n/Root %d 0 R\n/Info %d 0 R\n>>\n' % (following, CATALOG, INFO))
+        fp.write(b'startxref\n%d\n%%%%EOF\n' % xref)
+
+    return len(kids)
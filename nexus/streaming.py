@@ -0,0 +1,92 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Serve the current view as an MJPEG stream over http.
+Only imported when streaming is switched on.
+'''
+
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from PyQt6 import QtCore
+from . import instrument
+
+HOST, PORT = '127.0.0.1', 12345
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/":
+            self.send_response(200)
+            self.send_header('Content-type', 'text/html')
+            self.end_headers()
+            self.wfile.write(bytes('<html><head></head><body style="background-color: rgba(0,0,0,0)!important;">', 'utf-8'))
+            self.wfile.write(bytes(f'<img src="http://{HOST}:{PORT}/stream.mjpg"/>', 'utf-8'))
+            self.wfile.write(bytes('</body></html>', 'utf-8'))
+            return
+
+        elif self.path == "/stream.mjpg":
+            self.send_response(200)
+            self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0')
+            self.send_header('Pragma', 'no-cache')
+            # self.send_header('Connection', 'close')
+            self.send_header("Content-type", "multipart/x-mixed-replace; boundary=frame")
+            self.end_headers()
+            interval = 0.05
+            self.served_image_timestamp = time.time() + interval
+            while self.server.app.streaming:
+                if self.served_image_timestamp + interval < time.time() \
+                   and self.served_image_timestamp < self.server.app.streaming_ready_time + 3*interval:
+                    self.wfile.write(bytes("--frame", 'utf-8'))
+                    self.send_header('Content-type', 'image/png')
+                    view_bytes = self.getImageBytes()
+                    self.send_header('Content-length', str(len(view_bytes)))
+                    self.end_headers()
+                    self.wfile.write(view_bytes)
+                    self.wfile.write(b'\r\n')
+                    self.served_image_timestamp = time.time()
+                else:
+                    time.sleep(interval)
+                    pass
+            return
+
+        else:
+            self.send_error(404)
+            self.end_headers()
+
+    def getImageBytes(self):
+
+        t = instrument.start('streaming.encode')
+        # Convert QImage to bytes
+        buffer = QtCore.QBuffer()
+        buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+        ok = self.server.app.view_image.save(buffer, "PNG")
+        view_bytes = buffer.data().data()
+        instrument.stop('streaming.encode', t, bytes=len(view_bytes))
+
+        return view_bytes
+
+
+class StreamingDaemon(QtCore.QObject):
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    def run(self):
+        self._server = HTTPServer((HOST, PORT), RequestHandler)
+        self._server.app = self.app
+        self._server.serve_forever()
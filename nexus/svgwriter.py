@@ -0,0 +1,314 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Single pass clean up of the SVG written by QSvgGenerator.
+
+QSvgGenerator writes one top level group holding a long flat list of small
+groups, one per painter state change, each with the paths, text and images
+drawn in that state. The rewriter streams through the file with iterparse
+and only ever holds one of these small groups in memory, so maps of any
+size export in constant memory.
+'''
+
+import xml.etree.ElementTree as et
+from xml.sax.saxutils import escape, quoteattr
+import gzip, os, re
+
+SVGNS = '{http://www.w3.org/2000/svg}'
+XLINKNS = '{http://www.w3.org/1999/xlink}'
+XMLNS = '{http://www.w3.org/XML/1998/namespace}'
+
+PATHTAGS = [SVGNS+'path', SVGNS+'image']
+TEXTTAGS = [SVGNS+'text']
+
+FONTATTRIBUTES = ['font-family', 'font-size', 'font-weight', 'font-style']
+TEXTONLYSTRIP = ['fill', 'stroke', 'stroke-linecap', 'stroke-linejoin',
+                 'stroke-opacity', 'stroke-width',
+                 'font-family', 'font-size', 'font-style', 'font-weight']
+
+NUMBER = re.compile(r'\d*\.\d+')
+
+
+def _name(tag):
+    '''
+    Serialised name of a tag or attribute
+    '''
+    if tag.startswith(SVGNS):
+        return tag[len(SVGNS):]
+    elif tag.startswith(XLINKNS):
+        return 'xlink:'+tag[len(XLINKNS):]
+    elif tag.startswith(XMLNS):
+        return 'xml:'+tag[len(XMLNS):]
+    return tag
+
+
+def _attributes(attrib):
+    return ''.join(' {}={}'.format(_name(k), quoteattr(v)) for k, v in attrib.items())
+
+
+#----------------------------------------------------------------------
+class SVGRewriter:
+#----------------------------------------------------------------------
+    '''
+    Rewrite a QSvgGenerator file for the web:
+
+    - drop empty groups and default attributes, and font or line attributes
+      from groups that don't need them
+    - wrap the drawing in a "viewcontrol" group offset by (dx, dy) for the
+      zooming and panning javascript, appended as script
+    - put back links (see export_svg) from the dict {key: {'url', 'text'}}
+    - round path coordinates to precision decimal places
+    - with merge, join consecutive groups with identical attributes, and
+      consecutive unfilled paths with identical attributes into one path
+    '''
+
+    def __init__(self, links=None, offset=(0, 0), script=None, precision=1, merge=True):
+        self.links = links or {}
+        self.offset = offset
+        self.script = script
+        self.precision = precision
+        self.merge = merge
+        self._rounded = {}
+
+    def roundnumber(self, number):
+        s = "{:.{}f}".format(float(number), self.precision)
+        if self.precision > 0:
+            s = s.rstrip('0').rstrip('.')
+        s = s or '0'
+
+        # the same coordinates turn up over and over, remember them
+        if len(self._rounded) > 100000:
+            self._rounded.clear()
+        self._rounded[number] = s
+        return s
+
+    def roundpath(self, d):
+        '''
+        Round all the decimals in path data d. Splitting and joining is a lot
+        quicker than a substitution with a callback.
+        '''
+        rounded = self._rounded
+        rest = NUMBER.split(d)
+        numbers = [rounded[x] if x in rounded else self.roundnumber(x) for x in NUMBER.findall(d)]
+
+        parts = [None]*(len(rest)+len(numbers))
+        parts[::2] = rest
+        parts[1::2] = numbers
+        return ''.join(parts)
+
+    def rewrite(self, source, path, compress=None):
+        '''
+        Rewrite SVG file source to path, gzipped if compress (by default if
+        path ends in .svgz)
+        '''
+        if compress is None:
+            compress = os.path.splitext(str(path))[1].lower() == '.svgz'
+
+        if compress:
+            out = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            out = open(path, 'w', encoding='utf-8')
+
+        with out:
+            self._rewrite(source, out.write)
+
+    def _rewrite(self, source, write):
+
+        write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
+
+        stack = []
+        viewcontrol = False
+        after = []
+        self._pending = None
+
+        for event, elem in et.iterparse(source, events=('start', 'end')):
+            depth = len(stack)
+
+            if event == 'start':
+                stack.append(elem)
+                if depth == 0:
+                    # the svg element: viewBox plays havoc with zoom
+                    attrib = {k: v for k, v in elem.attrib.items() if k != 'viewBox'}
+                    attrib.update({'id': 'nexusmap', 'width': '100%', 'height': '100%'})
+                    write('<svg xmlns="http://www.w3.org/2000/svg" '
+                          'xmlns:xlink="http://www.w3.org/1999/xlink"{}>\n'.format(_attributes(attrib)))
+                elif depth == 1 and elem.tag == SVGNS+'g':
+                    if not viewcontrol:
+                        write('<g id="viewcontrol" transform="matrix(1,0,0,1,{},{})">\n'.format(
+                            int(self.offset[0]), int(self.offset[1])))
+                        viewcontrol = True
+                    # Qt's top level group only holds groups, treat as the
+                    # whole-tree cleanup always did
+                    write('<g{}>\n'.format(_attributes(self.cleangroup(elem.attrib, [SVGNS+'g']))))
+                continue
+
+            # end event
+            stack.pop()
+            depth -= 1
+
+            if depth == 0:
+                self.flush(write)
+                if viewcontrol:
+                    write('</g>\n')
+                for e in after:
+                    write(e)
+                if self.script is not None:
+                    write('<script>{}</script>\n'.format(self.script))
+                write('</svg>\n')
+
+            elif depth == 1:
+                if elem.tag == SVGNS+'g':
+                    self.flush(write)
+                    write('</g>\n')
+                elif viewcontrol:
+                    # anything after the drawing starts goes after it
+                    after.append(self.serialise(elem))
+                else:
+                    write(self.serialise(elem))
+                stack[-1].remove(elem)
+
+            elif depth == 2:
+                if elem.tag == SVGNS+'g':
+                    self.group(elem, write)
+                else:
+                    self.flush(write)
+                    write(self.serialise(self.cleanelement(elem)))
+                stack[-1].remove(elem)
+
+    def group(self, elem, write):
+        '''
+        A painter state group: hold on to it in case the next one can be merged
+        '''
+        if len(elem) == 0:
+            # Qt produces lots of empty groups
+            return
+
+        pending = self._pending
+        if self.merge and pending is not None and pending.attrib == elem.attrib:
+            pending.extend(list(elem))
+            return
+
+        self.flush(write)
+        self._pending = elem
+
+    def flush(self, write):
+        if self._pending is None:
+            return
+        elem, self._pending = self._pending, None
+
+        elem.attrib = self.cleangroup(elem.attrib, [c.tag for c in elem])
+
+        children = [self.cleanelement(c) for c in elem]
+        if self.merge:
+            children = self.mergepaths(children, elem.get('fill'))
+
+        write('<g{}>\n'.format(_attributes(elem.attrib)))
+        for c in children:
+            write(self.serialise(c))
+        write('</g>\n')
+
+    def cleangroup(self, attrib, childtags):
+        attrib = dict(attrib)
+
+        # remove default value
+        # TODO problems if nested withon an opacity!=1 ?
+        if attrib.get('fill-opacity', '') == '1':
+            del attrib['fill-opacity']
+
+        # remove font attributes from groups that have only paths or images
+        # and line attributes (and font since in text) from only text groups
+        onlypath = True
+        onlytext = True
+        for tag in childtags:
+            if tag not in PATHTAGS:
+                onlypath = False
+            elif tag not in TEXTTAGS:
+                onlytext = False
+        if onlypath:
+            for a in FONTATTRIBUTES:
+                attrib.pop(a, None)
+        if onlytext:
+            for a in TEXTONLYSTRIP:
+                attrib.pop(a, None)
+
+        return attrib
+
+    def cleanelement(self, elem):
+        if elem.tag == SVGNS+'path':
+            d = elem.get('d')
+            if d is not None:
+                elem.set('d', self.roundpath(d))
+            # remove default values
+            if elem.get('vector-effect', '') == 'none':
+                del elem.attrib['vector-effect']
+
+        elif elem.tag == SVGNS+'text' and elem.text in self.links:
+            link = self.links[elem.text]
+            url = link['url']
+
+            # convert .nex to .svg
+            basename, ext = os.path.splitext(url)
+            if ext == '.nex':
+                url = basename+'.svg'
+
+            a = et.Element('a', {XLINKNS+'href': url, 'fill': 'blue'})
+            a.text = link['text']
+            elem.text = ''
+            elem.insert(0, a)
+
+        return elem
+
+    def mergepaths(self, children, fill):
+        '''
+        Join runs of paths with the same attributes. Only unfilled paths, as
+        overlapping filled subpaths would change the fill.
+        '''
+        merged = []
+        for c in children:
+            if c.tag == SVGNS+'path' and c.get('fill', fill) == 'none' and len(c) == 0 \
+               and len(merged) > 0 and merged[-1].tag == c.tag and len(merged[-1]) == 0:
+                last = merged[-1]
+                a = {k: v for k, v in c.attrib.items() if k != 'd'}
+                b = {k: v for k, v in last.attrib.items() if k != 'd'}
+                if a == b:
+                    last.set('d', last.get('d', '')+' '+c.get('d', ''))
+                    continue
+            merged.append(c)
+        return merged
+
+    def serialise(self, elem):
+        parts = []
+
+        def add(e, tail=True):
+            parts.append('<{}{}'.format(_name(e.tag), _attributes(e.attrib)))
+            if len(e) == 0 and not e.text:
+                parts.append('/>')
+            else:
+                parts.append('>')
+                if e.text:
+                    parts.append(escape(e.text))
+                for c in e:
+                    add(c)
+                parts.append('</{}>'.format(_name(e.tag)))
+            if tail and e.tail:
+                parts.append(escape(e.tail))
+
+        add(elem, tail=False)
+        parts.append('\n')
+        return ''.join(parts)
@@ -0,0 +1,475 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Tiled web export.
+
+Large maps are too much for a browser as a single SVG. Instead the scene is
+rendered to a pyramid of PNG tiles, as for online maps:
+
+    map-tiles/index.html
+    map-tiles/tiles/<level>/<x>_<y>.png
+
+Level 0 holds the whole map in one tile, each level after that doubles the
+resolution up to the full size at the last level. The viewer page only
+fetches the tiles covering the window at the level closest to the current
+zoom, so it opens straight away whatever the size of the map. Views are
+included as navigation targets in presentation order.
+
+Only the last level is rendered from the scene, the others are built by
+scaling down the level above. Empty tiles aren't written.
+'''
+
+from pathlib import Path
+from math import ceil, log2, hypot
+import html, json, logging
+
+from PyQt6 import QtCore, QtGui
+
+TILESIZE = 256
+
+# tiles rendered from the scene in one go along each side
+CHUNK = 8
+
+# largest side of the last level in pixels, the scale is lowered to fit
+MAXSIDE = 65536
+
+
+def pyramid_levels(width, height, tilesize=TILESIZE):
+    '''
+    Number of levels needed for level 0 to fit width x height in one tile
+    '''
+    return max(0, ceil(log2(max(width, height, 1)/tilesize)))+1
+
+
+def view_scale(views, width=1920):
+    '''
+    Pixels per scene unit needed to show the closest of the views (a list of
+    (left, right) sides) width pixels across at full resolution
+    '''
+    scales = [width/hypot(right[0]-left[0], right[1]-left[1]) for left, right in views if left != right]
+    return max(scales, default=1.0)
+
+
+def tile_path(directory, level, x, y):
+    return Path(directory).joinpath('tiles', str(level), '{}_{}.png'.format(x, y))
+
+
+def occupied_tiles(scene, rect, span):
+    '''
+    Set of (x, y) of the tiles of size span (in scene units) from the top
+    left of rect that have something drawn in them. Looking at every item
+    once is a lot quicker than asking the scene for the items in each tile.
+    '''
+    occupied = set()
+    for item in scene.items():
+        if not item.isVisible():
+            continue
+        r = item.sceneBoundingRect()
+        if r.isEmpty():
+            continue
+        x0 = max(0, int((r.left()-rect.left())//span))
+        y0 = max(0, int((r.top()-rect.top())//span))
+        x1 = int((r.right()-rect.left())//span)
+        y1 = int((r.bottom()-rect.top())//span)
+        for y in range(y0, y1+1):
+            for x in range(x0, x1+1):
+                occupied.add((x, y))
+
+    return occupied
+
+
+def render_top_level(scene, rect, directory, level, scale, tilesize=TILESIZE, progress=None):
+    '''
+    Render the scene in rect at scale pixels per scene unit to the tiles of
+    the last level. Returns set of (x, y) of the tiles written.
+    '''
+    nx = max(1, ceil(rect.width()*scale/tilesize))
+    ny = max(1, ceil(rect.height()*scale/tilesize))
+    span = tilesize/scale
+    occupied = occupied_tiles(scene, rect, span)
+    written = set()
+
+    chunks = [(cx, cy) for cy in range(0, ny, CHUNK) for cx in range(0, nx, CHUNK)]
+    for ii, (cx, cy) in enumerate(chunks):
+        if progress is not None and progress(ii, len(chunks)) is False:
+            break
+
+        w = min(CHUNK, nx-cx)
+        h = min(CHUNK, ny-cy)
+        todo = [(tx, ty) for ty in range(h) for tx in range(w) if (cx+tx, cy+ty) in occupied]
+        if len(todo) == 0:
+            continue
+
+        source = QtCore.QRectF(rect.left()+cx*span, rect.top()+cy*span, w*span, h*span)
+        image = QtGui.QImage(w*tilesize, h*tilesize, QtGui.QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.GlobalColor.transparent)
+        painter = QtGui.QPainter(image)
+        painter.setRenderHints(QtGui.QPainter.RenderHint.Antialiasing |
+                               QtGui.QPainter.RenderHint.TextAntialiasing |
+                               QtGui.QPainter.RenderHint.SmoothPixmapTransform)
+        scene.render(painter, QtCore.QRectF(image.rect()), source)
+        painter.end()
+
+        for tx, ty in todo:
+            tile = image.copy(tx*tilesize, ty*tilesize, tilesize, tilesize)
+            tile.save(str(tile_path(directory, level, cx+tx, cy+ty)))
+            written.add((cx+tx, cy+ty))
+
+    return written
+
+
+def reduce_level(directory, level, children, tilesize=TILESIZE):
+    '''
+    Build the tiles of level from the (x, y) children tiles of level+1.
+    Returns set of (x, y) of the tiles written.
+    '''
+    parents = {(x//2, y//2) for x, y in children}
+    for px, py in parents:
+        image = QtGui.QImage(2*tilesize, 2*tilesize, QtGui.QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.GlobalColor.transparent)
+        painter = QtGui.QPainter(image)
+        for dx in range(2):
+            for dy in range(2):
+                if (2*px+dx, 2*py+dy) in children:
+                    child = QtGui.QImage(str(tile_path(directory, level+1, 2*px+dx, 2*py+dy)))
+                    painter.drawImage(dx*tilesize, dy*tilesize, child)
+        painter.end()
+
+        tile = image.scaled(tilesize, tilesize,
+                            QtCore.Qt.AspectRatioMode.IgnoreAspectRatio,
+                            QtCore.Qt.TransformationMode.SmoothTransformation)
+        tile.save(str(tile_path(directory, level, px, py)))
+
+    return parents
+
+
+def export_tiles(scene, directory, views=(), scale=None, tilesize=TILESIZE, margin=10, progress=None, screenwidth=1920):
+    '''
+    Write the tile pyramid and viewer page for scene to directory.
+
+    scale is the number of pixels per scene unit at the last level, views a
+    list of (left, right) sides in presentation order. By default the scale
+    is enough for the closest view to be sharp on a screen screenwidth pixels
+    wide (and at least 1), up to MAXSIDE pixels for the whole map. progress
+    is an optional callable(done, total) returning False to abort. Returns
+    the path of the viewer page.
+    '''
+    directory = Path(directory)
+
+    # Remove background and selection so they don't appear in the tiles
+    backgroundbrush = scene.backgroundBrush()
+    scene.setBackgroundBrush(QtGui.QBrush())
+    scene.clearSelection()
+
+    hiddenstems = []
+    rect = QtCore.QRectF()
+    for child in scene.allChildStems():
+        if 'hide' in child.getTags() and child.isVisible():
+            child.hide()
+            hiddenstems.append(child)
+    for child in scene.allChildStems():
+        if child.isVisible():
+            rect = rect.united(child.sceneBoundingRect())
+    rect.adjust(-margin, -margin, margin, margin)
+
+    if scale is None:
+        scale = max(1.0, view_scale(views, screenwidth))
+        if max(rect.width(), rect.height())*scale > MAXSIDE:
+            scale = MAXSIDE/max(rect.width(), rect.height())
+            logging.warning("Tiles limited to %d pixels across, the closest views will be blurred", MAXSIDE)
+
+    width = ceil(rect.width()*scale)
+    height = ceil(rect.height()*scale)
+    levels = pyramid_levels(width, height, tilesize)
+    # clear out tiles of a previous export
+    for old in directory.glob('tiles/*/*.png'):
+        old.unlink()
+    for level in range(levels):
+        tile_path(directory, level, 0, 0).parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        logging.info("Rendering %d x %d map to %d tile levels", width, height, levels)
+        written = render_top_level(scene, rect, directory, levels-1, scale, tilesize, progress)
+        for level in range(levels-2, -1, -1):
+            written = reduce_level(directory, level, written, tilesize)
+    finally:
+        for child in hiddenstems:
+            child.show()
+        scene.setBackgroundBrush(backgroundbrush)
+
+    def topixels(point):
+        return [round((point[0]-rect.left())*scale, 2), round((point[1]-rect.top())*scale, 2)]
+
+    try:
+        title = scene.root().titles()[0]
+    except (AttributeError, IndexError):
+        title = directory.stem
+
+    info = {
+        'width': width,
+        'height': height,
+        'levels': levels,
+        'tilesize': tilesize,
+        'views': [[topixels(left), topixels(right)] for left, right in views],
+    }
+
+    page = directory.joinpath('index.html')
+    with open(page, 'w', encoding='utf-8') as fp:
+        fp.write(VIEWER.replace('@TITLE@', html.escape(title))
+                       .replace('@INFO@', json.dumps(info)))
+
+    return page
+
+
+# The viewer page. Positions are in pixels of the last level, the tile layer
+# is transformed to the screen with a CSS transform and the tiles of the
+# level nearest the current zoom (and the one below as a backdrop while
+# they load) are kept in the page.
+VIEWER = r'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1, user-scalable=no">
+<title>@TITLE@</title>
+<style>
+html, body {margin: 0; height: 100%; overflow: hidden; background: white; font-family: sans-serif;}
+#map {position: absolute; inset: 0; overflow: hidden; touch-action: none; cursor: grab;}
+#layer {position: absolute; left: 0; top: 0; transform-origin: 0 0;}
+#layer img {position: absolute; user-select: none; -webkit-user-drag: none;}
+#nav {position: absolute; right: 10px; bottom: 10px; background: rgba(255,255,255,0.8);
+      border-radius: 4px; padding: 4px; font-size: 14px;}
+#nav button {font-size: 14px; min-width: 2em;}
+</style>
+</head>
+<body>
+<div id="map"><div id="layer"></div></div>
+<div id="nav">
+<button id="prev" title="Previous view (left arrow)">&lsaquo;</button>
+<span id="count"></span>
+<button id="next" title="Next view (right arrow)">&rsaquo;</button>
+<button id="all" title="Whole map (0)">&#9633;</button>
+</div>
+<script>
+var NEXUS = @INFO@;
+(function() {
+    var map = document.getElementById("map");
+    var layer = document.getElementById("layer");
+    var T = NEXUS.tilesize, top = NEXUS.levels-1;
+    var state = {x: NEXUS.width/2, y: NEXUS.height/2, zoom: 1, angle: 0};
+    var tiles = {};
+    var missing = {};
+    var current = -1;
+    var animation = null;
+
+    function size() {
+        return [map.clientWidth, map.clientHeight];
+    }
+
+    function fitAll() {
+        var s = size();
+        return {x: NEXUS.width/2, y: NEXUS.height/2, angle: 0,
+                zoom: Math.min(1, 0.9*Math.min(s[0]/NEXUS.width, s[1]/NEXUS.height))};
+    }
+
+    function fitView(view) {
+        var l = view[0], r = view[1];
+        var dx = r[0]-l[0], dy = r[1]-l[1];
+        return {x: (l[0]+r[0])/2, y: (l[1]+r[1])/2, angle: Math.atan2(dy, dx),
+                zoom: size()[0]/Math.sqrt(dx*dx+dy*dy)};
+    }
+
+    // screen point to map pixels
+    function toMap(sx, sy) {
+        var s = size(), c = Math.cos(state.angle), n = Math.sin(state.angle);
+        var u = (sx-s[0]/2)/state.zoom, v = (sy-s[1]/2)/state.zoom;
+        return [state.x+c*u-n*v, state.y+n*u+c*v];
+    }
+
+    function visible(level) {
+        var s = size();
+        var corners = [toMap(0, 0), toMap(s[0], 0), toMap(0, s[1]), toMap(s[0], s[1])];
+        var xs = corners.map(function(p) {return p[0];});
+        var ys = corners.map(function(p) {return p[1];});
+        var span = T*Math.pow(2, top-level);
+        var nx = Math.ceil(NEXUS.width/span), ny = Math.ceil(NEXUS.height/span);
+        return [Math.max(0, Math.floor(Math.min.apply(null, xs)/span)),
+                Math.max(0, Math.floor(Math.min.apply(null, ys)/span)),
+                Math.min(nx-1, Math.floor(Math.max.apply(null, xs)/span)),
+                Math.min(ny-1, Math.floor(Math.max.apply(null, ys)/span))];
+    }
+
+    function addTiles(level, keep) {
+        var r = visible(level), span = T*Math.pow(2, top-level);
+        for (var y = r[1]; y <= r[3]; y++) {
+            for (var x = r[0]; x <= r[2]; x++) {
+                var key = level+"/"+x+"_"+y;
+                if (missing[key]) continue;
+                keep[key] = true;
+                if (tiles[key]) continue;
+                var img = document.createElement("img");
+                img.style.left = x*span+"px";
+                img.style.top = y*span+"px";
+                img.style.width = img.style.height = span+"px";
+                img.style.zIndex = level;
+                img.onerror = (function(key) {
+                    return function() {missing[key] = true; this.remove(); delete tiles[key];};
+                })(key);
+                img.src = "tiles/"+key+".png";
+                tiles[key] = img;
+                layer.appendChild(img);
+            }
+        }
+    }
+
+    function update() {
+        var s = size();
+        layer.style.transform = "translate("+s[0]/2+"px,"+s[1]/2+"px) rotate("+(-state.angle)+"rad) " +
+            "scale("+state.zoom+") translate("+(-state.x)+"px,"+(-state.y)+"px)";
+
+        var level = Math.max(0, Math.min(top, Math.round(top+Math.log2(state.zoom))));
+        var keep = {};
+        addTiles(level, keep);
+        if (level > 0) addTiles(level-1, keep);
+        for (var key in tiles) {
+            if (!keep[key]) {
+                tiles[key].remove();
+                delete tiles[key];
+            }
+        }
+    }
+
+    function go(target, duration) {
+        if (animation) cancelAnimationFrame(animation);
+        var start = {x: state.x, y: state.y, zoom: state.zoom, angle: state.angle};
+        var da = target.angle-start.angle;
+        da = Math.atan2(Math.sin(da), Math.cos(da));
+        var t0 = null;
+        function step(t) {
+            if (t0 === null) t0 = t;
+            var f = duration > 0 ? Math.min(1, (t-t0)/duration) : 1;
+            f = f*f*(3-2*f);
+            state.x = start.x+(target.x-start.x)*f;
+            state.y = start.y+(target.y-start.y)*f;
+            state.zoom = Math.exp(Math.log(start.zoom)+(Math.log(target.zoom)-Math.log(start.zoom))*f);
+            state.angle = start.angle+da*f;
+            update();
+            animation = f < 1 ? requestAnimationFrame(step) : null;
+        }
+        animation = requestAnimationFrame(step);
+    }
+
+    function showView(n) {
+        if (NEXUS.views.length == 0) return;
+        current = Math.max(0, Math.min(NEXUS.views.length-1, n));
+        document.getElementById("count").textContent = (current+1)+" / "+NEXUS.views.length;
+        history.replaceState(null, "", "#"+(current+1));
+        go(fitView(NEXUS.views[current]), 800);
+    }
+
+    function showAll() {
+        current = -1;
+        document.getElementById("count").textContent = NEXUS.views.length > 0 ? "- / "+NEXUS.views.length : "";
+        history.replaceState(null, "", "#");
+        go(fitAll(), 800);
+    }
+
+    function zoomAt(factor, sx, sy) {
+        var p = toMap(sx, sy);
+        state.zoom = Math.max(0.5/Math.pow(2, top), Math.min(8, state.zoom*factor));
+        var q = toMap(sx, sy);
+        state.x += p[0]-q[0];
+        state.y += p[1]-q[1];
+        update();
+    }
+
+    function panBy(dx, dy) {
+        var c = Math.cos(state.angle), n = Math.sin(state.angle);
+        state.x -= (c*dx-n*dy)/state.zoom;
+        state.y -= (n*dx+c*dy)/state.zoom;
+        update();
+    }
+
+    map.addEventListener("wheel", function(e) {
+        e.preventDefault();
+        if (animation) {cancelAnimationFrame(animation); animation = null;}
+        if (e.ctrlKey) zoomAt(Math.exp(-e.deltaY*0.008), e.clientX, e.clientY);
+        else panBy(-e.deltaX, -e.deltaY);
+    }, {passive: false});
+
+    var pointers = {}, pinch = null;
+    map.addEventListener("pointerdown", function(e) {
+        if (animation) {cancelAnimationFrame(animation); animation = null;}
+        map.setPointerCapture(e.pointerId);
+        pointers[e.pointerId] = [e.clientX, e.clientY];
+        pinch = null;
+    });
+    map.addEventListener("pointermove", function(e) {
+        if (!(e.pointerId in pointers)) return;
+        var ids = Object.keys(pointers);
+        if (ids.length == 1) {
+            panBy(e.clientX-pointers[e.pointerId][0], e.clientY-pointers[e.pointerId][1]);
+        } else if (ids.length == 2) {
+            pointers[e.pointerId] = [e.clientX, e.clientY];
+            var a = pointers[ids[0]], b = pointers[ids[1]];
+            var d = Math.hypot(b[0]-a[0], b[1]-a[1]), m = [(a[0]+b[0])/2, (a[1]+b[1])/2];
+            if (pinch) {
+                panBy(m[0]-pinch.m[0], m[1]-pinch.m[1]);
+                zoomAt(d/pinch.d, m[0], m[1]);
+            }
+            pinch = {d: d, m: m};
+        }
+        pointers[e.pointerId] = [e.clientX, e.clientY];
+    });
+    function release(e) {
+        delete pointers[e.pointerId];
+        pinch = null;
+    }
+    map.addEventListener("pointerup", release);
+    map.addEventListener("pointercancel", release);
+
+    document.addEventListener("keydown", function(e) {
+        if (e.key == "ArrowRight" || e.key == "PageDown" || e.key == " ") showView(current+1);
+        else if (e.key == "ArrowLeft" || e.key == "PageUp") showView(current-1);
+        else if (e.key == "0" || e.key == "Escape") showAll();
+        else if (e.key == "+" || e.key == "=") zoomAt(1.25, size()[0]/2, size()[1]/2);
+        else if (e.key == "-") zoomAt(0.8, size()[0]/2, size()[1]/2);
+        else return;
+        e.preventDefault();
+    });
+    document.getElementById("next").onclick = function() {showView(current+1);};
+    document.getElementById("prev").onclick = function() {showView(current-1);};
+    document.getElementById("all").onclick = showAll;
+    if (NEXUS.views.length == 0) document.getElementById("nav").style.display = "none";
+    window.addEventListener("resize", update);
+
+    var n = parseInt(location.hash.slice(1));
+    var target = n > 0 && n <= NEXUS.views.length ? fitView(NEXUS.views[n-1]) : fitAll();
+    state = target;
+    if (n > 0 && n <= NEXUS.views.length) {
+        current = n-1;
+        document.getElementById("count").textContent = n+" / "+NEXUS.views.length;
+    } else {
+        document.getElementById("count").textContent = "- / "+NEXUS.views.length;
+    }
+    update();
+})();
+</script>
+</body>
+</html>
+'''
@@ -17,11 +17,25 @@
 ## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
 
 import time
+from pathlib import Path
 from PyQt6 import QtCore, QtGui, QtWidgets
 
-from . import resources
 import logging
 
+def registerResources():
+    '''
+    Register the icons and fonts under ":/". The compiled resources.rcc is memory
+    mapped by Qt, the much slower to import resources.py is only a fallback.
+    '''
+    rcc = Path(__file__).with_name('resources.rcc')
+    if rcc.exists() and QtCore.QResource.registerResource(rcc.as_posix()):
+        return
+
+    logging.debug("No %s, falling back to resources.py", rcc)
+    from . import resources
+
+registerResources()
+
 DEFAULTpencols = [
     ['#FFE53935', '#FFD81A60', '#FF8E24AA', '#FF5E34B1', '#FF3949AB'],
     ['#FF1F88E5', '#FF049BE5', '#FF00ACC2', '#FF01897B', '#FF43A047'],
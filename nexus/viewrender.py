@@ -0,0 +1,223 @@
+##
+## Copyright 2010-2025 Alexei Gilchrist
+##
+## This file is part of Nexus.
+##
+## Nexus is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Nexus is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Rendering views (keyframes) of a scene to pages.
+
+Shared by printing and the batch exporter:
+
+- view_transform() maps the scene to a page so a view's sides span its width
+- hide_outside() culls the stems a page doesn't need with one spatial query
+- ImageDownsampler swaps in one scaled down pixmap per image (by sha1) for
+  the whole document, so images are embedded once at the resolution the
+  pages need rather than once per item at full size
+'''
+
+from math import atan2, sqrt
+import logging
+
+from PyQt6 import QtCore, QtGui
+
+from . import graphics
+
+RENDERHINTS = QtGui.QPainter.RenderHint.Antialiasing | \
+              QtGui.QPainter.RenderHint.TextAntialiasing | \
+              QtGui.QPainter.RenderHint.SmoothPixmapTransform
+
+# resolution images are kept at when printing
+IMAGEDPI = 150
+
+
+def map_rect(scene, margin=10):
+    '''
+    Bounding rect of the visible stems
+    '''
+    rect = QtCore.QRectF()
+    for item in scene.allChildStems():
+        if item.isVisible():
+            rect = rect.united(item.sceneBoundingRect())
+
+    return rect.adjusted(-margin, -margin, margin, margin)
+
+
+def view_transform(left, right, width, height):
+    '''
+    Transform taking the scene to a width x height target showing the view with
+    the given sides, as in presentation mode the sides span the full width.
+    '''
+    cx = (left[0]+right[0])/2
+    cy = (left[1]+right[1])/2
+    scale = width/sqrt((right[0]-left[0])**2+(right[1]-left[1])**2)
+    angle = atan2(right[1]-left[1], right[0]-left[0])
+
+    T = QtGui.QTransform()
+    T.translate(width/2, height/2)
+    T.scale(scale, scale)
+    T.rotateRadians(-angle)
+    T.translate(-cx, -cy)
+    return T
+
+
+def map_transform(scene, width, height):
+    '''
+    Transform fitting the whole map centred in a width x height target
+    '''
+    rect = map_rect(scene)
+    scale = min(width/rect.width(), height/rect.height())
+
+    T = QtGui.QTransform()
+    T.translate(width/2, height/2)
+    T.scale(scale, scale)
+    T.translate(-rect.center().x(), -rect.center().y())
+    return T
+
+
+def owning_stem(item):
+    while item is not None and not isinstance(item, graphics.StemItem):
+        item = item.parentItem()
+    return item
+
+
+def hide_outside(scene, polygon):
+    '''
+    Hide the visible stems that scene.render would draw for the bounding
+    rect of polygon (in scene coordinates) but that don't show in polygon
+    itself. Returns the list of hidden stems to show again afterwards.
+
+    A stem's own path from its parent is one of its child items, so the
+    query also keeps stems just passing through. Only stems around the
+    polygon are touched, not every stem in the map.
+    '''
+    mode = QtCore.Qt.ItemSelectionMode.IntersectsItemBoundingRect
+
+    inview = set()
+    for item in scene.items(polygon, mode):
+        stem = owning_stem(item)
+        if stem is None or stem in inview:
+            continue
+        inview.add(stem)
+        # if parents hide so do the children
+        inview.update(stem.allParentStems())
+
+    hidden = []
+    for item in scene.items(polygon.boundingRect(), mode):
+        stem = owning_stem(item)
+        if stem is None or stem in inview or not stem.isVisible():
+            continue
+        stem.hide()
+        hidden.append(stem)
+
+    return hidden
+
+
+def render_page(scene, painter, T, width, height):
+    '''
+    Render the scene through transform T to a width x height page, culling
+    stems outside it
+    '''
+    painter.setRenderHints(RENDERHINTS)
+    target = QtCore.QRectF(0, 0, width, height)
+    polygon = T.inverted()[0].map(QtGui.QPolygonF(target))
+    source = polygon.boundingRect()
+
+    hidden = hide_outside(scene, polygon)
+    painter.save()
+    painter.setClipRect(target)
+    painter.setTransform(T, True)
+    # identical source and target so scene.render adds no scaling of its own
+    scene.render(painter, source, source)
+    painter.restore()
+
+    for stem in hidden:
+        stem.show()
+
+
+#----------------------------------------------------------------------
+class ImageDownsampler:
+#----------------------------------------------------------------------
+    '''
+    Replace the pixmaps of image items by scaled down copies, one per image
+    shared by all the items showing it.
+
+        images = ImageDownsampler(scene)
+        for T in pages:
+            images.need(T, width, height)
+        images.apply()
+        ... render pages ...
+        images.restore()
+
+    need() records the largest size each image is drawn at on the pages.
+    '''
+
+    def __init__(self, scene, oversample=1.0):
+        self.scene = scene
+        self.oversample = oversample
+        self.items = [item for item in scene.items() if isinstance(item, graphics.PixmapItem)
+                      and not item.pixmap().isNull()]
+        self.scales = {}
+        self.saved = []
+
+    def need(self, T, width, height):
+        '''
+        Note the images drawn through transform T on a width x height page
+        '''
+        if len(self.items) == 0:
+            return
+
+        target = QtCore.QRectF(0, 0, width, height)
+        polygon = T.inverted()[0].map(QtGui.QPolygonF(target))
+        for item in self.items:
+            if not item.isVisible() or not polygon.boundingRect().intersects(item.sceneBoundingRect()):
+                continue
+            # device pixels per image pixel
+            M = item.sceneTransform()*T
+            scale = sqrt(abs(M.determinant()))*self.oversample
+            key = item['sha1']
+            self.scales[key] = max(self.scales.get(key, 0), scale)
+
+    def apply(self):
+        '''
+        Swap in the scaled images, compensating the item transforms
+        '''
+        scaled = {}
+        for item in self.items:
+            key = item['sha1']
+            original = item.pixmap()
+
+            if key not in scaled:
+                scale = min(1.0, self.scales.get(key, 1.0))
+                width = max(1, round(original.width()*scale))
+                if width >= original.width():
+                    scaled[key] = original
+                else:
+                    scaled[key] = original.scaledToWidth(width, QtCore.Qt.TransformationMode.SmoothTransformation)
+                    logging.debug("Image %s downsampled from %d to %d pixels wide", key, original.width(), width)
+
+            pixmap = scaled[key]
+            self.saved.append((item, original, item.transform(), item.transformationMode()))
+            f = original.width()/pixmap.width()
+            item.setPixmap(pixmap)
+            item.setTransform(QtGui.QTransform.fromScale(f, f)*item.transform())
+            item.setTransformationMode(QtCore.Qt.TransformationMode.SmoothTransformation)
+
+    def restore(self):
+        for item, pixmap, T, mode in self.saved:
+            item.setPixmap(pixmap)
+            item.setTransform(T)
+            item.setTransformationMode(mode)
+        self.saved = []
@@ -18,12 +18,42 @@
 # along with Nexus.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys,  time
+STARTTIME = time.perf_counter()
 from PyQt6 import QtCore, QtGui, QtWidgets
+QTTIME = time.perf_counter()
 
 from nexus.mainwindow import MainWindow, NexusApplication, NewOrOpenDialog
 from pathlib import Path
 from nexus.graphics import VERSION
 import logging
+IMPORTTIME = time.perf_counter()
+
+
+class StartupProfiler(QtCore.QObject):
+    '''
+    Log how long the stages of starting up take, enabled with --profile-startup.
+    For a per module breakdown of the imports run with "python -X importtime".
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.marks = [('Qt import', QTTIME), ('Nexus import', IMPORTTIME)]
+
+    def mark(self, label):
+        self.marks.append((label, time.perf_counter()))
+
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Type.Paint:
+            self.mark('first paint')
+            QtWidgets.QApplication.instance().removeEventFilter(self)
+            self.report()
+        return False
+
+    def report(self):
+        last = STARTTIME
+        for label, t in self.marks:
+            logging.info("Startup: %-14s %8.1f ms (total %8.1f ms)", label, 1000*(t-last), 1000*(t-STARTTIME))
+            last = t
 
 # import cProfile
 
@@ -33,8 +63,23 @@ import logging
 #     QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps, True)
 
 if __name__ == "__main__":
+    profiler = None
+    if '--profile-startup' in sys.argv:
+        sys.argv.remove('--profile-startup')
+        profiler = StartupProfiler()
+
+    if '--profile' in sys.argv:
+        # Record timings from the start, see View > Profiler
+        sys.argv.remove('--profile')
+        from nexus import instrument
+        instrument.enable()
+
     app = NexusApplication()
 
+    if profiler is not None:
+        profiler.mark('application')
+        app.installEventFilter(profiler)
+
     # app.processEvents()
 
     validfiles = []
@@ -53,5 +98,8 @@ if __name__ == "__main__":
         d.show()
         # d.activateWindow()
 
+    if profiler is not None:
+        profiler.mark('windows')
+
     # cProfile.run('app.exec_()','stats')
     app.exec()